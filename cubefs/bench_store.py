@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Store bench results as mergeable latency histograms and gate changes on them.
+
+Every run keeps its latency distribution as an HDR-style histogram (log2 buckets split into linear
+sub-buckets, ~3% relative error) plus its qps and throughput. Histograms of iterations and runs merge by
+adding bucket counts, so no raw samples are kept. A candidate is compared with a saved baseline using a
+one-sided Mann-Whitney U test over the per-run p99 and throughput, and the exit code is 1 on regression.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_STORE = "bench-store"
+# percentiles parsed by run_bench.py, with the share of requests at or below them
+PERCENTILE_KEYS = [("lat_min_us", 0.0), ("lat_p50_us", 0.50), ("lat_p90_us", 0.90), ("lat_p95_us", 0.95),
+                   ("lat_p99_us", 0.99), ("lat_p999_us", 0.999), ("lat_max_us", 1.0)]
+
+class LogHistogram:
+    """Sparse histogram of microsecond latencies in log2 buckets of SUB_BUCKETS linear sub-buckets"""
+
+    SUB_BUCKETS = 32
+
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+
+    @staticmethod
+    def index(value: float) -> int:
+        if value < 1:
+            return 0
+        mantissa, exponent = math.frexp(value)
+        # mantissa is in [0.5, 1), exponent - 1 is floor(log2(value))
+        sub = int((mantissa * 2 - 1) * LogHistogram.SUB_BUCKETS)
+        return (exponent - 1) * LogHistogram.SUB_BUCKETS + sub + 1
+
+    @staticmethod
+    def bounds(index: int) -> Tuple[float, float]:
+        if index == 0:
+            return 0.0, 1.0
+        exponent, sub = divmod(index - 1, LogHistogram.SUB_BUCKETS)
+        low = 2.0 ** exponent
+        step = low / LogHistogram.SUB_BUCKETS
+        return low + sub * step, low + (sub + 1) * step
+
+    def record(self, value: float, count: int = 1) -> None:
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+
+    def record_samples(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.record(value)
+
+    def record_percentiles(self, points: List[Tuple[float, float]], count: int) -> None:
+        """
+        Fill the histogram from (share, latency) points such as min/p50/p99/max when the raw samples are
+        not available, spreading each slice of requests evenly in log space between its two latencies.
+        """
+        points = sorted((share, value) for share, value in points if value > 0)
+        if not points or count <= 0:
+            return
+        if points[0][0] > 0:
+            points.insert(0, (0.0, points[0][1]))
+        if points[-1][0] < 1:
+            points.append((1.0, points[-1][1]))
+        recorded = 0
+        for (share_low, low), (share_high, high) in zip(points, points[1:]):
+            slice_count = round(count * share_high) - round(count * share_low)
+            if slice_count <= 0:
+                continue
+            low, high = min(low, high), max(low, high)
+            first, last = self.index(low), self.index(high)
+            buckets = last - first + 1
+            for n, index in enumerate(range(first, last + 1)):
+                share = slice_count * (n + 1) // buckets - slice_count * n // buckets
+                if share:
+                    self.counts[index] = self.counts.get(index, 0) + share
+            recorded += slice_count
+        self.total += recorded
+
+    def merge(self, other: "LogHistogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+
+    def percentile(self, share: float) -> Optional[float]:
+        if self.total == 0:
+            return None
+        target = max(1, math.ceil(share * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low, high = self.bounds(index)
+                return (low + high) / 2
+        return self.bounds(max(self.counts))[1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        indexes = sorted(self.counts)
+        return {"sub_buckets": self.SUB_BUCKETS, "index": indexes, "count": [self.counts[i] for i in indexes]}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "LogHistogram":
+        if data.get("sub_buckets", LogHistogram.SUB_BUCKETS) != LogHistogram.SUB_BUCKETS:
+            raise ValueError(f"histogram has {data['sub_buckets']} sub buckets, expected {LogHistogram.SUB_BUCKETS}")
+        histogram = LogHistogram()
+        for index, count in zip(data["index"], data["count"]):
+            histogram.counts[int(index)] = histogram.counts.get(int(index), 0) + int(count)
+            histogram.total += int(count)
+        return histogram
+
+class RunResult:
+    """One bench run: its latency histogram, qps and throughput"""
+
+    def __init__(self, run_id: str, histogram: LogHistogram, qps: Optional[float],
+                 throughput_mb: Optional[float], params: Optional[Dict[str, Any]] = None) -> None:
+        self.run_id = run_id
+        self.histogram = histogram
+        self.qps = qps
+        self.throughput_mb = throughput_mb
+        self.params = params or {}
+
+    @staticmethod
+    def from_bench_record(record: Dict[str, Any]) -> "RunResult":
+        """Build from a results.jsonl record of run_bench.py, from raw samples when given, else from percentiles"""
+        metrics = record.get("metrics", {})
+        if "histogram" in record:
+            histogram = LogHistogram.from_dict(record["histogram"])
+        else:
+            histogram = LogHistogram()
+            points = [(share, metrics[key]) for key, share in PERCENTILE_KEYS if key in metrics]
+            count = int(metrics.get("success") or 0) or int(metrics.get("qps", 0) * record.get("wall_sec", 0)) or 10000
+            histogram.record_percentiles(points, count)
+        params = {key: record[key] for key in ("mode", "size", "threads", "session") if key in record}
+        return RunResult(record["run_id"], histogram, metrics.get("qps"), metrics.get("throughput_mb"), params)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"run_id": self.run_id, "qps": self.qps, "throughput_mb": self.throughput_mb,
+                "params": self.params, "histogram": self.histogram.to_dict()}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "RunResult":
+        return RunResult(data["run_id"], LogHistogram.from_dict(data["histogram"]), data.get("qps"),
+                         data.get("throughput_mb"), data.get("params"))
+
+class ResultStore:
+    """Named result sets saved as <store>/<name>.json"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    def load(self, name: str) -> List[RunResult]:
+        try:
+            with open(self.file(name), "r") as f:
+                return [RunResult.from_dict(run) for run in json.load(f)["runs"]]
+        except FileNotFoundError:
+            print(f"Error: no result set named {name} in {self.path}")
+            sys.exit(1)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: failed to load {self.file(name)}: {e}")
+            sys.exit(1)
+
+    def save(self, name: str, runs: List[RunResult], append: bool = False) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        if append and os.path.exists(self.file(name)):
+            known = {run.run_id for run in runs}
+            runs = [run for run in self.load(name) if run.run_id not in known] + runs
+        tmp = self.file(name) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"name": name, "runs": [run.to_dict() for run in runs]}, f)
+        os.replace(tmp, self.file(name))
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.path) if name.endswith(".json"))
+
+class Regression:
+    """Compare candidate runs with baseline runs"""
+
+    @staticmethod
+    def mann_whitney_greater(xs: List[float], ys: List[float]) -> float:
+        """One-sided p-value of xs being stochastically greater than ys, normal approximation with tie correction"""
+        n1, n2 = len(xs), len(ys)
+        values = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+        ranks = [0.0] * len(values)
+        ties = 0.0
+        i = 0
+        while i < len(values):
+            j = i
+            while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+                j += 1
+            for k in range(i, j + 1):
+                ranks[k] = (i + j) / 2 + 1
+            ties += (j - i + 1) ** 3 - (j - i + 1)
+            i = j + 1
+        rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+        u = rank_sum - n1 * (n1 + 1) / 2
+        n = n1 + n2
+        variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+        if variance <= 0:
+            return 0.5
+        # continuity correction
+        z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+        return 0.5 * math.erfc(z / math.sqrt(2))
+
+    @staticmethod
+    def check(name: str, baseline: List[float], candidate: List[float], threshold: float, alpha: float,
+              higher_is_worse: bool) -> Tuple[bool, str]:
+        if not baseline or not candidate:
+            return False, f"{name:<12} skipped, no values"
+        base, cand = statistics.median(baseline), statistics.median(candidate)
+        change = (cand - base) / base * 100 if base else 0.0
+        worse = change if higher_is_worse else -change
+        if len(baseline) >= 2 and len(candidate) >= 2:
+            xs, ys = (candidate, baseline) if higher_is_worse else (baseline, candidate)
+            p_value = Regression.mann_whitney_greater(xs, ys)
+            regressed = worse > threshold and p_value < alpha
+            test = f"p={p_value:.4f}"
+        else:
+            # a single run per side can't be tested, fall back to the threshold alone
+            regressed = worse > threshold
+            test = "p=n/a"
+        verdict = "REGRESSION" if regressed else "ok"
+        return regressed, f"{name:<12} baseline {base:>12.2f}  candidate {cand:>12.2f}  {change:+7.2f}%  {test:<9} {verdict}"
+
+def merged(runs: List[RunResult]) -> LogHistogram:
+    histogram = LogHistogram()
+    for run in runs:
+        histogram.merge(run.histogram)
+    return histogram
+
+def describe(name: str, runs: List[RunResult]) -> None:
+    histogram = merged(runs)
+    qps = [run.qps for run in runs if run.qps is not None]
+    throughput = [run.throughput_mb for run in runs if run.throughput_mb is not None]
+    print(f"{name}: {len(runs)} runs, {histogram.total} requests")
+    for label, share in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999), ("max", 1.0)):
+        value = histogram.percentile(share)
+        print(f"  {label:<5} {'-' if value is None else f'{value:.1f}us'}")
+    if qps:
+        print(f"  qps   median {statistics.median(qps):.2f}, min {min(qps):.2f}, max {max(qps):.2f}")
+    if throughput:
+        print(f"  MB/s  median {statistics.median(throughput):.2f}")
+
+def import_results(path: str, session: str) -> List[RunResult]:
+    try:
+        with open(path, "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError) as e:
+        print(f"Error: failed to read {path}: {e}")
+        sys.exit(1)
+    if session:
+        records = [record for record in records if record.get("session") == session]
+    return [RunResult.from_bench_record(record) for record in records
+            if record.get("exit_code", 0) == 0 and "metrics" in record]
+
+def load_samples(path: str) -> LogHistogram:
+    histogram = LogHistogram()
+    with open(path, "r") as f:
+        histogram.record_samples(float(line) for line in f if line.strip())
+    return histogram
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bench result store with mergeable latency histograms")
+    parser.add_argument("--store", default=DEFAULT_STORE, help=f"Store directory (default {DEFAULT_STORE})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="Import runs of a run_bench.py results.jsonl as a named result set")
+    p.add_argument("results", help="results.jsonl written by run_bench.py")
+    p.add_argument("--name", required=True, help="Result set name, e.g. baseline or data-qos-on")
+    p.add_argument("--session", default="", help="Only import runs of this session")
+    p.add_argument("--append", action="store_true", help="Add to an existing result set instead of replacing it")
+
+    p = sub.add_parser("add-samples", help="Add one run from a file of raw latencies in microseconds")
+    p.add_argument("samples", help="File with one latency per line")
+    p.add_argument("--name", required=True, help="Result set name")
+    p.add_argument("--run-id", required=True, help="Run id")
+    p.add_argument("--qps", type=float, help="Run qps")
+    p.add_argument("--throughput", type=float, help="Run throughput in MB/s")
+
+    p = sub.add_parser("merge", help="Merge result sets into a new one")
+    p.add_argument("sources", nargs="+", help="Result set names")
+    p.add_argument("--name", required=True, help="Name of the merged result set")
+
+    p = sub.add_parser("show", help="Print merged percentiles and throughput of result sets")
+    p.add_argument("names", nargs="*", help="Result set names, all when empty")
+
+    p = sub.add_parser("compare", help="Compare a candidate with a baseline, exit 1 on regression")
+    p.add_argument("baseline", help="Baseline result set")
+    p.add_argument("candidate", help="Candidate result set")
+    p.add_argument("--p99-threshold", type=float, default=5.0, help="Allowed p99 increase in percent (default 5)")
+    p.add_argument("--throughput-threshold", type=float, default=5.0,
+                   help="Allowed qps/throughput decrease in percent (default 5)")
+    p.add_argument("--alpha", type=float, default=0.05, help="Significance level of the test (default 0.05)")
+
+    args = parser.parse_args()
+    store = ResultStore(args.store)
+
+    if args.command == "import":
+        runs = import_results(args.results, args.session)
+        if not runs:
+            print(f"Error: no successful runs found in {args.results}")
+            sys.exit(1)
+        store.save(args.name, runs, args.append)
+        print(f"Saved {len(runs)} runs to {store.file(args.name)}")
+    elif args.command == "add-samples":
+        run = RunResult(args.run_id, load_samples(args.samples), args.qps, args.throughput)
+        store.save(args.name, [run], append=True)
+        print(f"Added run {args.run_id} with {run.histogram.total} samples to {store.file(args.name)}")
+    elif args.command == "merge":
+        runs = [run for name in args.sources for run in store.load(name)]
+        store.save(args.name, runs)
+        print(f"Saved {len(runs)} runs to {store.file(args.name)}")
+    elif args.command == "show":
+        for name in args.names or store.names():
+            describe(name, store.load(name))
+    elif args.command == "compare":
+        baseline, candidate = store.load(args.baseline), store.load(args.candidate)
+        describe(f"baseline {args.baseline}", baseline)
+        describe(f"candidate {args.candidate}", candidate)
+        base_p99, cand_p99 = merged(baseline).percentile(0.99), merged(candidate).percentile(0.99)
+        if base_p99 and cand_p99:
+            print(f"Merged p99: {base_p99:.1f}us -> {cand_p99:.1f}us ({(cand_p99 - base_p99) / base_p99 * 100:+.2f}%)")
+        checks = [
+            Regression.check("p99_us", [r.histogram.percentile(0.99) for r in baseline if r.histogram.total],
+                             [r.histogram.percentile(0.99) for r in candidate if r.histogram.total],
+                             args.p99_threshold, args.alpha, True),
+            Regression.check("qps", [r.qps for r in baseline if r.qps is not None],
+                             [r.qps for r in candidate if r.qps is not None],
+                             args.throughput_threshold, args.alpha, False),
+            Regression.check("throughput", [r.throughput_mb for r in baseline if r.throughput_mb is not None],
+                             [r.throughput_mb for r in candidate if r.throughput_mb is not None],
+                             args.throughput_threshold, args.alpha, False),
+        ]
+        for _, line in checks:
+            print(line)
+        if any(regressed for regressed, _ in checks):
+            print("Result: regression detected")
+            sys.exit(1)
+        print("Result: no regression")
+
+if __name__ == "__main__":
+    main()
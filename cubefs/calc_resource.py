@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Blobstore resource planner, a port of calc_resource.sh evaluated with NumPy over whole parameter grids.
+
+The flags and environment variables are the ones of calc_resource.sh, and a single point prints the same
+report. Any flag may take a comma separated list (e.g. --ec 6+3,8+3,12+9 --dc 16,20 --dn 32,36), then
+every combination is evaluated at once and the cheapest configurations are printed.
+
+Every formula is computed in exact integer arithmetic: the bc truncation of the script (scale=2 for the
+QPS terms, scale=20 and integer ceil/floor for the others) is reproduced with floor divisions on scaled
+integers, so results match the script digit for digit.
+"""
+import argparse
+import os
+import sys
+from fractions import Fraction
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# multiplier applied to disk capacity by the script, TB to usable TiB
+DISK_EFFICIENCY = Fraction(909, 1000)
+# bc -l keeps 20 decimal digits and truncates every division to them
+BC_SCALE = 10 ** 20
+# decimal digits kept when turning --pb/--qps/--dc/CLUSTER_THRESHOLD into exact fractions
+DECIMAL_DIGITS = 4
+SCALE = 10 ** DECIMAL_DIGITS
+
+def ceil_div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return -(-a // b)
+
+def to_fixed(value: str) -> int:
+    """Decimal string to an integer scaled by SCALE, exact for up to DECIMAL_DIGITS digits"""
+    fraction = Fraction(value) * SCALE
+    if fraction.denominator != 1:
+        raise ValueError(f"{value} has more than {DECIMAL_DIGITS} decimal digits")
+    return int(fraction)
+
+def bc_format(hundredths: int) -> str:
+    """Print a scale=2 value like bc does, without the leading zero"""
+    integer, fraction = divmod(int(hundredths), 100)
+    return f"{integer if integer else ''}.{fraction:02d}"
+
+class PlannerEnv:
+    """Constants of calc_resource.sh taken from environment variables"""
+
+    def __init__(self) -> None:
+        try:
+            self.iops_per_disk = int(os.environ.get("IOPS_PER_DISK", "100"))
+            self.iops_coefficient = int(os.environ.get("IOPS_COEFFICIENT", "512"))
+            self.blobnode_io_align = int(os.environ.get("BLOBNODE_IO_ALIGN", "4096"))
+            self.dataset_size = int(os.environ.get("DATASET_SIZE", "60"))
+            self.min_read_shard_x = int(os.environ.get("MIN_READ_SHARD_X", "1"))
+            self.cluster_threshold = os.environ.get("CLUSTER_THRESHOLD", "0.85")
+            self.cluster_threshold_fixed = to_fixed(self.cluster_threshold)
+        except ValueError as e:
+            print(f"Error: invalid environment variable: {e}")
+            sys.exit(1)
+
+class CapacityPlanner:
+    """Vectorized calc_resource.sh, inputs are broadcastable integer arrays"""
+
+    def __init__(self, env: PlannerEnv) -> None:
+        self.env = env
+
+    def evaluate(self, pb: np.ndarray, qps: np.ndarray, io: np.ndarray, read: np.ndarray, write: np.ndarray,
+                 dc: np.ndarray, dn: np.ndarray, ec_k: np.ndarray, ec_m: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        pb, qps and dc are fixed point (scaled by SCALE), the others plain integers.
+        Values the script prints with scale=2 are returned in hundredths.
+        """
+        env = self.env
+        ec_total = ec_k + ec_m
+
+        # EC_Shard_Size = ceil(IO * 1024 / K, BLOBNODE_IO_ALIGN)
+        shard = (io * 1024) // ec_k
+        shard = ceil_div(shard, env.blobnode_io_align) * env.blobnode_io_align
+
+        # Disk_Per_PiB = ceil(1024 * (K + M) / (Capa_Per_Disk * 0.909 * CLUSTER_THRESHOLD * K))
+        disk_per_pib = ceil_div(1024 * ec_total * DISK_EFFICIENCY.denominator * SCALE * SCALE,
+                                dc * DISK_EFFICIENCY.numerator * env.cluster_threshold_fixed * ec_k)
+
+        # TPS_Per_PiB = floor(Disk_Per_PiB * (IOPS / (Shard / (COEF * 1024) + 1)) / (K + M))
+        # the inner divisions are truncated by bc, which can land just below an integer (4719.999.. -> 4719),
+        # so they are replayed on 20 digit fixed point Python ints. Only the io, dc and ec axes broadcast here.
+        coef = env.iops_coefficient * 1024
+        divisor = (shard.astype(object) * BC_SCALE) // coef + BC_SCALE
+        per_disk = (env.iops_per_disk * BC_SCALE * BC_SCALE) // divisor
+        tps_per_pib = ((disk_per_pib.astype(object) * per_disk) // (ec_total.astype(object) * BC_SCALE)).astype(np.int64)
+
+        # Gibps_Per_PiB = TPS_Per_PiB * IO * 1024 * 8 / 1024^3, scale=2
+        gbps_per_pib = (tps_per_pib * io * 1024 * 8 * 100) // (1024 ** 3)
+
+        # servers by capacity = ceil(PB * Disk_Per_PiB / Disks_Per_Node), at least K + M
+        servers_cap = np.maximum(ceil_div(pb * disk_per_pib, dn * SCALE), ec_total)
+
+        # Demand_QPS_{Write,Read} = QPS * {w,r} / (r + w), scale=2
+        ratio_sum = read + write
+        qps_write = (qps * write * 100) // (ratio_sum * SCALE)
+        qps_read = (qps * read * 100) // (ratio_sum * SCALE)
+
+        # Demand_IOPS_Per_Disk = W * (K + M) / Disk_Per_PiB + R * (K + X) / Disk_Per_PiB, each term scale=2
+        iops_per_disk = (qps_write * ec_total) // disk_per_pib + \
+                        (qps_read * (ec_k + env.min_read_shard_x)) // disk_per_pib
+        iops_mag = iops_per_disk // env.iops_per_disk
+
+        # servers by QPS = ceil(Mag * Disk_Per_PiB * PB / Disks_Per_Node), at least K + M
+        servers_qps = np.maximum(ceil_div(iops_mag * disk_per_pib * pb, dn * 100 * SCALE), ec_total)
+
+        # ties go to QPS, as with the script's -gt
+        by_capacity = servers_cap > servers_qps
+        servers = np.where(by_capacity, servers_cap, servers_qps)
+        datasets = ceil_div(servers, env.dataset_size)
+        return {
+            "ec_total": ec_total, "shard": shard, "disk_per_pib": disk_per_pib, "tps_per_pib": tps_per_pib,
+            "gbps_per_pib": gbps_per_pib, "servers_cap": servers_cap, "qps_write": qps_write,
+            "qps_read": qps_read, "iops_per_disk": iops_per_disk, "iops_mag": iops_mag,
+            "servers_qps": servers_qps, "by_capacity": by_capacity, "servers": servers,
+            "datasets": datasets, "servers_rounded": datasets * env.dataset_size,
+        }
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def parse_pairs(value: str, sep: str) -> List[Tuple[int, int]]:
+    pairs = []
+    for item in parse_list(value):
+        left, _, right = item.partition(sep)
+        pairs.append((int(left), int(right or left)))
+    return pairs
+
+def build_grid(args: argparse.Namespace) -> Dict[str, np.ndarray]:
+    """One axis per flag, shaped so that NumPy broadcasting evaluates every combination"""
+    try:
+        axes = [
+            ("pb", [[to_fixed(v)] for v in parse_list(args.pb)]),
+            ("qps", [[to_fixed(v)] for v in parse_list(args.qps)]),
+            ("io", [[int(v)] for v in parse_list(args.io)]),
+            ("rw", [list(pair) for pair in parse_pairs(args.rw, ":")]),
+            ("dc", [[to_fixed(v)] for v in parse_list(args.dc)]),
+            ("dn", [[int(v)] for v in parse_list(args.dn)]),
+            ("ec", [list(pair) for pair in parse_pairs(args.ec, "+")]),
+        ]
+    except ValueError as e:
+        print(f"Error: invalid argument: {e}")
+        sys.exit(1)
+    grid: Dict[str, np.ndarray] = {}
+    for axis, (name, values) in enumerate(axes):
+        if not values:
+            print(f"Error: --{name} is empty")
+            sys.exit(1)
+        shape = [1] * len(axes)
+        shape[axis] = len(values)
+        columns = np.array(values, dtype=np.int64)
+        if name == "rw":
+            grid["read"], grid["write"] = columns[:, 0].reshape(shape), columns[:, 1].reshape(shape)
+        elif name == "ec":
+            grid["ec_k"], grid["ec_m"] = columns[:, 0].reshape(shape), columns[:, 1].reshape(shape)
+        else:
+            grid[name] = columns[:, 0].reshape(shape)
+    if np.any(grid["ec_k"] <= 0) or np.any(grid["dn"] <= 0) or np.any(grid["dc"] <= 0) or \
+            np.any(grid["read"] + grid["write"] <= 0):
+        print("Error: --ec K, --dc, --dn and --rw must be positive")
+        sys.exit(1)
+    return grid
+
+def print_report(env: PlannerEnv, args: argparse.Namespace, point: Dict[str, int], result: Dict[str, int]) -> None:
+    """The report of calc_resource.sh for a single point, inputs are echoed as given like the script does"""
+    io = point["io"]
+    lines = [
+        "",
+        "========== Blobstore Resource Calculation ==========",
+        "",
+        "Input:",
+        f"  EC K/M:                     {point['ec_k']}+{point['ec_m']}",
+        f"  Demand Capacity:            {args.pb.strip(',')} PB",
+        f"  Demand QPS:                 {args.qps.strip(',')}",
+        f"  IO Size:                    {io} KiB ({io // 1024} MiB)",
+        f"  Read/Write Ratio:           {point['read']}:{point['write']}",
+        f"  Capacity per Disk:          {args.dc.strip(',')} TB",
+        f"  Disks per Node:             {point['dn']}",
+        f"  IOPS per Disk:              {env.iops_per_disk}",
+        f"  IOPS Coefficient:           {env.iops_coefficient} KiB ({env.iops_coefficient // 1024} MiB)",
+        f"  Blobnode IO Align:          {env.blobnode_io_align} bytes",
+        f"  Dataset Size:               {env.dataset_size} devices",
+        f"  EC Shard Size:              {result['shard'] // 1024} KiB",
+        "",
+        "Intermediate:",
+        f"  Disks per PiB:              {result['disk_per_pib']}",
+        f"  TPS per PiB:                {result['tps_per_pib']}",
+        f"  Bandwidth per PiB:          {bc_format(result['gbps_per_pib'])} Gbps",
+        f"  Demand QPS Write:           {bc_format(result['qps_write'])}",
+        f"  Demand QPS Read:            {bc_format(result['qps_read'])}",
+        f"  Demand IOPS per Disk:       {bc_format(result['iops_per_disk'])}",
+        f"  IOPS Magnification Factor:  {bc_format(result['iops_mag'])}",
+        "",
+        "Result - By Capacity:",
+        f"  Servers:                    {result['servers_cap']}",
+        "",
+        "Result - By QPS:",
+        f"  Servers:                    {result['servers_qps']}",
+        "",
+        "Final Recommendation:",
+        f"  Servers (raw):              {result['servers']} (driven by {'capacity' if result['by_capacity'] else 'QPS'})",
+        f"  Servers (dataset rounded):  {result['servers_rounded']} ({result['datasets']} datasets)",
+        "",
+    ]
+    print("\n".join(lines))
+
+def print_cheapest(grid: Dict[str, np.ndarray], result: Dict[str, np.ndarray], args: argparse.Namespace) -> None:
+    inputs = dict(zip(grid, np.broadcast_arrays(*grid.values())))
+    outputs = dict(zip(result, np.broadcast_arrays(*result.values())))
+    flat = {name: value.ravel() for name, value in {**inputs, **outputs}.items()}
+    servers = flat["servers_rounded"]
+    # cost of a configuration: servers plus the raw disk capacity they carry
+    raw_tb = servers * flat["dn"] * flat["dc"] / SCALE
+    cost = servers * args.node_cost + raw_tb * args.tb_cost
+    order = np.lexsort((raw_tb, servers, cost))[:args.top]
+    print(f"Evaluated {len(servers)} configurations, cheapest {len(order)} "
+          f"(cost = servers * {args.node_cost:g} + raw TB * {args.tb_cost:g}):")
+    header = ["EC", "PB", "QPS", "IO KiB", "R:W", "Disk TB", "Disks/Node", "Disks/PiB", "Cap Servers",
+              "QPS Servers", "Driven By", "Servers", "Datasets", "Raw PB", "Cost"]
+    rows = [header]
+    for i in order:
+        rows.append([f"{flat['ec_k'][i]}+{flat['ec_m'][i]}", f"{flat['pb'][i] / SCALE:g}",
+                     f"{flat['qps'][i] / SCALE:g}", str(flat["io"][i]), f"{flat['read'][i]}:{flat['write'][i]}",
+                     f"{flat['dc'][i] / SCALE:g}", str(flat["dn"][i]), str(flat["disk_per_pib"][i]),
+                     str(flat["servers_cap"][i]), str(flat["servers_qps"][i]),
+                     "capacity" if flat["by_capacity"][i] else "QPS", str(servers[i]), str(flat["datasets"][i]),
+                     f"{raw_tb[i] / 1000:.2f}", f"{cost[i]:.2f}"])
+    widths = [max(len(row[c]) for row in rows) for c in range(len(header))]
+    for n, row in enumerate(rows):
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+        if n == 0:
+            print("  ".join("-" * width for width in widths))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Calculate the servers a Blobstore cluster needs by capacity and QPS. "
+                    "Every option accepts a comma separated list to evaluate a grid.",
+        epilog="Environment variables: IOPS_PER_DISK (100), IOPS_COEFFICIENT (512), BLOBNODE_IO_ALIGN (4096), "
+               "DATASET_SIZE (60), MIN_READ_SHARD_X (1), CLUSTER_THRESHOLD (0.85)")
+    parser.add_argument("--pb", default="1", help="Required capacity in PB (default: 1)")
+    parser.add_argument("--qps", default="1000", help="Required QPS (default: 1000)")
+    parser.add_argument("--io", default="1024", help="Client IO size in KiB (default: 1024, 1MiB)")
+    parser.add_argument("--rw", default="1:9", help="Read:Write ratio (default: 1:9)")
+    parser.add_argument("--dc", default="16", help="Capacity per disk in TB (default: 16)")
+    parser.add_argument("--dn", default="32", help="Disks per server node (default: 32)")
+    parser.add_argument("--ec", default="8+3", help="EC scheme, e.g. 12+9 (default: 8+3)")
+    parser.add_argument("--top", type=int, default=10, help="Configurations printed for a grid (default: 10)")
+    parser.add_argument("--node-cost", type=float, default=1.0, help="Cost of one server for a grid (default: 1)")
+    parser.add_argument("--tb-cost", type=float, default=0.0, help="Cost of one raw disk TB for a grid (default: 0)")
+    args = parser.parse_args()
+
+    env = PlannerEnv()
+    grid = build_grid(args)
+    result = CapacityPlanner(env).evaluate(**grid)
+    if all(value.size == 1 for value in grid.values()):
+        point = {name: int(value.ravel()[0]) for name, value in grid.items()}
+        print_report(env, args, point, {name: value.ravel()[0].item() for name, value in result.items()})
+    else:
+        print_cheapest(grid, result, args)
+
+if __name__ == "__main__":
+    main()
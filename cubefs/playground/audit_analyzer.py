@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Analyze blobstore audit logs in one streaming pass, as written under auditlog.logdir by the vstart services.
+
+Every line is one request, tab separated: REQ, module, start time in 100ns, method, path, request header,
+request params, status code, response header, response body, response length, duration in us.
+Latencies are kept in log-bucketed quantile sketches, so memory only grows with the number of
+service/api pairs, never with the number of lines.
+"""
+import os
+import sys
+import csv
+import gzip
+import math
+import re
+import argparse
+from collections import deque
+from typing import Any, Deque, Dict, IO, Iterator, List, Optional, Tuple
+
+import common
+
+DEFAULT_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run/log/auditlog")
+FIELDS = 12
+START_TIME_UNITS = 10_000_000
+DURATION_UNITS = 1_000_000
+# same templates as common.HttpProfiler.endpoint, on raw bytes since urlsplit per line is the bottleneck
+NUMBER_SEGMENT = re.compile(rb"/-?\d+(?=/|$)")
+TEMPLATE_CACHE_SIZE = 1 << 16
+
+class QuantileSketch:
+    """
+    Counts of values in buckets growing by gamma = (1 + accuracy) / (1 - accuracy), so any quantile is
+    answered within the relative accuracy. Sketches of equal accuracy merge by adding their buckets.
+    """
+
+    def __init__(self, accuracy: float = 0.01) -> None:
+        self.accuracy = accuracy
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.buckets: Dict[int, int] = {}
+        # values below 1us all land in one bucket
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if value < 1e-6:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.count += other.count
+        self.zeros += other.zeros
+        self.max = max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # midpoint of the bucket in relative terms, bounded by the largest value seen
+                return min(2 * math.exp(index * self.log_gamma) / (1 + math.exp(self.log_gamma)), self.max)
+        return self.max
+
+class WindowStats:
+    """Requests, server errors and latency of one key within one step"""
+
+    def __init__(self, accuracy: float) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.latency = QuantileSketch(accuracy)
+
+    def merge(self, other: "WindowStats") -> None:
+        self.requests += other.requests
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+
+class ApiStats:
+    """Totals of one service/api pair over the whole input"""
+
+    def __init__(self, accuracy: float) -> None:
+        self.requests = 0
+        self.bytes_out = 0
+        self.statuses: Dict[int, int] = {}
+        self.latency = QuantileSketch(accuracy)
+        self.first = math.inf
+        self.last = 0.0
+
+class SlidingSeries:
+    """
+    Per key step statistics of one service, emitting a row for the window ending at every closed step for
+    every key with requests in that window, quiet steps included. Audit lines are written when requests
+    finish, so start times arrive slightly out of order; a step is closed once lines one step later have
+    been seen, lines older than that only count in the totals.
+    """
+
+    def __init__(self, window: float, step: float, accuracy: float, writer: Optional[Any]) -> None:
+        self.step = step
+        self.steps_per_window = max(1, round(window / step))
+        self.accuracy = accuracy
+        self.writer = writer
+        self.open: Dict[int, Dict[str, WindowStats]] = {}
+        self.closed: Dict[str, Deque[Tuple[int, WindowStats]]] = {}
+        self.newest = -1
+        # first step seen, windows reaching before it cover fewer steps, and the next step to close
+        self.first = -1
+        self.next_close = -1
+        self.late = 0
+
+    def add(self, key: str, start: float, duration: float, error: bool) -> None:
+        index = int(start // self.step)
+        if index < self.newest - 1:
+            self.late += 1
+            return
+        if self.first < 0 or index < self.first:
+            # nothing before the newest two steps is closed yet, so an earlier first step still gets its rows
+            self.first = index
+            self.next_close = min(self.next_close, index)
+        if index > self.newest:
+            self.newest = index
+            self._close(index - 1)
+        stats = self.open.setdefault(index, {}).get(key)
+        if stats is None:
+            stats = self.open[index][key] = WindowStats(self.accuracy)
+        stats.requests += 1
+        stats.errors += error
+        stats.latency.add(duration)
+
+    def flush(self) -> None:
+        self._close(self.newest + 1)
+
+    def _close(self, before: int) -> None:
+        index = max(self.next_close, self.first)
+        while index < before:
+            for key, stats in self.open.pop(index, {}).items():
+                self.closed.setdefault(key, deque()).append((index, stats))
+            for key in sorted(self.closed):
+                ring = self.closed[key]
+                while ring and ring[0][0] <= index - self.steps_per_window:
+                    ring.popleft()
+                if ring:
+                    self._emit(key, index, ring)
+                else:
+                    del self.closed[key]
+            index += 1
+            if not self.closed:
+                # nothing left in any window, skip the idle steps up to the next one with requests
+                index = min([i for i in self.open if i >= index] + [before])
+        self.next_close = max(self.next_close, index)
+
+    def _emit(self, key: str, index: int, ring: Deque[Tuple[int, WindowStats]]) -> None:
+        if self.writer is None:
+            return
+        window = WindowStats(self.accuracy)
+        for _, stats in ring:
+            window.merge(stats)
+        seconds = min(self.steps_per_window, index - self.first + 1) * self.step
+        self.writer.writerow([f"{(index + 1) * self.step:.0f}", *key.split("\t", 1),
+                              window.requests, f"{window.requests / seconds:.2f}",
+                              f"{window.errors / window.requests:.4f}" if window.requests else "0",
+                              f"{window.latency.quantile(0.5) * 1000:.3f}", f"{window.latency.quantile(0.99) * 1000:.3f}",
+                              f"{window.latency.max * 1000:.3f}"])
+
+class AuditAnalyzer:
+    def __init__(self, args: argparse.Namespace, writer: Optional[Any]) -> None:
+        self.args = args
+        self.writer = writer
+        self.apis: Dict[Tuple[str, str], ApiStats] = {}
+        self.lines = 0
+        self.malformed = 0
+        self.late = 0
+        self.templates: Dict[Tuple[bytes, bytes], str] = {}
+
+    def api(self, method: bytes, path: bytes) -> str:
+        """Method and endpoint template of a request, numeric segments become * and query values are dropped"""
+        api = self.templates.get((method, path))
+        if api is None:
+            path_only, _, query = path.partition(b"?")
+            template = NUMBER_SEGMENT.sub(b"/*", path_only) or b"/"
+            if query:
+                template += b"?" + b"&".join(sorted(item.split(b"=", 1)[0] for item in query.split(b"&")))
+            api = f"{method.decode('utf-8', 'replace')} {template.decode('utf-8', 'replace')}"
+            if len(self.templates) >= TEMPLATE_CACHE_SIZE:
+                self.templates.clear()
+            self.templates[(method, path)] = api
+        return api
+
+    @staticmethod
+    def discover(paths: List[str]) -> Dict[str, List[str]]:
+        """Service name -> its audit files oldest first, the service is the directory holding the files"""
+        services: Dict[str, List[str]] = {}
+        for path in paths:
+            if os.path.isfile(path):
+                services.setdefault(os.path.basename(os.path.dirname(os.path.abspath(path))), []).append(path)
+                continue
+            for root, _, files in os.walk(path):
+                for name in files:
+                    services.setdefault(os.path.basename(root), []).append(os.path.join(root, name))
+        # rotated files are named differently by every rotator, modification time orders them all
+        return {service: sorted(files, key=lambda f: (os.path.getmtime(f), f))
+                for service, files in sorted(services.items())}
+
+    @staticmethod
+    def open_log(path: str) -> IO[bytes]:
+        if path.endswith(".gz"):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb', buffering=1 << 20)
+
+    def iter_requests(self, files: List[str]) -> Iterator[Tuple[str, float, str, int, int, float]]:
+        """(module, start seconds, method and api template, status, response length, duration seconds)"""
+        for path in files:
+            with self.open_log(path) as f:
+                for line in f:
+                    self.lines += 1
+                    fields = line.rstrip(b"\n").split(b"\t")
+                    if len(fields) < FIELDS or fields[0] != b"REQ":
+                        self.malformed += 1
+                        continue
+                    try:
+                        start = int(fields[2]) / START_TIME_UNITS
+                        status = int(fields[7])
+                        length = int(fields[10] or 0)
+                        duration = int(fields[11]) / DURATION_UNITS
+                    except ValueError:
+                        self.malformed += 1
+                        continue
+                    yield fields[1].decode('utf-8', 'replace'), start, self.api(fields[3], fields[4]), status, length, duration
+
+    def analyze(self, services: Dict[str, List[str]]) -> None:
+        by_api = self.args.series_by == 'api'
+        for service, files in services.items():
+            series = SlidingSeries(self.args.window, self.args.step, self.args.accuracy, self.writer)
+            for module, start, api, status, length, duration in self.iter_requests(files):
+                name = service or module
+                stats = self.apis.get((name, api))
+                if stats is None:
+                    stats = self.apis[(name, api)] = ApiStats(self.args.accuracy)
+                stats.requests += 1
+                stats.bytes_out += length
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+                stats.latency.add(duration)
+                stats.first = min(stats.first, start)
+                stats.last = max(stats.last, start)
+                series.add(f"{name}\t{api if by_api else '*'}", start, duration, status >= 500)
+            series.flush()
+            self.late += series.late
+
+    def print_summary(self) -> None:
+        rows = [["service", "api", "requests", "req/s", "5xx%", "p50_ms", "p90_ms", "p99_ms", "max_ms", "sent", "statuses"]]
+        items = sorted(self.apis.items(), key=lambda item: (item[0][0], -item[1].requests))
+        for (service, api), stats in items:
+            span = stats.last - stats.first
+            errors = sum(count for status, count in stats.statuses.items() if status >= 500)
+            statuses = sorted(stats.statuses.items(), key=lambda item: -item[1])[:self.args.statuses]
+            rows.append([service, api, str(stats.requests), f"{stats.requests / span:.1f}" if span > 0 else "-",
+                         f"{errors * 100 / stats.requests:.2f}",
+                         *(f"{stats.latency.quantile(q) * 1000:.2f}" for q in (0.5, 0.9, 0.99)),
+                         f"{stats.latency.max * 1000:.2f}", common.HumanReadable.human_bytes(stats.bytes_out),
+                         " ".join(f"{status}:{count * 100 / stats.requests:.1f}%" for status, count in statuses)])
+        if self.args.top > 0:
+            rows = rows[:self.args.top + 1]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for n, row in enumerate(rows):
+            print("  ".join(cell.ljust(width) if i in (0, 1, len(row) - 1) else cell.rjust(width)
+                            for i, (cell, width) in enumerate(zip(row, widths))).rstrip())
+            if n == 0:
+                print("  ".join("-" * width for width in widths))
+        print(f"{self.lines} lines, {self.malformed} malformed, {self.late} too late for the --series windows")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per service and api rates, status mix and latency of audit logs")
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_LOG_DIR],
+                        help='Audit log files or directories of them, one directory per service '
+                             '(default ./run/log/auditlog of vstart)')
+    parser.add_argument('--window', type=float, default=60, help='Seconds of each --series window')
+    parser.add_argument('--step', type=float, default=10, help='Seconds between --series windows')
+    parser.add_argument('--series', type=str, metavar='FILE', help='Write a csv row per window and key to FILE')
+    parser.add_argument('--series-by', type=str, default='service', choices=['service', 'api'],
+                        help='Key of --series rows, every api of a service or the service as a whole')
+    parser.add_argument('--accuracy', type=float, default=0.01, help='Relative accuracy of the latency percentiles')
+    parser.add_argument('--statuses', type=int, default=3, help='Status codes shown per api, most frequent first')
+    parser.add_argument('--top', type=int, default=0, help='Only print the first N apis, 0 for all')
+    args = parser.parse_args()
+
+    if args.step <= 0 or args.window < args.step:
+        print("Error: --step must be positive and not above --window")
+        sys.exit(1)
+    if not 0 < args.accuracy < 1:
+        print("Error: --accuracy must be between 0 and 1")
+        sys.exit(1)
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        print(f"Error: {', '.join(missing)} not found")
+        sys.exit(1)
+
+    services = AuditAnalyzer.discover(args.paths)
+    series_file = open(args.series, 'w', newline='') if args.series else None
+    try:
+        writer = None
+        if series_file is not None:
+            writer = csv.writer(series_file)
+            writer.writerow(["window_end", "service", "api", "requests", "req_per_sec", "error_ratio",
+                             "p50_ms", "p99_ms", "max_ms"])
+        analyzer = AuditAnalyzer(args, writer)
+        analyzer.analyze(services)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if series_file is not None:
+            series_file.close()
+    analyzer.print_summary()
+
+if __name__ == "__main__":
+    main()
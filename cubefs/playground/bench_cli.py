@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmark cli.py offline against fake_blobstore.py.
+
+A fake cluster is started on free local ports, then every scenario runs cli.py as a child process
+and records wall time, requests/s seen by the fake server and peak RSS of the cli process.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import common
+
+PLAYGROUND_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["disk-list", "disk-list-table", "watch", "shard-delete"]
+
+class FakeBlobstore:
+    """fake_blobstore.py running as a child process on three free ports"""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.ports = {role: self._free_port() for role in ("cm", "bn", "sc")}
+        self.urls = {role: f"http://127.0.0.1:{port}" for role, port in self.ports.items()}
+        command = [sys.executable, os.path.join(PLAYGROUND_DIR, "fake_blobstore.py"),
+                   "--cm-port", str(self.ports["cm"]), "--bn-port", str(self.ports["bn"]),
+                   "--sc-port", str(self.ports["sc"]), "--disks", str(args.disks), "--vuids", str(args.vuids),
+                   "--bids", str(args.bids), "--latency", str(args.latency), "--jitter", str(args.jitter),
+                   "--error-rate", str(args.error_rate), "--seed", "1"]
+        self.proc = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        self._wait_ready()
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def _wait_ready(self) -> None:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                print(f"Error: fake_blobstore.py exited with {self.proc.returncode}")
+                sys.exit(1)
+            if all(common.CommandExecutor.run_http_get_json(f"{url}/fake/metrics", timeout=1)
+                   for url in self.urls.values()):
+                return
+            time.sleep(0.05)
+        print("Error: fake_blobstore.py did not become ready in 10s")
+        self.stop()
+        sys.exit(1)
+
+    def requests(self) -> int:
+        total = 0
+        for url in self.urls.values():
+            metrics = common.CommandExecutor.run_http_get_json(f"{url}/fake/metrics", timeout=5)
+            if isinstance(metrics, dict):
+                total += metrics.get("total", 0)
+        return total
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+class CliBenchmark:
+    """Run cli.py scenarios and measure them"""
+
+    def __init__(self, args: argparse.Namespace, fake: FakeBlobstore) -> None:
+        self.args = args
+        self.fake = fake
+        self.workdir = args.workdir
+
+    def command(self, scenario: str, round_index: int) -> List[str]:
+        base = [sys.executable, os.path.join(PLAYGROUND_DIR, "cli.py"), "--host-cm", self.fake.urls["cm"],
+                "--host-bn", self.fake.urls["bn"], "--host-sc", self.fake.urls["sc"]] + self.args.cli_args
+        if not self.args.cache:
+            # rounds after the first would be served by the metadata cache of the first
+            base.append("--no-cache")
+        if scenario == "disk-list":
+            return base + ["--disk-list", "--format", "ndjson", "--page-size", str(self.args.page_size)]
+        if scenario == "disk-list-table":
+            return base + ["--disk-list", "--page-size", str(self.args.page_size)]
+        if scenario == "watch":
+            return base + ["--watch", "cm,sc,bn", "--interval", "0", "--samples", str(self.args.watch_samples)]
+        if scenario == "shard-delete":
+            # every round deletes shards of a different disk, so no round sees an already emptied one
+            disk_id = round_index % self.args.disks + 1
+            journal = os.path.join(self.workdir, f"bench-shard-delete-{disk_id}-{os.getpid()}.journal")
+            if os.path.exists(journal):
+                os.remove(journal)
+            return base + ["--shard-delete", "--disk-id", str(disk_id), "-n", str(self.args.delete_vuids),
+                           "--journal", journal]
+        raise ValueError(f"unknown scenario {scenario}")
+
+    def run_once(self, scenario: str, round_index: int) -> Dict[str, Any]:
+        command = self.command(scenario, round_index)
+        before = self.fake.requests()
+        start = time.monotonic()
+        # stderr goes to a file, a pipe nobody reads before wait4 would block the cli once it fills up
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file, cwd=self.workdir)
+            # wait4 reports the peak RSS of this cli process alone
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall = time.monotonic() - start
+            stderr_file.seek(max(0, stderr_file.tell() - 4096))
+            stderr = stderr_file.read().decode(errors="replace")
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        requests = self.fake.requests() - before
+        return {"scenario": scenario, "round": round_index, "exit_code": proc.returncode, "wall_sec": wall,
+                "requests": requests, "req_per_sec": requests / wall if wall > 0 else 0.0,
+                "peak_rss_mb": rusage.ru_maxrss / 1024, "cpu_sec": rusage.ru_utime + rusage.ru_stime,
+                "stderr": stderr.strip()[-500:]}
+
+    def run(self, scenarios: List[str]) -> List[Dict[str, Any]]:
+        results = []
+        for scenario in scenarios:
+            for round_index in range(self.args.rounds):
+                result = self.run_once(scenario, round_index)
+                results.append(result)
+                status = "ok" if result["exit_code"] == 0 else f"exit {result['exit_code']}"
+                print(f"{scenario:<16} round {round_index + 1}/{self.args.rounds}: {result['requests']} requests "
+                      f"in {result['wall_sec']:.2f}s, {result['req_per_sec']:.0f} req/s, "
+                      f"peak rss {result['peak_rss_mb']:.1f}MB, {status}")
+                if result["exit_code"] != 0 and result["stderr"]:
+                    print(f"  {result['stderr'].splitlines()[-1]}")
+        return results
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+def print_summary(results: List[Dict[str, Any]]) -> None:
+    rows = [["scenario", "rounds", "failed", "requests", "wall_s", "req/s", "peak_rss_mb", "cpu_s"]]
+    for scenario in dict.fromkeys(result["scenario"] for result in results):
+        group = [result for result in results if result["scenario"] == scenario]
+        rows.append([scenario, str(len(group)), str(sum(1 for r in group if r["exit_code"] != 0)),
+                     f"{median([r['requests'] for r in group]):.0f}", f"{median([r['wall_sec'] for r in group]):.3f}",
+                     f"{median([r['req_per_sec'] for r in group]):.0f}",
+                     f"{max(r['peak_rss_mb'] for r in group):.1f}", f"{median([r['cpu_sec'] for r in group]):.3f}"])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print("Summary (medians, peak rss is the max):")
+    for n, row in enumerate(rows):
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+        if n == 0:
+            print("  ".join("-" * width for width in widths))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark cli.py against a local fake blobstore",
+                                     epilog="Arguments after -- are passed to every cli.py run")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS),
+                        help=f"Comma separated scenarios (default {','.join(SCENARIOS)})")
+    parser.add_argument("--rounds", type=int, default=3, help="Runs of each scenario")
+    parser.add_argument("--disks", type=int, default=10000, help="Disks of the fake cluster")
+    parser.add_argument("--vuids", type=int, default=20, help="Vuids per disk of the fake cluster")
+    parser.add_argument("--bids", type=int, default=500, help="Shards per vuid of the fake cluster")
+    parser.add_argument("--latency", type=float, default=0, help="Latency injected per request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Jitter of the injected latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests failed with 500")
+    parser.add_argument("--page-size", type=int, default=100, help="Disk list page size")
+    parser.add_argument("--watch-samples", type=int, default=200, help="Samples of the watch scenario")
+    parser.add_argument("--delete-vuids", type=int, default=4, help="Vuids deleted per shard-delete run")
+    parser.add_argument("--cache", action="store_true", help="Let cli.py use its metadata cache")
+    parser.add_argument("--workdir", type=str, default=".", help="Directory of cli.py journals")
+    parser.add_argument("--output", type=str, help="Also write every run as json to this file")
+
+    argv = sys.argv[1:]
+    cli_args: List[str] = []
+    if "--" in argv:
+        cli_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+    args.cli_args = cli_args
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        print(f"Error: unknown scenarios {','.join(unknown)}, expect {','.join(SCENARIOS)}")
+        sys.exit(1)
+
+    fake = FakeBlobstore(args)
+    try:
+        results = CliBenchmark(args, fake).run(scenarios)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        fake.stop()
+    print_summary(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,65 @@
 #!/usr/bin/env python3
+import os
+import re
 import sys
+import time
 import argparse
 import json
-from typing import Any, List, Dict
+import csv
+import math
+import heapq
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, List, Dict, Iterator, Optional, Tuple, Union
 
 import common
 
 if sys.version_info < (3, 10):
     sys.exit(f"Error: Python 3.10 or higher is required, but found {sys.version}")
 
+# seconds clustermgr lookups stay in the metadata cache, disk hosts hardly ever change
+DISK_INFO_TTL = 600
+DISK_LIST_TTL = 60
+VUID_LIST_TTL = 60
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "blobstore-cli")
+
 class HandleService():
     @staticmethod
-    def get_disk_host_from_cm(host: str, disk_id: int) -> str:
-        url = f"{host}/disk/info?disk_id={disk_id}"
-        response_data = common.CommandExecutor.run_http_get_json(url)
+    def _get_json_cached(host: str, key: str, path: str, ttl: float, valid: Any,
+                         leader: bool = False, fresh: bool = False) -> Union[Dict[str, Any], List[Any]]:
+        """
+        GET path from the clustermgr members in host through the metadata cache of their cluster,
+        only responses passing valid are cached. Misses go to the leader if asked to, else are hedged.
+        fresh skips the cached entry and only refreshes it, for callers acting on the answer destructively.
+        """
+        router = common.ClustermgrRouter.for_hosts(host)
+        cache = common.MetadataCache.for_cluster(router.cluster)
+        if cache is not None and not fresh:
+            response_data = cache.get(key)
+            if response_data is not None:
+                return response_data
+        response_data = router.get_json(path, valid, leader)
+        if cache is not None and valid(response_data):
+            cache.put(key, response_data, ttl)
+        return response_data
+
+    @staticmethod
+    def get_disk_host_from_cm(host: str, disk_id: int, fresh: bool = False) -> str:
+        # shards are deleted on the host answered here, so ask the leader rather than a lagging follower
+        response_data = HandleService._get_json_cached(
+            host, f"disk_info/{disk_id}", f"/disk/info?disk_id={disk_id}", DISK_INFO_TTL,
+            lambda data: isinstance(data, dict) and "host" in data, leader=True, fresh=fresh)
         if isinstance(response_data, dict) and "host" in response_data:
             return response_data["host"]
         sys.exit(f"don't get disk {disk_id} info from {host}")
 
     @staticmethod
-    def get_vuid_list_from_cm(host: str, disk_id: int) -> List[Dict[str, Any]]:
-        url = f"{host}/volume/unit/list?disk_id={disk_id}"
-        response_data = common.CommandExecutor.run_http_get_json(url)
+    def get_vuid_list_from_cm(host: str, disk_id: int, fresh: bool = False) -> List[Dict[str, Any]]:
+        response_data = HandleService._get_json_cached(
+            host, f"vuid_list/{disk_id}", f"/volume/unit/list?disk_id={disk_id}", VUID_LIST_TTL,
+            lambda data: isinstance(data, dict) and "volume_unit_infos" in data, leader=True, fresh=fresh)
         if isinstance(response_data, dict) and "volume_unit_infos" in response_data:
             return response_data["volume_unit_infos"]
         return []
@@ -36,12 +74,25 @@ class HandleService():
 
     @staticmethod
     def get_disk_list_from_cm(host: str, marker: int, count: int = 10) -> tuple[List[Dict[str, Any]], int]:
-        url = f"{host}/disk/list?marker={marker}&count={count}"
-        response_data = common.CommandExecutor.run_http_get_json(url)
+        response_data = HandleService._get_json_cached(
+            host, f"disk_list/{marker}/{count}", f"/disk/list?marker={marker}&count={count}", DISK_LIST_TTL,
+            lambda data: isinstance(data, dict) and "disks" in data and "marker" in data)
         if isinstance(response_data, dict) and "disks" in response_data and "marker" in response_data:
             return response_data["disks"], response_data["marker"]
         return [], -1
 
+    @staticmethod
+    def iter_disk_list_from_cm(host: str, count: int = 10) -> Iterator[Dict[str, Any]]:
+        """Yield disks page by page, fetching the next marker page while the current one is consumed"""
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            future = prefetcher.submit(HandleService.get_disk_list_from_cm, host, 0, count)
+            while future is not None:
+                disks, marker = future.result()
+                future = None
+                if marker != -1 and marker != 0:
+                    future = prefetcher.submit(HandleService.get_disk_list_from_cm, host, marker, count)
+                yield from disks
+
     @staticmethod
     def get_sc_stat(host: str, task: str = "all") -> Dict[str, Any]:
         url = f"{host}/stats"
@@ -57,35 +108,758 @@ class HandleService():
 
     @staticmethod
     def get_cm_stat(host: str) -> Dict[str, Any]:
-        url = f"{host}/stat"
-        response_data = common.CommandExecutor.run_http_get_json(url)
+        response_data = common.ClustermgrRouter.for_hosts(host).get_json("/stat", lambda data: isinstance(data, dict))
         if not isinstance(response_data, dict):
             return {}
         return response_data
 
     @staticmethod
-    def delete_shard_from_bn(host: str, disk_id: int, vuid: int, bid: int) -> bool:
-        url = f"{host}/shard/markdelete/diskid/{disk_id}/vuid/{vuid}/bid/{bid}"
-        response = common.CommandExecutor.run_http_post(url)
-        if not response:
-            return False
+    def get_bn_stat(host: str) -> List[Dict[str, Any]]:
+        url = f"{host}/stat"
+        response_data = common.CommandExecutor.run_http_get_json(url)
+        if not isinstance(response_data, list):
+            return []
+        return response_data
+
+    @staticmethod
+    def delete_shard_from_bn(host: str, disk_id: int, vuid: int, bid: int, marked: bool = False) -> bool:
+        """Mark delete then delete the shard, a shard already marked by an earlier attempt is only deleted"""
+        if not marked:
+            url = f"{host}/shard/markdelete/diskid/{disk_id}/vuid/{vuid}/bid/{bid}"
+            response = common.CommandExecutor.run_http_post(url)
+            if not response:
+                return False
         url = f"{host}/shard/delete/diskid/{disk_id}/vuid/{vuid}/bid/{bid}"
         return common.CommandExecutor.run_http_post(url)
 
+class AsyncHandleService():
+    """Async twins of HandleService, for fanning out many requests from one event loop"""
+
+    @staticmethod
+    async def _get_json_cached(host: str, key: str, path: str, ttl: float, valid: Any) -> Union[Dict[str, Any], List[Any]]:
+        router = common.ClustermgrRouter.for_hosts(host)
+        cache = common.MetadataCache.for_cluster(router.cluster)
+        if cache is not None:
+            response_data = cache.get(key)
+            if response_data is not None:
+                return response_data
+        response_data = await router.get_json_async(path, valid)
+        if cache is not None and valid(response_data):
+            cache.put(key, response_data, ttl)
+        return response_data
+
+    @staticmethod
+    async def get_vuid_list_from_cm(host: str, disk_id: int) -> List[Dict[str, Any]]:
+        response_data = await AsyncHandleService._get_json_cached(
+            host, f"vuid_list/{disk_id}", f"/volume/unit/list?disk_id={disk_id}", VUID_LIST_TTL,
+            lambda data: isinstance(data, dict) and "volume_unit_infos" in data)
+        if isinstance(response_data, dict) and "volume_unit_infos" in response_data:
+            return response_data["volume_unit_infos"]
+        return []
+
+    @staticmethod
+    async def get_bid_list_from_bn(host: str, disk_id: int, vuid: int, start_bid: int, status: int = 1, count: int = 10) -> tuple[List[Dict[str, Any]], int]:
+        url = f"{host}/shard/list/diskid/{disk_id}/vuid/{vuid}/startbid/{start_bid}/status/{status}/count/{count}"
+        response_data = await common.AsyncCommandExecutor.run_http_get_json(url)
+        if isinstance(response_data, dict) and "shard_infos" in response_data and "next" in response_data:
+            return response_data["shard_infos"], response_data["next"]
+        return [], -1
+
+    @staticmethod
+    async def get_disk_list_from_cm(host: str, marker: int, count: int = 10) -> tuple[List[Dict[str, Any]], int]:
+        response_data = await AsyncHandleService._get_json_cached(
+            host, f"disk_list/{marker}/{count}", f"/disk/list?marker={marker}&count={count}", DISK_LIST_TTL,
+            lambda data: isinstance(data, dict) and "disks" in data and "marker" in data)
+        if isinstance(response_data, dict) and "disks" in response_data and "marker" in response_data:
+            return response_data["disks"], response_data["marker"]
+        return [], -1
+
+    @staticmethod
+    async def get_sc_stat(host: str, task: str = "all") -> Dict[str, Any]:
+        url = f"{host}/stats"
+        response_data = await common.AsyncCommandExecutor.run_http_get_json(url)
+        if not isinstance(response_data, dict):
+            return {}
+        if task == "all":
+            return response_data
+        else:
+            if f"{task}" not in response_data:
+                return {}
+            return response_data[f"{task}"]
+
+    @staticmethod
+    async def get_cm_stat(host: str) -> Dict[str, Any]:
+        router = common.ClustermgrRouter.for_hosts(host)
+        response_data = await router.get_json_async("/stat", lambda data: isinstance(data, dict))
+        if not isinstance(response_data, dict):
+            return {}
+        return response_data
+
+    @staticmethod
+    async def get_bn_stat(host: str) -> List[Dict[str, Any]]:
+        url = f"{host}/stat"
+        response_data = await common.AsyncCommandExecutor.run_http_get_json(url)
+        if not isinstance(response_data, list):
+            return []
+        return response_data
+
+# data_qos.level.delete.concurrency of the blobnode configs shipped with vstart
+DEFAULT_DELETE_CONCURRENCY = 32
+DEFAULT_SHARD_PAGE_COUNT = 100
+# shard status of blobnode shard listing, 0 lists every status
+SHARD_STATUS_ALL = 0
+SHARD_STATUS_NORMAL = 1
+SHARD_STATUS_MARK_DELETE = 2
+
+class DeleteStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.success = 0
+        self.failed = 0
+        self.vuids_done = 0
+        self.vuids_skipped = 0
+        self.vuids_failed = 0
+        self.start_time = time.monotonic()
+
+    def record(self, success: bool) -> None:
+        with self.lock:
+            if success:
+                self.success += 1
+            else:
+                self.failed += 1
+
+    def finish_vuid(self, success: bool = True) -> None:
+        with self.lock:
+            if success:
+                self.vuids_done += 1
+            else:
+                self.vuids_failed += 1
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def rate(self) -> float:
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return (self.success + self.failed) / elapsed
+
+class DeleteJournal:
+    """Append-only progress journal of shard deletion, one "disk_id vuid last_bid" line per checkpoint"""
+
+    # last_bid recorded once the vuid was listed to the end and every listed bid has been deleted
+    VUID_DONE = -1
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 1.0) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._last_flush = time.monotonic()
+        self._file = None
+
+    def load(self) -> Dict[Tuple[int, int], int]:
+        """Return the latest checkpoint of every (disk_id, vuid) in the journal"""
+        checkpoints: Dict[Tuple[int, int], int] = {}
+        if not os.path.exists(self.path):
+            return checkpoints
+        with open(self.path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                # the tail may be torn if the previous run was killed mid-write
+                if len(fields) != 3 or not all(field.lstrip('-').isdigit() for field in fields):
+                    continue
+                disk_id, vuid, last_bid = (int(field) for field in fields)
+                checkpoints[(disk_id, vuid)] = last_bid
+        return checkpoints
+
+    def open(self, checkpoints: Dict[Tuple[int, int], int]) -> None:
+        """Start a new journal holding only the given checkpoints, compacting the previous run"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for (disk_id, vuid), last_bid in checkpoints.items():
+                f.write(f"{disk_id} {vuid} {last_bid}\n")
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+
+    def record(self, disk_id: int, vuid: int, last_bid: int) -> None:
+        with self._lock:
+            self._pending.append(f"{disk_id} {vuid} {last_bid}\n")
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending or self._file is None:
+            return
+        self._file.write("".join(self._pending))
+        self._file.flush()
+        self._pending = []
+
+class VuidProgress:
+    """
+    Track listed pages of one vuid, checkpointing the last bid of every page deleted in order. A page with a
+    failed bid holds the checkpoint before it, so a resumed run lists and retries it again.
+    """
+
+    def __init__(self, disk_id: int, vuid: int, journal: Optional[DeleteJournal], stats: DeleteStats) -> None:
+        self.disk_id = disk_id
+        self.vuid = vuid
+        self.journal = journal
+        self.stats = stats
+        self._lock = threading.Lock()
+        # [bids not yet finished, last bid, failed bids] of every page, in listing order
+        self._pages: deque = deque()
+        self._pending = 0
+        self._listed = False
+        self._listing_failed = False
+        self._finished = False
+
+    def add_page(self, shards: List[Dict[str, Any]], last_bid: int) -> List[int]:
+        page = [len(shards), last_bid, 0]
+        with self._lock:
+            self._pages.append(page)
+            self._pending += len(shards)
+        if not shards:
+            self._advance()
+        return page
+
+    def finish_bid(self, page: List[int], success: bool) -> None:
+        with self._lock:
+            page[0] -= 1
+            self._pending -= 1
+            if not success:
+                page[2] += 1
+        self._advance()
+
+    def finish_listing(self, success: bool = True) -> None:
+        with self._lock:
+            self._listed = True
+            self._listing_failed = not success
+        self._advance()
+
+    def _advance(self) -> None:
+        with self._lock:
+            checkpoint = 0
+            while self._pages and self._pages[0][0] == 0 and self._pages[0][2] == 0:
+                checkpoint = self._pages.popleft()[1] or checkpoint
+            # finish once, when the last bid and the listing end race
+            finished = self._listed and self._pending == 0 and not self._finished
+            if finished:
+                self._finished = True
+            done = finished and not self._pages and not self._listing_failed
+        if self.journal is not None:
+            if done:
+                self.journal.record(self.disk_id, self.vuid, DeleteJournal.VUID_DONE)
+            elif checkpoint:
+                self.journal.record(self.disk_id, self.vuid, checkpoint)
+        if finished:
+            self.stats.finish_vuid(done)
+
+class ShardDeleter:
+    """Delete every shard of a disk, paging bids per vuid and deleting them on a bounded worker pool"""
+
+    def __init__(self, host: str, disk_id: int, count: int = DEFAULT_SHARD_PAGE_COUNT,
+                 vuid_concurrency: int = DEFAULT_DELETE_CONCURRENCY,
+                 bid_concurrency: int = DEFAULT_DELETE_CONCURRENCY) -> None:
+        self.host = host
+        self.disk_id = disk_id
+        self.count = count
+        self.vuid_concurrency = max(1, vuid_concurrency)
+        self.bid_concurrency = max(1, bid_concurrency)
+        self.stats = DeleteStats()
+        # bounds the bids queued on the bid pool, so paging never runs far ahead of deletion
+        self._inflight = threading.BoundedSemaphore(self.bid_concurrency * 2)
+        self._stop_report = threading.Event()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def default_concurrency(bn_cfg: Optional[str]) -> int:
+        if not bn_cfg:
+            return DEFAULT_DELETE_CONCURRENCY
+        blobnode_config = common.ConfigFileManager.get_json_data(bn_cfg)
+        level = blobnode_config.get("disk_config", {}).get("data_qos", {}).get("level", {})
+        concurrency = level.get("delete", {}).get("concurrency", 0)
+        if isinstance(concurrency, int) and concurrency > 0:
+            return concurrency
+        return DEFAULT_DELETE_CONCURRENCY
+
+    def run(self, vuids: List[int], journal: Optional[DeleteJournal] = None,
+            checkpoints: Optional[Dict[Tuple[int, int], int]] = None) -> DeleteStats:
+        checkpoints = checkpoints or {}
+        reporter = threading.Thread(target=self._report, daemon=True)
+        reporter.start()
+        bid_pool = ThreadPoolExecutor(max_workers=self.bid_concurrency)
+        vuid_pool = ThreadPoolExecutor(max_workers=self.vuid_concurrency)
+        try:
+            futures = []
+            for vuid in vuids:
+                start_bid = checkpoints.get((self.disk_id, vuid), 0)
+                if start_bid == DeleteJournal.VUID_DONE:
+                    self.stats.vuids_skipped += 1
+                    continue
+                futures.append(vuid_pool.submit(self._delete_vuid, bid_pool, journal, vuid, start_bid))
+            for future in futures:
+                future.result()
+            vuid_pool.shutdown()
+            bid_pool.shutdown()
+        except BaseException:
+            # Ctrl-C or a failed listing, drop queued bids and keep the journal at what was really deleted
+            self._stop.set()
+            vuid_pool.shutdown(cancel_futures=True)
+            bid_pool.shutdown(cancel_futures=True)
+            raise
+        finally:
+            self._stop_report.set()
+            reporter.join()
+            if journal is not None:
+                journal.close()
+        return self.stats
+
+    def _delete_vuid(self, bid_pool: ThreadPoolExecutor, journal: Optional[DeleteJournal],
+                     vuid: int, start_bid: int) -> None:
+        progress = VuidProgress(self.disk_id, vuid, journal, self.stats)
+        while not self._stop.is_set():
+            # shards marked by an interrupted attempt are listed too, only their delete is left to do
+            shards, next = HandleService.get_bid_list_from_bn(self.host, self.disk_id, vuid, start_bid,
+                                                              SHARD_STATUS_ALL, self.count)
+            if next == -1:
+                print(f"\nFailed to list shards: disk_id={self.disk_id}, vuid={vuid}, start_bid={start_bid}",
+                      file=sys.stderr)
+                progress.finish_listing(False)
+                break
+            statuses = [shard.get("status", shard.get("flag", SHARD_STATUS_NORMAL)) for shard in shards]
+            page = progress.add_page([shard for shard, status in zip(shards, statuses)
+                                      if status in (SHARD_STATUS_NORMAL, SHARD_STATUS_MARK_DELETE)],
+                                     shards[-1]["bid"] if shards else 0)
+            for shard, status in zip(shards, statuses):
+                if status not in (SHARD_STATUS_NORMAL, SHARD_STATUS_MARK_DELETE):
+                    continue
+                self._inflight.acquire()
+                if self._stop.is_set():
+                    self._inflight.release()
+                    return
+                future = bid_pool.submit(self._delete_bid, vuid, shard["bid"], status == SHARD_STATUS_MARK_DELETE)
+                future.add_done_callback(lambda f, page=page: self._finish_bid(f, progress, page))
+            if next == 0:
+                progress.finish_listing()
+                break
+            start_bid = next
+
+    def _finish_bid(self, future: Any, progress: VuidProgress, page: List[int]) -> None:
+        self._inflight.release()
+        if not future.cancelled():
+            progress.finish_bid(page, future.exception() is None and future.result())
+
+    def _delete_bid(self, vuid: int, bid: int, marked: bool = False) -> bool:
+        success = HandleService.delete_shard_from_bn(self.host, self.disk_id, vuid, bid, marked)
+        self.stats.record(success)
+        if not success:
+            print(f"\nFailed to delete shard: disk_id={self.disk_id}, vuid={vuid}, bid={bid}", file=sys.stderr)
+        return success
+
+    def _report(self) -> None:
+        while not self._stop_report.wait(1):
+            self._print_progress()
+        self._print_progress()
+        print()
+
+    def _print_progress(self) -> None:
+        stats = self.stats
+        throttle = common.CommandExecutor.get_throttle(self.host)
+        limit = f", limit: {throttle.summary()}" if throttle is not None else ""
+        sys.stdout.write(f"\rvuids done: {stats.vuids_done}, vuids failed: {stats.vuids_failed}, "
+                         f"deleted: {stats.success}, "
+                         f"failed: {stats.failed}, {stats.rate():.1f} bids/s{limit}")
+        sys.stdout.flush()
+
+DISK_LIST_FIELDS = ["idc", "rack", "host", "path", "status", "readonly", "disk_set_id", "node_id", "disk_id",
+                    "used", "free", "size", "max_chunk_cnt", "free_chunk_cnt", "used_chunk_cnt"]
+
+class InventoryScanner:
+    """
+    Page every shard of every disk into a columnar file. Disks and vuids are listed from clustermgr by a few
+    tasks and shards by a pool of async workers, the requests to each blobnode capped by --host-concurrency.
+    """
+    COLUMNS = [("disk_id", "I"), ("vuid", "Q"), ("bid", "Q"), ("size", "I"), ("status", "B")]
+    VUID_LISTERS = 8
+
+    def __init__(self, host_cm: str, count: int = DEFAULT_SHARD_PAGE_COUNT, workers: int = 64,
+                 status: int = 0) -> None:
+        self.host_cm = host_cm
+        self.count = count
+        self.workers = max(1, workers)
+        self.status = status
+        self.disks = 0
+        self.vuids = 0
+        self.failed_vuids = 0
+        self.shards = 0
+        self.started = time.monotonic()
+
+    async def run(self, writer: common.ColumnarWriter, disks: List[Tuple[int, str]]) -> None:
+        """disks is a list of (disk_id, blobnode host), an empty list scans every disk of the cluster"""
+        disk_queue: asyncio.Queue = asyncio.Queue(maxsize=self.VUID_LISTERS * 2)
+        vuid_queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        listers = [asyncio.create_task(self._list_vuids(disk_queue, vuid_queue)) for _ in range(self.VUID_LISTERS)]
+        workers = [asyncio.create_task(self._scan_vuids(vuid_queue, writer)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report())
+        try:
+            if disks:
+                for disk in disks:
+                    await disk_queue.put(disk)
+            else:
+                marker = 0
+                while True:
+                    page, marker = await AsyncHandleService.get_disk_list_from_cm(self.host_cm, marker, 200)
+                    for disk in page:
+                        await disk_queue.put((disk["disk_id"], disk.get("host", "")))
+                    if marker in (0, -1):
+                        break
+            for _ in listers:
+                await disk_queue.put(None)
+            await asyncio.gather(*listers)
+            for _ in workers:
+                await vuid_queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in listers + workers + [reporter]:
+                task.cancel()
+            self._print_progress()
+
+    async def _list_vuids(self, disk_queue: asyncio.Queue, vuid_queue: asyncio.Queue) -> None:
+        while True:
+            disk = await disk_queue.get()
+            if disk is None:
+                return
+            disk_id, bn_host = disk
+            vols = await AsyncHandleService.get_vuid_list_from_cm(self.host_cm, disk_id)
+            self.disks += 1
+            for vol in vols:
+                await vuid_queue.put((disk_id, vol.get("host") or bn_host, vol["vuid"]))
+
+    async def _scan_vuids(self, vuid_queue: asyncio.Queue, writer: common.ColumnarWriter) -> None:
+        while True:
+            item = await vuid_queue.get()
+            if item is None:
+                return
+            disk_id, bn_host, vuid = item
+            start_bid = 0
+            while True:
+                shards, next = await AsyncHandleService.get_bid_list_from_bn(bn_host, disk_id, vuid, start_bid,
+                                                                             self.status, self.count)
+                if next == -1:
+                    self.failed_vuids += 1
+                    break
+                if shards:
+                    writer.append({
+                        "disk_id": [disk_id] * len(shards),
+                        "vuid": [vuid] * len(shards),
+                        "bid": [shard["bid"] for shard in shards],
+                        "size": [shard.get("size", 0) for shard in shards],
+                        "status": [shard.get("status", shard.get("flag", 0)) for shard in shards],
+                    })
+                    self.shards += len(shards)
+                if next == 0:
+                    break
+                start_bid = next
+            self.vuids += 1
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(5)
+            self._print_progress()
+
+    def _print_progress(self) -> None:
+        elapsed = time.monotonic() - self.started
+        rate = self.shards / elapsed if elapsed > 0 else 0.0
+        print(f"disks: {self.disks}, vuids: {self.vuids}, failed vuids: {self.failed_vuids}, "
+              f"shards: {self.shards}, {rate:.0f} shards/s", file=sys.stderr)
+
+class InventoryQuery:
+    """Count, filter and aggregate an inventory file chunk by chunk over its memory-mapped columns"""
+
+    CHUNK_ROWS = 1 << 20
+    WHERE_PATTERN = re.compile(r"^\s*(\w+)\s*(==|=|!=|<=|>=|<|>)\s*([0-9,\s]+)$")
+
+    def __init__(self, path: str, where: List[str]) -> None:
+        try:
+            import numpy
+        except ImportError:
+            print("Error: numpy library is not installed.")
+            print("Please install it using: pip install numpy")
+            sys.exit(1)
+        try:
+            self.reader = common.ColumnarReader(path)
+        except (OSError, ValueError) as e:
+            print(f"Error: failed to open inventory {path}: {e}")
+            sys.exit(1)
+        self.filters = []
+        for condition in where:
+            match = self.WHERE_PATTERN.match(condition)
+            if not match or match[1] not in self.reader.columns:
+                print(f"Error: invalid --where {condition}, expect <column><op><value>[,value...] "
+                      f"with column in {','.join(self.reader.columns)}")
+                sys.exit(1)
+            values = [int(value) for value in match[3].replace(" ", "").split(",") if value]
+            self.filters.append((match[1], match[2], values))
+
+    def chunks(self) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """Yield (columns, mask) of every chunk, columns are loaded lazily by name"""
+        import numpy as np
+        columns = {name: self.reader.column(name) for name in self.reader.columns}
+        for start in range(0, self.reader.rows, self.CHUNK_ROWS):
+            end = min(self.reader.rows, start + self.CHUNK_ROWS)
+            chunk = {name: column[start:end] for name, column in columns.items()}
+            mask = np.ones(end - start, dtype=bool)
+            for name, op, values in self.filters:
+                column = chunk[name]
+                if op in ("=", "=="):
+                    mask &= np.isin(column, values)
+                elif op == "!=":
+                    mask &= ~np.isin(column, values)
+                elif op == "<":
+                    mask &= column < values[0]
+                elif op == "<=":
+                    mask &= column <= values[0]
+                elif op == ">":
+                    mask &= column > values[0]
+                elif op == ">=":
+                    mask &= column >= values[0]
+            yield chunk, mask
+
+    def aggregate(self, group_by: Optional[str]) -> Dict[int, List[int]]:
+        """{group: [shards, bytes]}, a single group -1 without group_by"""
+        import numpy as np
+        groups: Dict[int, List[int]] = {}
+        for chunk, mask in self.chunks():
+            sizes = chunk["size"][mask].astype(np.uint64)
+            if group_by is None:
+                total = groups.setdefault(-1, [0, 0])
+                total[0] += int(mask.sum())
+                total[1] += int(sizes.sum())
+                continue
+            keys, inverse, counts = np.unique(chunk[group_by][mask], return_inverse=True, return_counts=True)
+            sums = np.bincount(inverse, weights=sizes, minlength=len(keys))
+            for key, count, size in zip(keys.tolist(), counts.tolist(), sums.tolist()):
+                total = groups.setdefault(key, [0, 0])
+                total[0] += count
+                total[1] += int(size)
+        return groups
+
+    def head(self, limit: int) -> Iterator[Dict[str, int]]:
+        names = list(self.reader.columns)
+        for chunk, mask in self.chunks():
+            selected = {name: chunk[name][mask][:limit].tolist() for name in names}
+            for i in range(len(selected[names[0]])):
+                yield {name: selected[name][i] for name in names}
+                limit -= 1
+            if limit <= 0:
+                return
+
+class BalancePlanner:
+    """
+    Plan the chunk moves that bring every disk within band chunks of the average usage of its group. A group
+    is the disks of one disk set in one idc, or in one rack with scope rack, as a chunk only moves to a disk
+    its volume could have been allocated on. The largest surplus and deficit are paired from two heaps and
+    every pair drains one of them, so a group of n disks plans in O(n log n) with fewer than n transfers.
+    """
+
+    def __init__(self, band: float, scope: str = "idc") -> None:
+        self.band = band
+        self.scope = scope
+        # group -> [(disk_id, used_chunk_cnt, max_chunk_cnt)]
+        self.groups: Dict[Tuple[Any, ...], List[Tuple[int, int, int]]] = {}
+        self.skipped = 0
+
+    def add(self, disk: Dict[str, Any]) -> None:
+        """Only normal writable disks are balanced, the others neither give nor take chunks"""
+        if disk.get("status", 1) != 1 or disk.get("readonly"):
+            self.skipped += 1
+            return
+        key: Tuple[Any, ...] = (disk.get("disk_set_id", 0), disk.get("idc", ""))
+        if self.scope == "rack":
+            key += (disk.get("rack", ""),)
+        used = disk.get("used_chunk_cnt", 0)
+        total = disk.get("max_chunk_cnt") or used + disk.get("free_chunk_cnt", 0)
+        self.groups.setdefault(key, []).append((disk["disk_id"], used, total))
+
+    def plan(self) -> List[Dict[str, Any]]:
+        return [self.plan_group(key, disks) for key, disks in sorted(self.groups.items())]
+
+    def plan_group(self, key: Tuple[Any, ...], disks: List[Tuple[int, int, int]]) -> Dict[str, Any]:
+        used_total = sum(used for _, used, _ in disks)
+        capacity = sum(total for _, _, total in disks)
+        ratio = used_total / capacity if capacity else 0.0
+        # chunks each disk must give or take to get into the band, and may give or take and stay in it
+        give: Dict[int, int] = {}
+        take: Dict[int, int] = {}
+        spare_give: List[Tuple[int, int]] = []
+        spare_take: List[Tuple[int, int]] = []
+        low_ratio, high_ratio = 1.0, 0.0
+        for disk_id, used, total in disks:
+            target = ratio * total
+            high = min(total, math.floor(target + self.band))
+            low = max(0, math.ceil(target - self.band))
+            if used > high:
+                give[disk_id] = used - high
+            elif used < low:
+                take[disk_id] = low - used
+            if used > low:
+                spare_give.append((low - min(used, high), disk_id))
+            if used < high:
+                spare_take.append((max(used, low) - high, disk_id))
+            if total:
+                low_ratio = min(low_ratio, used / total)
+                high_ratio = max(high_ratio, used / total)
+        over = sum(give.values())
+        under = sum(take.values())
+        # what one side of the band can't absorb is spread over the disks with the most room left in it
+        if over != under:
+            extra, spare = (take, spare_take) if over > under else (give, spare_give)
+            need = abs(over - under)
+            heapq.heapify(spare)
+            while need > 0 and spare:
+                chunks, disk_id = heapq.heappop(spare)
+                chunks = min(-chunks, need)
+                extra[disk_id] = extra.get(disk_id, 0) + chunks
+                need -= chunks
+        # heaps of (-chunks, disk_id)
+        givers = [(-chunks, disk_id) for disk_id, chunks in give.items()]
+        takers = [(-chunks, disk_id) for disk_id, chunks in take.items()]
+        heapq.heapify(givers)
+        heapq.heapify(takers)
+        transfers: List[Tuple[int, int, int]] = []
+        moves = 0
+        while givers and takers:
+            give_left, src = heapq.heappop(givers)
+            take_left, dst = heapq.heappop(takers)
+            chunks = min(-give_left, -take_left)
+            transfers.append((src, dst, chunks))
+            moves += chunks
+            if give_left + chunks < 0:
+                heapq.heappush(givers, (give_left + chunks, src))
+            if take_left + chunks < 0:
+                heapq.heappush(takers, (take_left + chunks, dst))
+        return {
+            "group": key, "disks": len(disks), "used": used_total, "capacity": capacity, "ratio": ratio,
+            "low_ratio": low_ratio if disks else 0.0, "high_ratio": high_ratio, "over": over, "under": under,
+            "moves": moves, "unplaced": -sum(chunks for chunks, _ in givers + takers), "transfers": transfers,
+        }
+
+def disk_sort_key(disk: Dict[str, Any]) -> tuple:
+    return (disk.get('idc', ''), disk.get('rack', ''), disk.get('host', ''), disk.get('disk_id', 0))
+
 class CLI:
     def __init__(self) -> None:
         self.args = self._parse_args()
+        common.CommandExecutor.configure_http_pool(self.args.http_pool_size, self.args.http_idle_timeout)
+        common.AsyncCommandExecutor.configure(self.args.host_concurrency)
+        common.CommandExecutor.configure_throttle(self.args.rate_limit, self.args.max_inflight,
+                                                  self.args.adaptive, self.args.latency_target / 1000)
+        common.HttpProfiler.configure(self.args.profile or bool(self.args.profile_prom))
+        common.ClustermgrRouter.configure(self.args.hedge_after / 1000)
+        common.MetadataCache.configure(self.args.cache_dir, int(self.args.cache_max_mb * (1 << 20)),
+                                       not self.args.no_cache, self.args.refresh)
 
     def _parse_args(self) -> argparse.Namespace:
         parser = argparse.ArgumentParser(description="Vstart Manager for Blobstore")
-        parser.add_argument('--host-cm', type=str, default='http://127.0.0.1:9998', help='Host and port for clustermgr service')
+        parser.add_argument('--host-cm', type=str, default='http://127.0.0.1:9998',
+                            help='Host and port for clustermgr service, comma separated for every raft member')
         parser.add_argument('--host-bn', type=str, default='http://127.0.0.1:8899', help='Host and port for blobnode service')
         parser.add_argument('--host-sc', type=str, default='http://127.0.0.1:9800', help='Host and port for scheduler service')
         parser.add_argument('--disk-id', type=int, help='Disk id of the shard to delete')
         parser.add_argument('-n', '--number', type=int, default=1, help='Number of options to process')
+        parser.add_argument('--count', type=int, default=DEFAULT_SHARD_PAGE_COUNT,
+                            help='Page size of shard listing from blobnode')
+        parser.add_argument('--concurrency', type=int,
+                            help='Concurrent shard deletions, default data_qos.level.delete.concurrency of blobnode')
+        parser.add_argument('--vuid-concurrency', type=int,
+                            help='Concurrent vuids to list, default same as --concurrency')
+        parser.add_argument('--journal', type=str,
+                            help='Progress journal of shard deletion, default shard-delete-<disk-id>.journal')
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Skip vuids and bids already deleted according to the journal')
+        parser.add_argument('--fresh', action='store_true', default=False,
+                            help='Discard the progress in an existing journal and start shard deletion over')
+        parser.add_argument('--bn-cfg', type=str, help='Blobnode config file to read default delete concurrency')
+        parser.add_argument('--http-pool-size', type=int, default=64,
+                            help='Max idle keep-alive connections kept per host')
+        parser.add_argument('--rate-limit', type=float, default=0,
+                            help='Max requests per second to each host, 0 for unlimited')
+        parser.add_argument('--max-inflight', type=int, default=0,
+                            help='Max in-flight requests to each host, 0 for unlimited')
+        parser.add_argument('--adaptive', action='store_true', default=False,
+                            help='Back off --rate-limit/--max-inflight AIMD-style on high latency or errors')
+        parser.add_argument('--latency-target', type=float, default=0,
+                            help='Latency in ms above which adaptive mode backs off, default twice the best seen')
+        parser.add_argument('--host-concurrency', type=int, default=32,
+                            help='Max concurrent async requests per host')
+        parser.add_argument('--http-idle-timeout', type=float, default=30.0,
+                            help='Seconds an idle keep-alive connection is reused before reconnecting')
+        parser.add_argument('--hedge-after', type=float, default=50,
+                            help='Ms after which a clustermgr read is also sent to the next member, 0 to only fail over')
+        parser.add_argument('--no-cache', action='store_true', default=False,
+                            help='Always ask clustermgr, neither read nor write the metadata cache')
+        parser.add_argument('--refresh', action='store_true', default=False,
+                            help='Ignore cached disk info, disk lists and vuid lists, then cache the fresh ones '
+                                 '(--shard-delete always does)')
+        parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                            help='Directory of the metadata cache, one file per clustermgr cluster')
+        parser.add_argument('--cache-max-mb', type=float, default=16,
+                            help='Size cap of each metadata cache file, least recently used entries go first')
+        parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                            help='Print metadata cache and clustermgr routing counters on exit')
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='Print calls, latency, bytes and errors per http endpoint on exit')
+        parser.add_argument('--profile-prom', type=str, metavar='FILE',
+                            help='Also write the --profile metrics to FILE in Prometheus text format')
         parser.add_argument('--shard-delete', action='store_true', default=False, help='Delete shards from blobnode')
         parser.add_argument('--disk-list', action='store_true', default=False, help='List all disk from clustermgr')
+        parser.add_argument('--page-size', type=int, default=10, help='Page size of disk listing from clustermgr')
+        parser.add_argument('--format', type=str, default='table', choices=['table', 'ndjson', 'csv'],
+                            help='Output format of disk listing, ndjson and csv are written row by row')
+        parser.add_argument('--sort', action='store_true', default=False,
+                            help='Sort disk listing by idc, rack, host and disk id, listing order otherwise')
+        parser.add_argument('--balance-plan', action='store_true', default=False,
+                            help='Plan the chunk moves that bring every disk within --balance-band of its disk set')
+        parser.add_argument('--balance-band', type=float, default=2,
+                            help='Chunks a disk may be off the average usage of its disk set, at least 1')
+        parser.add_argument('--balance-scope', type=str, default='idc', choices=['idc', 'rack'],
+                            help='Only move chunks between disks of the same disk set and idc or rack')
+        parser.add_argument('--inventory', type=str, metavar='FILE',
+                            help='Scan every shard of the cluster (or of --disk-id) into a columnar FILE')
+        parser.add_argument('--inventory-workers', type=int, default=64,
+                            help='Vuids scanned at once by --inventory, per host still capped by --host-concurrency')
+        parser.add_argument('--inventory-status', type=int, default=0,
+                            help='Shard status listed by --inventory, 0 for all')
+        parser.add_argument('--query', type=str, metavar='FILE', help='Count and aggregate an --inventory FILE')
+        parser.add_argument('--where', type=str, action='append', default=[],
+                            help='Filter of --query such as status=1, disk_id=3,4 or size>=65536, repeatable')
+        parser.add_argument('--group-by', type=str, choices=[name for name, _ in InventoryScanner.COLUMNS],
+                            help='Count shards and bytes of --query per value of this column')
+        parser.add_argument('--limit', type=int, default=20, help='Groups printed by --query --group-by, 0 for all')
+        parser.add_argument('--head', type=int, default=0, help='Also print the first N rows matching --query')
         parser.add_argument('--show', type=str, choices=['scstat', 'cmstat'], help='Show specify info')
+        parser.add_argument('--watch', type=str, nargs='?', const='cm,sc,bn',
+                            help='Poll stats of comma separated services (cm,sc,bn) and show rates of change')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between --watch samples, also the scheduler balance rate sampled by '
+                                 '--balance-plan, 0 to skip it')
+        parser.add_argument('--samples', type=int, default=0, help='Stop --watch after this many samples, 0 for never')
+        parser.add_argument('--history', type=int, default=720, help='Samples of --watch history kept in memory')
+        parser.add_argument('--export', type=str, help='Write --watch history to this csv/json file on exit')
         parser.add_argument('--task', type=str, default='all',
                             choices=['all', 'disk_repair', 'disk_drop', 'balance', 'manual_migrate',
                                      'volume_inspect', 'shard_repair', 'blob_delete'],
@@ -96,32 +870,68 @@ class CLI:
         if not self.args.disk_id:
             print("Error: --disk-id is required for shard deletion.")
             sys.exit(1)
+        if self.args.resume and self.args.fresh:
+            print("Error: --resume and --fresh are mutually exclusive.")
+            sys.exit(1)
+        journal = DeleteJournal(self.args.journal or f"shard-delete-{self.args.disk_id}.journal")
+        checkpoints = journal.load()
+        if checkpoints and not self.args.resume and not self.args.fresh:
+            print(f"Error: journal {journal.path} holds progress of {len(checkpoints)} vuids, "
+                  f"rerun with --resume to continue or --fresh to discard it")
+            sys.exit(1)
+        if not self.args.resume:
+            checkpoints = {}
 
         print(f"Starting delete shards on disk {self.args.disk_id} ...")
-        # get disk host
-        disk_host = HandleService.get_disk_host_from_cm(self.args.host_cm, self.args.disk_id)
+        # get disk host, deletion never acts on cached metadata: a disk moved to another host or a stale vuid
+        # list would send the deletes to the wrong place
+        disk_host = HandleService.get_disk_host_from_cm(self.args.host_cm, self.args.disk_id, fresh=True)
         # get volume info
-        vols = HandleService.get_vuid_list_from_cm(self.args.host_cm, self.args.disk_id)
+        vols = HandleService.get_vuid_list_from_cm(self.args.host_cm, self.args.disk_id, fresh=True)
         ordered_vols = sorted(vols, key=lambda d: d["free"])
         rows = ordered_vols if self.args.number == -1 else ordered_vols[:self.args.number]
-        for vol in rows:
-            vuid = vol["vuid"]
-            while True:
-                start_bid = 0
-                shards, next = HandleService.get_bid_list_from_bn(disk_host, self.args.disk_id, vuid, start_bid)
-                for shard in shards:
-                    bid = shard["bid"]
-                    success = HandleService.delete_shard_from_bn(disk_host, self.args.disk_id, vuid, bid)
-                    if success:
-                        print(f"Deleted shard: disk_id={self.args.disk_id}, vuid={vuid}, bid={bid}")
-                    else:
-                        print(f"Failed to delete shard: disk_id={self.args.disk_id}, vuid={vuid}, bid={bid}")
-                if next == 0 or next == -1:
-                    break
-                else:
-                    start_bid = next
+
+        concurrency = self.args.concurrency or ShardDeleter.default_concurrency(self.args.bn_cfg)
+        vuid_concurrency = self.args.vuid_concurrency or concurrency
+        journal.open(checkpoints)
+        deleter = ShardDeleter(disk_host, self.args.disk_id, self.args.count, vuid_concurrency, concurrency)
+        try:
+            stats = deleter.run([vol["vuid"] for vol in rows], journal, checkpoints)
+        except KeyboardInterrupt:
+            print(f"Interrupted, progress is saved in {journal.path}, rerun with --resume to continue")
+            sys.exit(130)
+        print(f"Finished delete shards on disk {self.args.disk_id}: vuids={stats.vuids_done}, "
+              f"skipped vuids={stats.vuids_skipped}, failed vuids={stats.vuids_failed}, "
+              f"success={stats.success}, failed={stats.failed}, "
+              f"elapsed={stats.elapsed():.1f}s, {stats.rate():.1f} bids/s")
+        if stats.failed > 0 or stats.vuids_failed > 0:
+            print("Error: failed vuids are journaled before their first failed bid, rerun with --resume to retry")
+            sys.exit(1)
 
     def disk_list(self) -> None:
+        disks = HandleService.iter_disk_list_from_cm(self.args.host_cm, self.args.page_size)
+        if self.args.sort:
+            disks = iter(sorted(disks, key=disk_sort_key))
+        if self.args.format == 'table':
+            self._print_disk_table(disks)
+            return
+        try:
+            if self.args.format == 'ndjson':
+                for disk in disks:
+                    sys.stdout.write(json.dumps(disk, separators=(',', ':')))
+                    sys.stdout.write("\n")
+            elif self.args.format == 'csv':
+                writer = csv.writer(sys.stdout)
+                writer.writerow(DISK_LIST_FIELDS)
+                for disk in disks:
+                    writer.writerow([disk.get(field, "") for field in DISK_LIST_FIELDS])
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # reader such as head went away, stop listing quietly
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+
+    def _print_disk_table(self, disks: Iterator[Dict[str, Any]]) -> None:
         try:
             from prettytable import PrettyTable
         except ImportError:
@@ -132,19 +942,7 @@ class CLI:
         table = PrettyTable()
         table.field_names = ["IDC", "Rack", "Host", "Path", "Status", "Readonly", "DiskSetID",
                              "NodeID", "DiskID", "Used", "Free", "Size", "MaxChk", "FreeChk", "UsedChk"]
-        marker = 0
-        all_disks = []
-        while True:
-            disks, marker = HandleService.get_disk_list_from_cm(self.args.host_cm, marker)
-            all_disks.extend(disks)
-            if marker == -1 or marker == 0:
-                break
-
-        sorted_all_disks = sorted(all_disks, key=lambda x: (x.get('idc', ''),
-                                                            x.get('rack', ''),
-                                                            x.get('host', ''),
-                                                            x.get('disk_id', 0)))
-        for disk in sorted_all_disks:
+        for disk in disks:
             idc = disk.get("idc", "")
             rock = disk.get("rack", "")
             host = disk.get("host", "")
@@ -164,6 +962,120 @@ class CLI:
                            used, free, size, max_chunk_cnt, free_chunk_cnt, used_chunk_cnt])
         print(table)
 
+    def balance_plan(self) -> None:
+        if self.args.balance_band < 1:
+            print("Error: --balance-band must be at least 1 chunk, a tighter band can't always be reached.")
+            sys.exit(1)
+        planner = BalancePlanner(self.args.balance_band, self.args.balance_scope)
+        for disk in HandleService.iter_disk_list_from_cm(self.args.host_cm, self.args.page_size):
+            planner.add(disk)
+        started = time.monotonic()
+        groups = planner.plan()
+        elapsed = time.monotonic() - started
+        disks = sum(group["disks"] for group in groups)
+        moves = sum(group["moves"] for group in groups)
+        print(f"planned {moves} chunk moves over {disks} disks in {len(groups)} groups in {elapsed * 1000:.0f}ms, "
+              f"{planner.skipped} disks skipped", file=sys.stderr)
+
+        if self.args.format != 'table':
+            keys = ["disk_set_id", "idc"] + (["rack"] if self.args.balance_scope == "rack" else [])
+            rows = ([*group["group"], src, dst, chunks] for group in groups for src, dst, chunks in group["transfers"])
+            keys += ["src_disk_id", "dst_disk_id", "chunks"]
+            try:
+                if self.args.format == 'csv':
+                    writer = csv.writer(sys.stdout)
+                    writer.writerow(keys)
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        sys.stdout.write(json.dumps(dict(zip(keys, row)), separators=(',', ':')))
+                        sys.stdout.write("\n")
+                sys.stdout.flush()
+            except BrokenPipeError:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                sys.exit(1)
+            return
+
+        try:
+            name = "disk set/idc/rack" if self.args.balance_scope == "rack" else "disk set/idc"
+            print(f"{name:<24} {'disks':>7} {'used':>10} {'avg':>7} {'min':>7} {'max':>7} "
+                  f"{'over':>9} {'under':>9} {'moves':>9} {'transfers':>9}")
+            ordered = sorted(groups, key=lambda group: -group["moves"])
+            for group in ordered[:self.args.limit] if self.args.limit > 0 else ordered:
+                label = "/".join(str(part) for part in group["group"])
+                print(f"{label:<24} {group['disks']:>7} {group['used']:>10} {group['ratio']:>7.2%} "
+                      f"{group['low_ratio']:>7.2%} {group['high_ratio']:>7.2%} {group['over']:>9} {group['under']:>9} "
+                      f"{group['moves']:>9} {len(group['transfers']):>9}")
+            unplaced = sum(group["unplaced"] for group in groups)
+            if unplaced:
+                print(f"{unplaced} chunks can't be placed within the band")
+            self._print_balance_convergence(moves)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+
+    def _print_balance_convergence(self, moves: int) -> None:
+        """Time the plan would take at the balance rate the scheduler finishes tasks now, one chunk a task"""
+        if moves == 0 or self.args.interval <= 0:
+            return
+        first = HandleService.get_sc_stat(self.args.host_sc, "balance").get("finished_tasks_cnt")
+        started = time.monotonic()
+        if first is None:
+            return
+        print(f"sampling scheduler balance for {self.args.interval:g}s ...", file=sys.stderr)
+        time.sleep(self.args.interval)
+        last = HandleService.get_sc_stat(self.args.host_sc, "balance").get("finished_tasks_cnt")
+        if last is None:
+            return
+        rate = (last - first) / (time.monotonic() - started)
+        if rate <= 0:
+            print(f"scheduler balance finished no task in {self.args.interval:g}s, the plan never converges")
+            return
+        print(f"scheduler balance finishes {rate:.2f} tasks/s, the plan converges in "
+              f"{common.HumanReadable.human_duration(moves / rate)} if usage holds still")
+
+    def inventory(self) -> None:
+        disks: List[Tuple[int, str]] = []
+        if self.args.disk_id:
+            disks.append((self.args.disk_id, HandleService.get_disk_host_from_cm(self.args.host_cm, self.args.disk_id)))
+        writer = common.ColumnarWriter(self.args.inventory, InventoryScanner.COLUMNS)
+        scanner = InventoryScanner(self.args.host_cm, self.args.count, self.args.inventory_workers,
+                                   self.args.inventory_status)
+        try:
+            common.AsyncCommandExecutor.run(scanner.run(writer, disks))
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        print(f"Inventory of {scanner.shards} shards on {scanner.disks} disks written to {self.args.inventory}")
+        if scanner.failed_vuids > 0:
+            print(f"Error: listing failed for {scanner.failed_vuids} vuids, their shards are missing")
+            sys.exit(1)
+
+    def query(self) -> None:
+        query = InventoryQuery(self.args.query, self.args.where)
+        groups = query.aggregate(self.args.group_by)
+        if self.args.group_by is None:
+            shards, size = groups.get(-1, [0, 0])
+            print(f"rows: {query.reader.rows}, matched shards: {shards}, "
+                  f"bytes: {size} ({common.HumanReadable.human_bytes(size)})")
+        else:
+            ordered = sorted(groups.items(), key=lambda item: (-item[1][0], item[0]))
+            if self.args.limit > 0:
+                ordered = ordered[:self.args.limit]
+            if self.args.format == 'csv':
+                writer = csv.writer(sys.stdout)
+                writer.writerow([self.args.group_by, "shards", "bytes"])
+                writer.writerows([key, shards, size] for key, (shards, size) in ordered)
+            else:
+                print(f"{self.args.group_by:>20} {'shards':>14} {'bytes':>20}")
+                for key, (shards, size) in ordered:
+                    print(f"{key:>20} {shards:>14} {common.HumanReadable.human_bytes(size):>20}")
+            print(f"{len(groups)} groups", file=sys.stderr)
+        for row in query.head(self.args.head) if self.args.head > 0 else []:
+            print(json.dumps(row))
+
     def show_scheduler_stat(self) -> None:
         result = HandleService.get_sc_stat(self.args.host_sc, self.args.task)
         print(json.dumps(result, indent=2))
@@ -172,11 +1084,85 @@ class CLI:
         result = HandleService.get_cm_stat(self.args.host_cm)
         print(json.dumps(result, indent=2))
 
+    def watch(self) -> None:
+        targets = [target.strip() for target in self.args.watch.split(",") if target.strip()]
+        unknown = [target for target in targets if target not in ('cm', 'sc', 'bn')]
+        if unknown or not targets:
+            print(f"Error: unknown --watch services {','.join(unknown)}, expect cm, sc or bn")
+            sys.exit(1)
+
+        history = common.MetricsHistory(self.args.history)
+        try:
+            common.AsyncCommandExecutor.run(self._watch_loop(targets, history))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.args.export:
+                history.export(self.args.export)
+                print(f"History of {len(history.timestamps)} samples written to {self.args.export}")
+
+    async def _watch_loop(self, targets: List[str], history: common.MetricsHistory) -> None:
+        pollers = {
+            'cm': lambda: AsyncHandleService.get_cm_stat(self.args.host_cm),
+            'sc': lambda: AsyncHandleService.get_sc_stat(self.args.host_sc, self.args.task),
+            'bn': lambda: AsyncHandleService.get_bn_stat(self.args.host_bn),
+        }
+        sample_count = 0
+        while self.args.samples <= 0 or sample_count < self.args.samples:
+            started = time.monotonic()
+            timestamp = time.time()
+            results = await asyncio.gather(*(pollers[target]() for target in targets))
+            metrics: Dict[str, float] = {}
+            for target, result in zip(targets, results):
+                common.MetricsHistory.flatten(target, result, metrics)
+            history.add_sample(timestamp, metrics)
+            sample_count += 1
+            self._print_watch(timestamp, history, metrics)
+            await asyncio.sleep(max(0.0, self.args.interval - (time.monotonic() - started)))
+
+    def _print_watch(self, timestamp: float, history: common.MetricsHistory, metrics: Dict[str, float]) -> None:
+        print(f"==== {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} "
+              f"({len(metrics)} metrics) ====")
+        changes = history.changes()
+        for name, value, delta, rate in changes:
+            value_text = common.MetricsHistory.format_value(value)
+            delta_text = ("+" if delta > 0 else "") + common.MetricsHistory.format_value(delta)
+            print(f"  {name:<60} {value_text:>16} {delta_text:>14} {rate:>12.2f}/s")
+        if len(history.timestamps) > 1:
+            print(f"  {len(metrics) - len(changes)} metrics unchanged")
+        sys.stdout.flush()
+
     def run(self) -> None:
+        try:
+            self._run()
+        finally:
+            common.MetadataCache.save_all()
+            if self.args.verbose:
+                for line in common.MetadataCache.summary_all():
+                    print(f"cache {line}", file=sys.stderr)
+                for line in common.ClustermgrRouter.summary_all():
+                    print(f"clustermgr {line}", file=sys.stderr)
+            if self.args.profile:
+                print("http profile:", file=sys.stderr)
+                for line in common.HttpProfiler.summary():
+                    print(f"  {line}", file=sys.stderr)
+            if self.args.profile_prom:
+                common.HttpProfiler.write_prometheus(self.args.profile_prom, "blobstore_cli")
+
+    def _run(self) -> None:
+        if self.args.watch:
+            self.watch()
+            return
         if self.args.shard_delete:
             self.delete_shard()
         if self.args.disk_list:
             self.disk_list()
+        if self.args.balance_plan:
+            self.balance_plan()
+        if self.args.inventory:
+            self.inventory()
+        if self.args.query:
+            self.query()
         if self.args.show:
             if self.args.show == 'scstat':
                 self.show_scheduler_stat()
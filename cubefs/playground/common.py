@@ -1,14 +1,661 @@
 import os
 import sys
 import json
+import time
+import asyncio
+import bisect
+import threading
+import math
+import queue
+import re
+import fcntl
+import struct
 import subprocess
-from urllib.request import urlopen, Request
-from urllib.error import URLError, HTTPError
-from typing import Union, Any, List, Dict
+from array import array
+from collections import OrderedDict
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+from typing import Union, Any, List, Dict, Tuple, Optional
+
+class HttpConnectionPool:
+    """Per-host pool of persistent HTTP/1.1 connections, reconnecting when a kept-alive one is broken"""
+
+    # errors raised when the server has closed an idle keep-alive connection
+    STALE_ERRORS = (BrokenPipeError, ConnectionResetError, ConnectionAbortedError, HTTPException)
+    # errors of sending on such a connection, the server never saw the request
+    SEND_ERRORS = (BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+    # methods safe to resend when the connection broke after the request was sent, a POST may have been applied
+    IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+    def __init__(self, pool_size: int = 64, idle_timeout: float = 30.0) -> None:
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str, int], List[Tuple[HTTPConnection, float]]] = {}
+
+    def request(self, method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"unsupported url: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path)
+            except self.SEND_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            try:
+                response = conn.getresponse()
+                body = response.read()
+            except self.STALE_ERRORS:
+                conn.close()
+                if reused and method in self.IDEMPOTENT_METHODS:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, body
+
+    def clear(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def _acquire(self, key: Tuple[str, str, int], timeout: float) -> Tuple[HTTPConnection, bool]:
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self._lock:
+            conns = self._idle.get(key, [])
+            while conns:
+                candidate, last_used = conns.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                break
+        for candidate in expired:
+            candidate.close()
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        scheme, host, port = key
+        if scheme == "https":
+            return HTTPSConnection(host, port, timeout=timeout), False
+        return HTTPConnection(host, port, timeout=timeout), False
+
+    def _release(self, key: Tuple[str, str, int], conn: HTTPConnection) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.pool_size:
+                conns.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+class TokenBucket:
+    """Token bucket allowing rate tokens per second with bursts up to burst tokens, rate 0 means unlimited"""
+
+    def __init__(self, rate: float, burst: float = 0) -> None:
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill_locked()
+            self.rate = rate
+            self.burst = max(1.0, rate)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self) -> float:
+        """Take one token and return how long the caller has to wait before using it"""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            self._refill_locked()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+class HostThrottle:
+    """
+    Limit requests/s and in-flight requests against one host.
+    In adaptive mode both limits back off AIMD-style: they are halved when the error rate or latency
+    of the last interval is too high, and grow additively back towards the configured maximum otherwise.
+    """
+
+    MIN_RATE = 1.0
+    MIN_CONCURRENCY = 1
+    # concurrency ceiling of adaptive mode when no --max-inflight is given
+    DEFAULT_ADAPTIVE_CONCURRENCY = 32
+
+    def __init__(self, rate: float = 0, concurrency: int = 0, adaptive: bool = False,
+                 latency_target: float = 0, error_threshold: float = 0.05, interval: float = 1.0) -> None:
+        if adaptive and concurrency <= 0:
+            concurrency = self.DEFAULT_ADAPTIVE_CONCURRENCY
+        self.max_rate = rate
+        self.max_concurrency = concurrency
+        self.adaptive = adaptive
+        self.latency_target = latency_target
+        self.error_threshold = error_threshold
+        self.interval = interval
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self._cond = threading.Condition()
+        self._inflight = 0
+        # samples of the current adjust interval, and the best latency seen as baseline
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._window_errors = 0
+        self._window_latency = 0.0
+        self._baseline_latency = 0.0
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.concurrency > 0 and self._inflight >= self.concurrency:
+                self._cond.wait()
+            self._inflight += 1
+        wait = self.bucket.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, latency: float, success: bool) -> None:
+        with self._cond:
+            self._inflight -= 1
+            if self.adaptive:
+                self._observe_locked(latency, success)
+            self._cond.notify_all()
+
+    def observe(self, latency: float, success: bool) -> None:
+        """Feed a sample from a caller that does its own concurrency control"""
+        if self.adaptive:
+            with self._cond:
+                self._observe_locked(latency, success)
+                self._cond.notify_all()
+
+    def _observe_locked(self, latency: float, success: bool) -> None:
+        self._window_count += 1
+        self._window_latency += latency
+        if not success:
+            self._window_errors += 1
+        now = time.monotonic()
+        if now - self._window_start < self.interval:
+            return
+
+        mean_latency = self._window_latency / self._window_count
+        error_rate = self._window_errors / self._window_count
+        if self._baseline_latency == 0 or mean_latency < self._baseline_latency:
+            self._baseline_latency = mean_latency
+        latency_target = self.latency_target or self._baseline_latency * 2
+        if error_rate > self.error_threshold or mean_latency > latency_target:
+            self.concurrency = max(self.MIN_CONCURRENCY, self.concurrency // 2)
+            if self.max_rate > 0:
+                self.bucket.set_rate(max(self.MIN_RATE, self.bucket.rate / 2))
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            if self.max_rate > 0:
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate + max(self.MIN_RATE, self.max_rate / 20)))
+
+        self._window_start = now
+        self._window_count = 0
+        self._window_errors = 0
+        self._window_latency = 0.0
+
+    def summary(self) -> str:
+        rate = f"{self.bucket.rate:.0f} req/s" if self.bucket.rate > 0 else "unlimited req/s"
+        concurrency = f"{self.concurrency} inflight" if self.concurrency > 0 else "unlimited inflight"
+        return f"{rate}, {concurrency}"
+
+class AsyncHttpClient:
+    """asyncio HTTP/1.1 client keeping connections alive, with a semaphore per host capping concurrency"""
+
+    STALE_ERRORS = (asyncio.IncompleteReadError, BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+    SEND_ERRORS = HttpConnectionPool.SEND_ERRORS
+
+    def __init__(self, per_host_limit: int = 32, idle_timeout: float = 30.0) -> None:
+        self.per_host_limit = per_host_limit
+        self.idle_timeout = idle_timeout
+        self.loop = asyncio.get_running_loop()
+        self._semaphores: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+        self._idle: Dict[Tuple[str, int], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+
+    async def request(self, method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"unsupported url: {url}")
+        key = (parts.hostname, parts.port or 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        request = (f"{method} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                   f"Content-Length: 0\r\nConnection: keep-alive\r\n\r\n").encode('ascii')
+
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self.per_host_limit)
+        async with semaphore:
+            idempotent = method in HttpConnectionPool.IDEMPOTENT_METHODS
+            return await asyncio.wait_for(self._roundtrip(key, request, idempotent), timeout)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for _, writer, _ in conns:
+                writer.close()
+
+    async def _roundtrip(self, key: Tuple[str, int], request: bytes, idempotent: bool) -> Tuple[int, bytes]:
+        """A reused connection found broken is retried on a new one, after the send only for idempotent requests"""
+        while True:
+            reader, writer, reused = await self._acquire(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+            except self.SEND_ERRORS:
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            try:
+                status, keep_alive, body = await self._read_response(reader)
+            except self.STALE_ERRORS:
+                writer.close()
+                if reused and idempotent:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.setdefault(key, []).append((reader, writer, time.monotonic()))
+            else:
+                writer.close()
+            return status, body
+
+    async def _acquire(self, key: Tuple[str, int]) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        now = time.monotonic()
+        conns = self._idle.get(key, [])
+        while conns:
+            reader, writer, last_used = conns.pop()
+            if now - last_used > self.idle_timeout or reader.at_eof():
+                writer.close()
+                continue
+            return reader, writer, True
+        reader, writer = await asyncio.open_connection(key[0], key[1])
+        return reader, writer, False
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bool, bytes]:
+        status_line = await reader.readuntil(b"\r\n")
+        version, status, _ = (status_line.decode('latin-1').rstrip("\r\n") + "  ").split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), keep_alive, body
+
+class EndpointStats:
+    """Counters and a latency histogram of one endpoint template"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.bytes_in = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(HttpProfiler.BUCKETS) + 1)
+        self.errors: Dict[str, int] = {}
+        # requests given up by the caller, such as the losers of a hedge, in none of the counts above
+        self.cancelled = 0
+
+    def percentile(self, q: float) -> float:
+        """Latency at quantile q, interpolated inside its histogram bucket"""
+        rank = q * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                low = HttpProfiler.BUCKETS[index - 1] if index > 0 else 0.0
+                high = HttpProfiler.BUCKETS[index] if index < len(HttpProfiler.BUCKETS) else self.latency_max
+                return min(low + (high - low) * (rank - seen) / count, self.latency_max)
+            seen += count
+        return self.latency_max
+
+class HttpProfiler:
+    """
+    Per endpoint template counts, latency histogram, bytes received and errors by class of every http request
+    made through CommandExecutor and AsyncCommandExecutor. Recording is off until enabled.
+    """
+    # bucket upper bounds in seconds, sqrt(2) apart from 100us to about 100s
+    BUCKETS = [0.0001 * 2 ** (i / 2) for i in range(41)]
+    NUMBER_SEGMENT = re.compile(r"/-?\d+(?=/|$)")
+    enabled = False
+    _stats: Dict[Tuple[str, str], EndpointStats] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def configure(enabled: bool) -> None:
+        with HttpProfiler._lock:
+            HttpProfiler.enabled = enabled
+            HttpProfiler._stats = {}
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        """Template of url, numeric path segments become * and query values are dropped"""
+        parts = urlsplit(url)
+        path = HttpProfiler.NUMBER_SEGMENT.sub("/*", parts.path or "/")
+        if parts.query:
+            path += "?" + "&".join(sorted(item.split("=", 1)[0] for item in parts.query.split("&")))
+        return path
+
+    @staticmethod
+    def record(method: str, url: str, latency: float, status: int = 0, bytes_in: int = 0,
+               error: Optional[BaseException] = None) -> None:
+        key = (method, HttpProfiler.endpoint(url))
+        bucket = bisect.bisect_left(HttpProfiler.BUCKETS, latency)
+        with HttpProfiler._lock:
+            stats = HttpProfiler._stats.get(key)
+            if stats is None:
+                stats = HttpProfiler._stats[key] = EndpointStats()
+            stats.calls += 1
+            stats.bytes_in += bytes_in
+            stats.latency_sum += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            stats.buckets[bucket] += 1
+            # 5xx and 429 are failures of an answering node, other statuses are answers
+            name = type(error).__name__ if error is not None else (f"HTTP{status}" if status >= 500 or status == 429 else "")
+            if name:
+                stats.errors[name] = stats.errors.get(name, 0) + 1
+
+    @staticmethod
+    def record_cancelled(method: str, url: str) -> None:
+        key = (method, HttpProfiler.endpoint(url))
+        with HttpProfiler._lock:
+            stats = HttpProfiler._stats.get(key)
+            if stats is None:
+                stats = HttpProfiler._stats[key] = EndpointStats()
+            stats.cancelled += 1
+
+    @staticmethod
+    def summary() -> List[str]:
+        """Aligned table of every endpoint, the most time spent first"""
+        with HttpProfiler._lock:
+            items = sorted(HttpProfiler._stats.items(), key=lambda item: -item[1].latency_sum)
+            rows = [["method", "endpoint", "calls", "errors", "cancelled", "p50_ms", "p99_ms", "max_ms", "total_s",
+                     "received"]]
+            for (method, endpoint), stats in items:
+                rows.append([method, endpoint, str(stats.calls), str(sum(stats.errors.values())), str(stats.cancelled),
+                             f"{stats.percentile(0.5) * 1000:.2f}", f"{stats.percentile(0.99) * 1000:.2f}",
+                             f"{stats.latency_max * 1000:.2f}", f"{stats.latency_sum:.3f}",
+                             HumanReadable.human_bytes(stats.bytes_in)])
+            errors = [f"{method} {endpoint}: " + ", ".join(f"{name}={count}" for name, count in
+                                                            sorted(stats.errors.items(), key=lambda e: -e[1]))
+                      for (method, endpoint), stats in items if stats.errors]
+        if len(rows) == 1:
+            return ["no http requests"]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for n, row in enumerate(rows):
+            # method and endpoint are left aligned, numbers right aligned
+            lines.append("  ".join(cell.ljust(width) if i < 2 else cell.rjust(width)
+                                   for i, (cell, width) in enumerate(zip(row, widths))))
+            if n == 0:
+                lines.append("  ".join("-" * width for width in widths))
+        if errors:
+            lines.append("errors by class:")
+            lines.extend(f"  {line}" for line in errors)
+        return lines
+
+    @staticmethod
+    def prometheus(prefix: str) -> str:
+        """Every endpoint in the Prometheus text exposition format"""
+        def labels(method: str, endpoint: str, **extra: str) -> str:
+            pairs = {"method": method, "endpoint": endpoint, **extra}
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs.items()) + "}"
+
+        with HttpProfiler._lock:
+            items = sorted(HttpProfiler._stats.items())
+            lines = [f"# HELP {prefix}_http_request_duration_seconds Latency of http requests per endpoint template",
+                     f"# TYPE {prefix}_http_request_duration_seconds histogram"]
+            for (method, endpoint), stats in items:
+                cumulative = 0
+                for bound, count in zip(HttpProfiler.BUCKETS + [math.inf], stats.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else f"{bound:.6g}"
+                    lines.append(f"{prefix}_http_request_duration_seconds_bucket{labels(method, endpoint, le=le)} {cumulative}")
+                lines.append(f"{prefix}_http_request_duration_seconds_sum{labels(method, endpoint)} {stats.latency_sum:.6f}")
+                lines.append(f"{prefix}_http_request_duration_seconds_count{labels(method, endpoint)} {stats.calls}")
+            lines += [f"# HELP {prefix}_http_response_bytes_total Bytes of http response bodies per endpoint template",
+                      f"# TYPE {prefix}_http_response_bytes_total counter"]
+            lines += [f"{prefix}_http_response_bytes_total{labels(method, endpoint)} {stats.bytes_in}"
+                      for (method, endpoint), stats in items]
+            lines += [f"# HELP {prefix}_http_errors_total Failed http requests per endpoint template and error class",
+                      f"# TYPE {prefix}_http_errors_total counter"]
+            lines += [f"{prefix}_http_errors_total{labels(method, endpoint, error=name)} {count}"
+                      for (method, endpoint), stats in items for name, count in sorted(stats.errors.items())]
+            lines += [f"# HELP {prefix}_http_cancelled_total Http requests cancelled by the caller per endpoint template",
+                      f"# TYPE {prefix}_http_cancelled_total counter"]
+            lines += [f"{prefix}_http_cancelled_total{labels(method, endpoint)} {stats.cancelled}"
+                      for (method, endpoint), stats in items]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_prometheus(path: str, prefix: str) -> None:
+        try:
+            with open(path, 'w') as f:
+                f.write(HttpProfiler.prometheus(prefix))
+        except OSError as e:
+            print(f"warning: failed to write profile {path}: {e}", file=sys.stderr)
+
+class AsyncCommandExecutor:
+    """Async twins of the CommandExecutor http helpers, sharing one AsyncHttpClient per event loop"""
+
+    per_host_limit = 32
+    _client: Optional[AsyncHttpClient] = None
+
+    @staticmethod
+    def configure(per_host_limit: int = 32) -> None:
+        AsyncCommandExecutor.per_host_limit = per_host_limit
+        AsyncCommandExecutor._client = None
+
+    @staticmethod
+    def client() -> AsyncHttpClient:
+        client = AsyncCommandExecutor._client
+        if client is None or client.loop is not asyncio.get_running_loop():
+            client = AsyncHttpClient(AsyncCommandExecutor.per_host_limit)
+            AsyncCommandExecutor._client = client
+        return client
+
+    @staticmethod
+    def run(coro: Any) -> Any:
+        """Run a coroutine on a new event loop, closing the pooled connections afterwards"""
+        async def _wrapper() -> Any:
+            try:
+                return await coro
+            finally:
+                if AsyncCommandExecutor._client is not None:
+                    await AsyncCommandExecutor._client.close()
+                    AsyncCommandExecutor._client = None
+        return asyncio.run(_wrapper())
+
+    @staticmethod
+    async def _timed_request(method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        if not HttpProfiler.enabled:
+            return await AsyncCommandExecutor.client().request(method, url, timeout)
+        start = time.monotonic()
+        try:
+            status, body = await AsyncCommandExecutor.client().request(method, url, timeout)
+        except asyncio.CancelledError:
+            # a hedge loser or a stopped task, neither an answer nor a failure of the endpoint
+            HttpProfiler.record_cancelled(method, url)
+            raise
+        except BaseException as e:
+            HttpProfiler.record(method, url, time.monotonic() - start, error=e)
+            raise
+        HttpProfiler.record(method, url, time.monotonic() - start, status, len(body))
+        return status, body
+
+    @staticmethod
+    async def _http_request(method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        # concurrency is capped by the client semaphores, the throttle only paces the request rate
+        throttle = CommandExecutor.get_throttle(url)
+        if throttle is None:
+            return await AsyncCommandExecutor._timed_request(method, url, timeout)
+        wait = throttle.bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        start = time.monotonic()
+        try:
+            status, body = await AsyncCommandExecutor._timed_request(method, url, timeout)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            throttle.observe(time.monotonic() - start, False)
+            raise
+        throttle.observe(time.monotonic() - start, status < 500 and status != 429)
+        return status, body
+
+    @staticmethod
+    async def run_http_get_json(url: str, timeout=5) -> Union[Dict[str, Any], List[Any]]:
+        try:
+            status, body = await AsyncCommandExecutor._http_request('GET', url, timeout)
+            if status != 200:
+                return {}
+            return json.loads(body.decode('utf-8'))
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        return {}
+
+    @staticmethod
+    async def run_http_post(url: str, timeout=5) -> bool:
+        try:
+            status, _ = await AsyncCommandExecutor._http_request('POST', url, timeout)
+            return status == 200
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        return False
 
 class CommandExecutor:
     """Command execution tool class, encapsulating subprocess calls and error handling"""
 
+    http_pool = HttpConnectionPool()
+    # HostThrottle keyword arguments, None when requests are not throttled
+    throttle_config: Optional[Dict[str, Any]] = None
+    throttles: Dict[str, HostThrottle] = {}
+    _throttles_lock = threading.Lock()
+    # daemons started by run_background_daemon
+    _daemons: List[subprocess.Popen] = []
+    _daemons_lock = threading.Lock()
+
+    @staticmethod
+    def configure_http_pool(pool_size: int = 64, idle_timeout: float = 30.0) -> None:
+        CommandExecutor.http_pool.clear()
+        CommandExecutor.http_pool = HttpConnectionPool(pool_size, idle_timeout)
+
+    @staticmethod
+    def configure_throttle(rate: float = 0, concurrency: int = 0, adaptive: bool = False,
+                           latency_target: float = 0) -> None:
+        with CommandExecutor._throttles_lock:
+            CommandExecutor.throttles = {}
+            if rate <= 0 and concurrency <= 0 and not adaptive:
+                CommandExecutor.throttle_config = None
+                return
+            CommandExecutor.throttle_config = {"rate": rate, "concurrency": concurrency,
+                                               "adaptive": adaptive, "latency_target": latency_target}
+
+    @staticmethod
+    def get_throttle(url: str) -> Optional[HostThrottle]:
+        if CommandExecutor.throttle_config is None:
+            return None
+        host = urlsplit(url).netloc
+        with CommandExecutor._throttles_lock:
+            throttle = CommandExecutor.throttles.get(host)
+            if throttle is None:
+                throttle = HostThrottle(**CommandExecutor.throttle_config)
+                CommandExecutor.throttles[host] = throttle
+            return throttle
+
+    @staticmethod
+    def _timed_request(method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        if not HttpProfiler.enabled:
+            return CommandExecutor.http_pool.request(method, url, timeout)
+        start = time.monotonic()
+        try:
+            status, body = CommandExecutor.http_pool.request(method, url, timeout)
+        except BaseException as e:
+            HttpProfiler.record(method, url, time.monotonic() - start, error=e)
+            raise
+        HttpProfiler.record(method, url, time.monotonic() - start, status, len(body))
+        return status, body
+
+    @staticmethod
+    def _http_request(method: str, url: str, timeout: float) -> Tuple[int, bytes]:
+        throttle = CommandExecutor.get_throttle(url)
+        if throttle is None:
+            return CommandExecutor._timed_request(method, url, timeout)
+        throttle.acquire()
+        start = time.monotonic()
+        success = False
+        try:
+            status, body = CommandExecutor._timed_request(method, url, timeout)
+            # 429 and 5xx tell that the node is overloaded, other statuses are answers of a healthy node
+            success = status < 500 and status != 429
+            return status, body
+        finally:
+            throttle.release(time.monotonic() - start, success)
+
     @staticmethod
     def _get_run_kwargs(capture_output: bool) -> Dict[str, Any]:
         if sys.version_info >= (3, 7):
@@ -75,31 +722,22 @@ class CommandExecutor:
             sys.exit(1)
 
     @staticmethod
-    def run_background_daemon(command: List[str], logfile: str):
-        # Start the daemon process in the background
-        pid = os.fork()
-        if pid > 0:
-            return pid
-
-        # detach from the terminal
-        os.setsid()
-        # Second fork to prevent reacquisition of tty
-        pid = os.fork()
-        if pid > 0:
-            os._exit(0)
-
-        sys.stdout.flush()
-        sys.stderr.flush()
-        if logfile == "":
-            logfile = "/dev/null"
-        with open(logfile, 'ab', buffering=0) as log:
-            os.dup2(log.fileno(), sys.stdout.fileno())
-            os.dup2(log.fileno(), sys.stderr.fileno())
-        with open('/dev/null', 'rb') as f:
-            os.dup2(f.fileno(), sys.stdin.fileno())
-
-        os.execvp(command[0], command)
-        os._exit(255)
+    def run_background_daemon(command: List[str], logfile: str, pidfile: str = "") -> int:
+        """
+        Start the daemon process in its own session in the background and return its pid.
+        The pid is also recorded in pidfile with its start time, see ProcFs.write_pidfile.
+        Services are started from worker threads, so no fork is done here: subprocess spawns the daemon
+        without running any Python code in the child, which a fork of a threaded process can't do safely.
+        """
+        with open(logfile or "/dev/null", 'ab', buffering=0) as log:
+            daemon = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                      start_new_session=True)
+        with CommandExecutor._daemons_lock:
+            # keep a reference until exit, an exited daemon is a zombie that ProcFs.is_running reports stopped
+            CommandExecutor._daemons.append(daemon)
+        if pidfile:
+            ProcFs.write_pidfile(pidfile, daemon.pid)
+        return daemon.pid
 
     @staticmethod
     def run_test(command: List[str]) -> None:
@@ -108,25 +746,79 @@ class CommandExecutor:
     @staticmethod
     def run_http_get_json(url: str, timeout=5) -> Union[Dict[str, Any], List[Any]]:
         try:
-            with urlopen(url, timeout=timeout) as response:
-                if response.status != 200:
-                    return {}
-                body = response.read().decode('utf-8')
-                return json.loads(body)
-        except (URLError, HTTPError, TimeoutError, ValueError, UnicodeDecodeError, AttributeError):
+            status, body = CommandExecutor._http_request('GET', url, timeout)
+            if status != 200:
+                return {}
+            return json.loads(body.decode('utf-8'))
+        except (OSError, HTTPException, ValueError):
             pass
         return {}
 
     @staticmethod
     def run_http_post(url: str, timeout=5) -> bool:
         try:
-            req = Request(url=url, method='POST')
-            with urlopen(req, timeout=timeout) as response:
-                return response.status == 200
-        except (URLError, HTTPError, TimeoutError, UnicodeDecodeError, AttributeError):
+            status, _ = CommandExecutor._http_request('POST', url, timeout)
+            return status == 200
+        except (OSError, HTTPException, ValueError):
             pass
         return False
 
+class ProcFs:
+    """Helpers reading processes from /proc"""
+
+    @staticmethod
+    def start_time(pid: int) -> int:
+        """Start time of the process in clock ticks since boot, 0 if it doesn't exist"""
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                stat = f.read()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return 0
+        # comm may contain spaces, fields after it are fixed
+        return int(stat.rsplit(")", 1)[1].split()[19])
+
+    @staticmethod
+    def is_running(pid: int) -> bool:
+        """Whether the process exists and is not a zombie"""
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return False
+
+    @staticmethod
+    def snapshot() -> Dict[int, List[str]]:
+        """Argv of every process readable at this moment, indexed by pid"""
+        processes = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/cmdline", 'rb') as f:
+                    cmdline = f.read()
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                continue
+            if cmdline:
+                processes[int(entry)] = cmdline.decode('utf-8', 'replace').rstrip("\0").split("\0")
+        return processes
+
+    @staticmethod
+    def write_pidfile(pidfile: str, pid: int) -> None:
+        with open(pidfile, 'w') as f:
+            f.write(f"{pid} {ProcFs.start_time(pid)}\n")
+
+    @staticmethod
+    def read_pidfile(pidfile: str) -> int:
+        """Pid recorded in pidfile if that process is still running, 0 if missing or reused by another one"""
+        try:
+            with open(pidfile, 'r') as f:
+                pid, start_time = (int(field) for field in f.read().split())
+        except (FileNotFoundError, ValueError):
+            return 0
+        if start_time == 0 or ProcFs.start_time(pid) != start_time or not ProcFs.is_running(pid):
+            return 0
+        return pid
+
 class ConfigFileManager:
     @staticmethod
     def get_json_data(json_path: str) -> Dict:
@@ -143,6 +835,580 @@ class ConfigFileManager:
             print(f"error: read json file {json_path} failed : {str(e)}")
             sys.exit(1)
 
+class MetadataCache:
+    """
+    LRU of json values with a TTL per entry, persisted in one file per cluster so that repeated commands
+    against the same clustermgr skip its lookups. Entries are merged into the file on save, under a lock.
+    """
+    _caches: Dict[str, "MetadataCache"] = {}
+    cache_dir = ""
+    max_bytes = 16 << 20
+    enabled = False
+    refresh = False
+
+    def __init__(self, path: str, max_bytes: int, refresh: bool = False) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        # key -> (expires, stored, size, value), least recently used first
+        self.entries: "OrderedDict[str, Tuple[float, float, int, Any]]" = OrderedDict()
+        self.size = 0
+        self.dirty = set()
+        self.touched: Dict[str, None] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @staticmethod
+    def configure(cache_dir: str, max_bytes: int, enabled: bool = True, refresh: bool = False) -> None:
+        MetadataCache.cache_dir = cache_dir
+        MetadataCache.max_bytes = max_bytes
+        MetadataCache.enabled = enabled
+        MetadataCache.refresh = refresh
+
+    @staticmethod
+    def for_cluster(host: str) -> Optional["MetadataCache"]:
+        """Cache of the cluster behind clustermgr host, None when caching is off"""
+        if not MetadataCache.enabled:
+            return None
+        cache = MetadataCache._caches.get(host)
+        if cache is None:
+            name = re.sub(r'[^A-Za-z0-9.-]+', '_', urlsplit(host).netloc or host)
+            path = os.path.join(MetadataCache.cache_dir, f"{name}.json")
+            cache = MetadataCache._caches[host] = MetadataCache(path, MetadataCache.max_bytes, MetadataCache.refresh)
+        return cache
+
+    @staticmethod
+    def save_all() -> None:
+        for cache in MetadataCache._caches.values():
+            cache.save()
+
+    @staticmethod
+    def summary_all() -> List[str]:
+        return [f"{host}: {cache.summary()}" for host, cache in MetadataCache._caches.items()]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self.refresh or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.touched.pop(key, None)
+            self.touched[key] = None
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        size = len(json.dumps(value, separators=(',', ':')))
+        now = time.time()
+        with self.lock:
+            self._set_locked(key, (now + ttl, now, size, value))
+            self.dirty.add(key)
+
+    def summary(self) -> str:
+        return (f"hits={self.hits} misses={self.misses} evictions={self.evictions} "
+                f"entries={len(self.entries)} size={HumanReadable.human_bytes(self.size)} file={self.path}")
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # keep what other commands stored meanwhile, ours win for the keys we changed
+                with self.lock:
+                    ours = {key: self.entries[key] for key in self.dirty if key in self.entries}
+                    self.entries.clear()
+                    self.size = 0
+                    self._load()
+                    for key in self.touched:
+                        if key in self.entries:
+                            self.entries.move_to_end(key)
+                    for key, entry in ours.items():
+                        self._set_locked(key, entry)
+                    now = time.time()
+                    data = [[key, expires, stored, value] for key, (expires, stored, _, value)
+                            in self.entries.items() if expires >= now]
+                    self.dirty.clear()
+                    self.touched.clear()
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump({"version": 1, "entries": data}, f, separators=(',', ':'))
+                os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"warning: failed to save metadata cache {self.path}: {e}", file=sys.stderr)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != 1:
+            return
+        now = time.time()
+        for item in data.get("entries", []):
+            try:
+                key, expires, stored, value = item
+            except (TypeError, ValueError):
+                continue
+            if expires >= now:
+                self._set_locked(key, (expires, stored, len(json.dumps(value, separators=(',', ':'))), value))
+
+    def _set_locked(self, key: str, entry: Tuple[float, float, int, Any]) -> None:
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[2]
+        self.entries[key] = entry
+        self.size += entry[2]
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            evicted, old = self.entries.popitem(last=False)
+            self.size -= old[2]
+            self.dirty.discard(evicted)
+            self.evictions += 1
+
+class ClustermgrRouter:
+    """
+    Route requests across the raft members of one clustermgr. Requests that must see the latest state go to
+    the leader, discovered from /stat and cached. Reads go to the member that answered last and are hedged:
+    when it has not answered within hedge_after seconds the next member is asked too, the first valid answer wins.
+    """
+    LEADER_TTL = 30
+    LEADER_PROBE_TIMEOUT = 1.0
+    # seconds a member that failed a request is asked last
+    DOWN_SECONDS = 5
+    hedge_after = 0.05
+    _routers: Dict[str, "ClustermgrRouter"] = {}
+    _routers_lock = threading.Lock()
+
+    def __init__(self, members: List[str]) -> None:
+        self.members = members
+        # members of one cluster share a metadata cache whatever order they are given in
+        self.cluster = sorted(members)[0]
+        self.lock = threading.Lock()
+        self.preferred = members[0]
+        self.leader_host = ""
+        self.leader_expires = 0.0
+        self.down_until: Dict[str, float] = {}
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.leader_lookups = 0
+
+    @staticmethod
+    def configure(hedge_after: float) -> None:
+        ClustermgrRouter.hedge_after = hedge_after
+
+    @staticmethod
+    def for_hosts(hosts: str) -> "ClustermgrRouter":
+        """Router of comma separated clustermgr members, one per distinct member list"""
+        with ClustermgrRouter._routers_lock:
+            router = ClustermgrRouter._routers.get(hosts)
+            if router is None:
+                members = [host.strip().rstrip("/") for host in hosts.split(",") if host.strip()]
+                router = ClustermgrRouter._routers[hosts] = ClustermgrRouter(members)
+            return router
+
+    @staticmethod
+    def summary_all() -> List[str]:
+        return [f"{','.join(router.members)}: {router.summary()}" for router in ClustermgrRouter._routers.values()]
+
+    def summary(self) -> str:
+        return (f"reads={self.reads} hedged={self.hedged} hedge_wins={self.hedge_wins} "
+                f"leader_lookups={self.leader_lookups} leader={self.leader_host or '-'}")
+
+    def _order(self) -> List[str]:
+        now = time.monotonic()
+        with self.lock:
+            order = [self.preferred] + [member for member in self.members if member != self.preferred]
+            return sorted(order, key=lambda member: self.down_until.get(member, 0) > now)
+
+    def _fetch(self, member: str, path: str, valid: Any, timeout: float) -> Optional[Any]:
+        """GET path from member, None unless the answer passes valid"""
+        try:
+            status, body = CommandExecutor._http_request('GET', f"{member}{path}", timeout)
+            data = json.loads(body.decode('utf-8')) if status == 200 else None
+        except (OSError, HTTPException, ValueError):
+            data = None
+        if data is None or not valid(data):
+            with self.lock:
+                self.down_until[member] = time.monotonic() + self.DOWN_SECONDS
+            return None
+        return data
+
+    def get_json(self, path: str, valid: Any, leader: bool = False, timeout: float = 5) -> Union[Dict[str, Any], List[Any]]:
+        """GET path from the leader or hedged across members, {} when no member gave a valid answer"""
+        if leader and len(self.members) > 1:
+            for _ in range(2):
+                host = self.leader()
+                if not host:
+                    break
+                data = self._fetch(host, path, valid, timeout)
+                if data is not None:
+                    return data
+                # the leader may have changed, look it up once more
+                self.invalidate_leader()
+            return {}
+        return self._hedged(path, valid, timeout)
+
+    def _hedged(self, path: str, valid: Any, timeout: float) -> Union[Dict[str, Any], List[Any]]:
+        order = self._order()
+        with self.lock:
+            self.reads += 1
+        if len(order) == 1 or self.hedge_after <= 0:
+            for member in order:
+                data = self._fetch(member, path, valid, timeout)
+                if data is not None:
+                    with self.lock:
+                        self.preferred = member
+                    return data
+            return {}
+
+        # daemon threads, so that a member stuck until the timeout never holds up the exit
+        results: "queue.Queue[Tuple[str, Optional[Any]]]" = queue.Queue()
+
+        def launch(member: str) -> None:
+            threading.Thread(target=lambda: results.put((member, self._fetch(member, path, valid, timeout))),
+                             daemon=True).start()
+        launch(order[0])
+        launched, pending = 1, 1
+        while pending:
+            try:
+                member, data = results.get(timeout=self.hedge_after if launched < len(order) else None)
+            except queue.Empty:
+                launch(order[launched])
+                launched += 1
+                pending += 1
+                with self.lock:
+                    self.hedged += 1
+                continue
+            pending -= 1
+            if data is not None:
+                with self.lock:
+                    self.preferred = member
+                    if member != order[0]:
+                        self.hedge_wins += 1
+                return data
+            if launched < len(order):
+                # a member that failed fast is replaced right away instead of after the hedge delay
+                launch(order[launched])
+                launched += 1
+                pending += 1
+        return {}
+
+    async def get_json_async(self, path: str, valid: Any, timeout: float = 5) -> Union[Dict[str, Any], List[Any]]:
+        """Hedged read for event loops, losers are cancelled once an answer wins"""
+        order = self._order()
+        with self.lock:
+            self.reads += 1
+
+        async def fetch(member: str) -> Tuple[str, Optional[Any]]:
+            try:
+                status, body = await AsyncCommandExecutor._http_request('GET', f"{member}{path}", timeout)
+                data = json.loads(body.decode('utf-8')) if status == 200 else None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                data = None
+            if data is None or not valid(data):
+                with self.lock:
+                    self.down_until[member] = time.monotonic() + self.DOWN_SECONDS
+                return member, None
+            return member, data
+
+        hedging = len(order) > 1 and self.hedge_after > 0
+        tasks = {asyncio.ensure_future(fetch(order[0]))}
+        launched = 1
+        try:
+            while tasks:
+                wait_for = self.hedge_after if hedging and launched < len(order) else None
+                done, tasks = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    tasks.add(asyncio.ensure_future(fetch(order[launched])))
+                    launched += 1
+                    with self.lock:
+                        self.hedged += 1
+                    continue
+                for task in done:
+                    member, data = task.result()
+                    if data is not None:
+                        with self.lock:
+                            self.preferred = member
+                            if member != order[0]:
+                                self.hedge_wins += 1
+                        return data
+                if not tasks and launched < len(order):
+                    tasks.add(asyncio.ensure_future(fetch(order[launched])))
+                    launched += 1
+            return {}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def leader(self) -> str:
+        """Url of the raft leader, from memory, the metadata cache or else asking every member"""
+        if len(self.members) == 1:
+            return self.members[0]
+        with self.lock:
+            if self.leader_host and self.leader_expires > time.monotonic():
+                return self.leader_host
+        cache = MetadataCache.for_cluster(self.cluster)
+        host = cache.get("raft_leader") if cache is not None else None
+        if not isinstance(host, str) or not host:
+            host = self._discover_leader()
+            if host and cache is not None:
+                cache.put("raft_leader", host, self.LEADER_TTL)
+        with self.lock:
+            self.leader_host = host
+            self.leader_expires = time.monotonic() + self.LEADER_TTL
+        return host
+
+    def invalidate_leader(self) -> None:
+        with self.lock:
+            self.leader_host = ""
+            self.leader_expires = 0.0
+        cache = MetadataCache.for_cluster(self.cluster)
+        if cache is not None:
+            cache.put("raft_leader", "", 0)
+
+    def _discover_leader(self) -> str:
+        """Ask every member for /stat at once, a member reporting itself leader wins over a reported leader_host"""
+        with self.lock:
+            self.leader_lookups += 1
+        results: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+        def probe(member: str) -> None:
+            try:
+                status, body = CommandExecutor._http_request('GET', f"{member}/stat", self.LEADER_PROBE_TIMEOUT)
+                results.put((member, json.loads(body.decode('utf-8')) if status == 200 else None))
+            except (OSError, HTTPException, ValueError):
+                results.put((member, None))
+        for member in self.members:
+            threading.Thread(target=probe, args=(member,), daemon=True).start()
+
+        reported = ""
+        for _ in self.members:
+            member, stat = results.get()
+            if not isinstance(stat, dict):
+                continue
+            raft_status = stat.get('raft_status') or {}
+            if (raft_status.get('raftState') or raft_status.get('raft_state')) == "StateLeader":
+                return member
+            leader_host = stat.get('leader_host') or ""
+            if leader_host and not reported:
+                matches = [m for m in self.members if urlsplit(m).netloc == leader_host]
+                reported = matches[0] if matches else f"{urlsplit(member).scheme}://{leader_host}"
+        return reported
+
+class ColumnarWriter:
+    """
+    Append rows of unsigned integers as fixed-width columns into one binary file that readers can mmap.
+    Columns are buffered in array()s and spilled to one temporary file each, then laid out one after
+    another behind a small header on close.
+    """
+    MAGIC = b"CFSCOL01"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIIQ")
+    COLUMN = struct.Struct("<16s8sQQ")
+    ALIGN = 64
+    SPILL_ROWS = 1 << 20
+    DTYPES = {'B': '<u1', 'H': '<u2', 'I': '<u4', 'Q': '<u8'}
+
+    def __init__(self, path: str, columns: List[Tuple[str, str]]) -> None:
+        """columns are (name, array typecode) with typecode one of B, H, I, Q"""
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self.buffers = {name: array(typecode) for name, typecode in columns}
+        self.spills = {name: open(f"{path}.{name}.tmp", 'wb') for name, _ in columns}
+
+    def append(self, values: Dict[str, List[int]]) -> None:
+        """Append a batch of rows given column by column, every list of the same length"""
+        count = len(values[self.columns[0][0]])
+        for name, _ in self.columns:
+            self.buffers[name].extend(values[name])
+        self.rows += count
+        if len(self.buffers[self.columns[0][0]]) >= self.SPILL_ROWS:
+            self._spill()
+
+    def close(self) -> None:
+        self._spill()
+        offset = self._align(self.HEADER.size + self.COLUMN.size * len(self.columns))
+        directory = []
+        for name, typecode in self.columns:
+            nbytes = self.rows * array(typecode).itemsize
+            directory.append((name, typecode, offset, nbytes))
+            offset = self._align(offset + nbytes)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(self.columns), self.rows))
+            for name, typecode, column_offset, nbytes in directory:
+                f.write(self.COLUMN.pack(name.encode(), self.DTYPES[typecode].encode(), column_offset, nbytes))
+            for name, _, column_offset, _ in directory:
+                f.write(b"\0" * (column_offset - f.tell()))
+                spill = self.spills[name]
+                spill.close()
+                with open(spill.name, 'rb') as src:
+                    while True:
+                        chunk = src.read(8 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+        os.replace(tmp, self.path)
+        self._remove_spills()
+
+    def abort(self) -> None:
+        for spill in self.spills.values():
+            spill.close()
+        self._remove_spills()
+
+    def _remove_spills(self) -> None:
+        for spill in self.spills.values():
+            try:
+                os.remove(spill.name)
+            except FileNotFoundError:
+                pass
+
+    def _spill(self) -> None:
+        for name, typecode in self.columns:
+            self.buffers[name].tofile(self.spills[name])
+            self.buffers[name] = array(typecode)
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return (offset + ColumnarWriter.ALIGN - 1) // ColumnarWriter.ALIGN * ColumnarWriter.ALIGN
+
+class ColumnarReader:
+    """Memory-mapped columns of a file written by ColumnarWriter"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(ColumnarWriter.HEADER.size)
+            if len(header) != ColumnarWriter.HEADER.size:
+                raise ValueError(f"{path} is too short")
+            magic, version, ncols, self.rows = ColumnarWriter.HEADER.unpack(header)
+            if magic != ColumnarWriter.MAGIC or version != ColumnarWriter.VERSION:
+                raise ValueError(f"{path} is not a columnar file")
+            # name -> (dtype, offset)
+            self.columns: Dict[str, Tuple[str, int]] = {}
+            for _ in range(ncols):
+                name, dtype, offset, _ = ColumnarWriter.COLUMN.unpack(f.read(ColumnarWriter.COLUMN.size))
+                self.columns[name.rstrip(b"\0").decode()] = (dtype.rstrip(b"\0").decode(), offset)
+
+    def column(self, name: str) -> Any:
+        """numpy memmap of a column, pages are only read when touched"""
+        import numpy as np
+        dtype, offset = self.columns[name]
+        if self.rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(self.rows,))
+
+class RingBuffer:
+    """Fixed capacity ring of floats backed by array('d'), the oldest value is overwritten when full"""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self._values = array('d', bytes(8 * self.capacity))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> float:
+        """Value by age, 0 is the oldest and -1 the newest"""
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError("ring buffer index out of range")
+        return self._values[(self._start + index) % self.capacity]
+
+    def append(self, value: float) -> None:
+        end = (self._start + self._size) % self.capacity
+        self._values[end] = value
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def to_list(self) -> List[float]:
+        return [self[i] for i in range(self._size)]
+
+class MetricsHistory:
+    """Ring-buffered history of numeric metrics sampled together, missing values are kept as nan"""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.timestamps = RingBuffer(capacity)
+        self.series: Dict[str, RingBuffer] = {}
+
+    @staticmethod
+    def flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+        """Collect numeric leaves of a json document as dotted names, list items by disk_id when they have one"""
+        if isinstance(value, bool):
+            out[prefix] = float(value)
+        elif isinstance(value, (int, float)):
+            out[prefix] = float(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                MetricsHistory.flatten(f"{prefix}.{key}", item, out)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                key = item.get("disk_id", index) if isinstance(item, dict) else index
+                MetricsHistory.flatten(f"{prefix}.{key}", item, out)
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        # counters are integers which %g would print in exponent form
+        return f"{value:.0f}" if value.is_integer() else f"{value:.6g}"
+
+    def add_sample(self, timestamp: float, metrics: Dict[str, float]) -> None:
+        for name in metrics:
+            if name not in self.series:
+                ring = RingBuffer(self.capacity)
+                for _ in range(len(self.timestamps)):
+                    ring.append(math.nan)
+                self.series[name] = ring
+        self.timestamps.append(timestamp)
+        for name, ring in self.series.items():
+            ring.append(metrics.get(name, math.nan))
+
+    def changes(self) -> List[Tuple[str, float, float, float]]:
+        """(name, value, delta, rate per second) of every series that changed between the last two samples"""
+        if len(self.timestamps) < 2:
+            return []
+        elapsed = self.timestamps[-1] - self.timestamps[-2]
+        changes = []
+        for name, ring in sorted(self.series.items()):
+            value, previous = ring[-1], ring[-2]
+            delta = value - previous
+            if math.isnan(delta) or delta == 0:
+                continue
+            changes.append((name, value, delta, delta / elapsed if elapsed > 0 else 0.0))
+        return changes
+
+    def export(self, path: str) -> None:
+        """Write the history as csv, or as json columns when path ends with .json"""
+        names = sorted(self.series)
+        if path.endswith(".json"):
+            columns = {"timestamp": self.timestamps.to_list()}
+            for name in names:
+                columns[name] = [None if math.isnan(v) else v for v in self.series[name].to_list()]
+            with open(path, 'w') as f:
+                json.dump(columns, f)
+            return
+        with open(path, 'w') as f:
+            f.write(",".join(["timestamp"] + names) + "\n")
+            for i in range(len(self.timestamps)):
+                row = [f"{self.timestamps[i]:.3f}"]
+                for name in names:
+                    value = self.series[name][i]
+                    row.append("" if math.isnan(value) else MetricsHistory.format_value(value))
+                f.write(",".join(row) + "\n")
+
 class HumanReadable:
     @staticmethod
     def human_bytes(bytes: int) -> str:
@@ -153,6 +1419,13 @@ class HumanReadable:
             bytes_float /= 1024.0
         return f"{bytes_float:.2f}PB"
 
+    @staticmethod
+    def human_duration(seconds: float) -> str:
+        for unit, size in [('d', 86400), ('h', 3600), ('m', 60)]:
+            if seconds >= size:
+                return f"{seconds / size:.1f}{unit}"
+        return f"{seconds:.1f}s"
+
     @staticmethod
     def human_disk_stats(status: int) -> str:
         if status == 1:
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Local stand-in of the clustermgr, blobnode and scheduler endpoints used by cli.py, for offline benchmarks.
+
+Disks, vuids and shards are generated from their ids on request, so datasets of millions of shards cost
+nothing until shards are deleted (one byte per shard of a touched vuid). Latency and errors can be injected
+per request. Request counters are served on /fake/metrics of every listener.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SHARD_NORMAL = 1
+SHARD_MARK_DELETE = 2
+SHARD_DELETED = 3
+
+SHARD_LIST_PATTERN = re.compile(r"^/shard/list/diskid/(\d+)/vuid/(\d+)/startbid/(\d+)/status/(\d+)/count/(\d+)$")
+SHARD_OP_PATTERN = re.compile(r"^/shard/(markdelete|delete)/diskid/(\d+)/vuid/(\d+)/bid/(\d+)$")
+
+class FakeCluster:
+    """Generated dataset and shard states shared by all listeners"""
+
+    def __init__(self, disks: int, vuids_per_disk: int, bids_per_vuid: int, disks_per_host: int,
+                 shard_size: int) -> None:
+        self.disks = disks
+        self.vuids_per_disk = vuids_per_disk
+        self.bids_per_vuid = bids_per_vuid
+        self.disks_per_host = disks_per_host
+        self.shard_size = shard_size
+        self.bn_url = ""
+        self.leader_host = "127.0.0.1:9998"
+        self.raft_state = "StateLeader"
+        self.lock = threading.Lock()
+        # vuid -> shard status per bid, only for vuids that had a shard deleted
+        self.states: Dict[int, bytearray] = {}
+        self.deleted = 0
+        self.started = time.time()
+
+    def has_disk(self, disk_id: int) -> bool:
+        return 1 <= disk_id <= self.disks
+
+    def disk(self, disk_id: int) -> Dict[str, Any]:
+        host_index = (disk_id - 1) // self.disks_per_host
+        used_chunks = disk_id * 7 % 50
+        return {
+            "cluster_id": 1, "idc": f"z{host_index % 3}", "rack": f"rack{host_index % 8}",
+            "host": self.bn_url or f"http://10.0.{host_index // 256}.{host_index % 256}:8889",
+            "path": f"/data/disk{(disk_id - 1) % self.disks_per_host + 1}", "status": 1, "readonly": False,
+            "disk_id": disk_id, "node_id": host_index + 1, "disk_set_id": host_index % 4 + 1,
+            "size": 16 << 40, "used": used_chunks << 34, "free": (16 << 40) - (used_chunks << 34),
+            "max_chunk_cnt": 1024, "used_chunk_cnt": used_chunks, "free_chunk_cnt": 1024 - used_chunks,
+            "create_at": "2025-01-01T00:00:00Z", "last_update_at": "2025-01-01T00:00:00Z",
+        }
+
+    def vuid(self, disk_id: int, index: int) -> int:
+        # vid in the high bits, unit index and epoch in the low ones, like real vuids
+        vid = (disk_id - 1) * self.vuids_per_disk + index + 1
+        return (vid << 32) | (index % 27 << 24) | 1
+
+    def vuids(self, disk_id: int) -> List[Dict[str, Any]]:
+        return [{"vuid": self.vuid(disk_id, i), "disk_id": disk_id, "host": self.bn_url,
+                 "free": (i * 2654435761) % (16 << 30), "used": self.bids_per_vuid * self.shard_size,
+                 "compacting": False} for i in range(self.vuids_per_disk)]
+
+    def list_shards(self, vuid: int, start_bid: int, status: int, count: int) -> Tuple[List[Dict[str, Any]], int]:
+        states = self.states.get(vuid)
+        shards = []
+        bid = max(start_bid, 1)
+        while bid <= self.bids_per_vuid and len(shards) < count:
+            state = states[bid] if states is not None else SHARD_NORMAL
+            if status == 0 or state == status:
+                shards.append({"vuid": vuid, "bid": bid, "size": self.shard_size, "crc": bid * 31 & 0xffffffff,
+                               "flag": state, "status": state})
+            bid += 1
+        return shards, bid if bid <= self.bids_per_vuid else 0
+
+    def change_shard(self, vuid: int, bid: int, op: str) -> Tuple[int, str]:
+        if bid < 1 or bid > self.bids_per_vuid:
+            return 404, "shard not found"
+        with self.lock:
+            states = self.states.get(vuid)
+            if states is None:
+                states = self.states[vuid] = bytearray([SHARD_NORMAL]) * (self.bids_per_vuid + 1)
+            if op == "markdelete":
+                if states[bid] == SHARD_DELETED:
+                    return 404, "shard not found"
+                states[bid] = SHARD_MARK_DELETE
+                return 200, ""
+            if states[bid] != SHARD_MARK_DELETE:
+                return 400, "shard must be marked delete first"
+            states[bid] = SHARD_DELETED
+            self.deleted += 1
+            return 200, ""
+
+    def cm_stat(self) -> Dict[str, Any]:
+        return {
+            "leader_host": self.leader_host, "read_only": False,
+            "raft_status": {"nodeId": 1, "term": 3, "vote": 1, "commit": 1000 + self.deleted,
+                            "applied": 1000 + self.deleted, "raftState": self.raft_state, "leader": 1},
+            "space_stat": {"total_space": self.disks << 44, "free_space": self.disks << 43,
+                           "used_space": self.disks << 43, "total_disk": self.disks},
+            "volume_stat": {"total_volume": self.disks * self.vuids_per_disk},
+        }
+
+    def sc_stat(self) -> Dict[str, Any]:
+        elapsed = int(time.time() - self.started)
+        task = lambda n: {"switch": "Enable", "total_tasks_cnt": n, "finished_tasks_cnt": n // 2,
+                          "failed_tasks_cnt": n // 100}
+        return {
+            "disk_repair": {**task(elapsed * 3), "repairing_disk_id": 0},
+            "disk_drop": task(elapsed), "balance": task(elapsed * 2), "manual_migrate": task(0),
+            "volume_inspect": task(elapsed // 2), "shard_repair": task(elapsed // 3),
+            "blob_delete": {**task(elapsed * 10), "deleted_shards": self.deleted},
+        }
+
+    def bn_stat(self) -> List[Dict[str, Any]]:
+        return [{**self.disk(disk_id), "chunk_cnt": self.vuids_per_disk}
+                for disk_id in range(1, min(self.disks, self.disks_per_host) + 1)]
+
+class FaultInjector:
+    """Latency and errors added to every request"""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, error_pattern: str, seed: int) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_pattern = re.compile(error_pattern) if error_pattern else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self) -> None:
+        if self.latency <= 0 and self.jitter <= 0:
+            return
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, self.latency + jitter))
+
+    def should_fail(self, path: str) -> bool:
+        if self.error_rate <= 0 or (self.error_pattern and not self.error_pattern.search(path)):
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the body is written right after the headers, Nagle would hold it back until the delayed ACK
+    disable_nagle_algorithm = True
+    server_version = "fake-blobstore"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _reply(self, code: int, body: Any, counted: bool = True) -> None:
+        data = json.dumps(body, separators=(',', ':')).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if counted:
+            self.server.count(self.path, code)
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        url = urlparse(self.path)
+        if url.path == "/fake/metrics":
+            self._reply(200, self.server.metrics(), counted=False)
+            return
+        self.server.faults.delay()
+        if self.server.faults.should_fail(url.path):
+            self._reply(500, {"code": 500, "error": "injected error"})
+            return
+        code, body = self.server.route(method, url.path, parse_qs(url.query))
+        self._reply(code, body)
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+class FakeServer(ThreadingHTTPServer):
+    """One listener playing a role: cm, bn, sc or all of them"""
+
+    daemon_threads = True
+
+    def __init__(self, port: int, role: str, cluster: FakeCluster, faults: FaultInjector) -> None:
+        super().__init__(("127.0.0.1", port), FakeHandler)
+        self.role = role
+        self.cluster = cluster
+        self.faults = faults
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+
+    def count(self, path: str, code: int) -> None:
+        endpoint = "/".join(path.split("?")[0].split("/")[:3])
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if code >= 400:
+                self.errors += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"role": self.role, "requests": dict(self.requests), "total": sum(self.requests.values()),
+                    "errors": self.errors, "deleted_shards": self.cluster.deleted}
+
+    def route(self, method: str, path: str, query: Dict[str, List[str]]) -> Tuple[int, Any]:
+        cluster = self.cluster
+        is_cm, is_bn, is_sc = self.role in ("cm", "all"), self.role in ("bn", "all"), self.role in ("sc", "all")
+        try:
+            if is_cm and path == "/disk/info":
+                disk_id = int(query["disk_id"][0])
+                return (200, cluster.disk(disk_id)) if cluster.has_disk(disk_id) else (404, {"error": "disk not found"})
+            if is_cm and path == "/disk/list":
+                marker = int(query.get("marker", ["0"])[0])
+                count = int(query.get("count", ["10"])[0])
+                last = min(cluster.disks, marker + count)
+                disks = [cluster.disk(disk_id) for disk_id in range(marker + 1, last + 1)]
+                return 200, {"disks": disks, "marker": 0 if last >= cluster.disks else last}
+            if is_cm and path == "/volume/unit/list":
+                disk_id = int(query["disk_id"][0])
+                if not cluster.has_disk(disk_id):
+                    return 404, {"error": "disk not found"}
+                return 200, {"volume_unit_infos": cluster.vuids(disk_id)}
+            if is_cm and path == "/stat":
+                return 200, cluster.cm_stat()
+            if is_bn and path == "/stat":
+                return 200, cluster.bn_stat()
+            if is_sc and path == "/stats":
+                return 200, cluster.sc_stat()
+            if is_bn:
+                match = SHARD_LIST_PATTERN.match(path)
+                if match and method == "GET":
+                    shards, next_bid = cluster.list_shards(int(match[2]), int(match[3]), int(match[4]), int(match[5]))
+                    return 200, {"shard_infos": shards, "next": next_bid}
+                match = SHARD_OP_PATTERN.match(path)
+                if match and method == "POST":
+                    code, error = cluster.change_shard(int(match[3]), int(match[4]), match[1])
+                    return code, {"error": error} if error else {}
+        except (KeyError, ValueError) as e:
+            return 400, {"error": f"bad request: {e}"}
+        return 404, {"error": "not found"}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake clustermgr/blobnode/scheduler for offline cli.py benchmarks")
+    parser.add_argument("--port", type=int, default=0, help="Serve every role on this one port")
+    parser.add_argument("--cm-port", type=int, default=9998, help="Clustermgr port, when --port is not given")
+    parser.add_argument("--bn-port", type=int, default=8899, help="Blobnode port, when --port is not given")
+    parser.add_argument("--sc-port", type=int, default=9800, help="Scheduler port, when --port is not given")
+    parser.add_argument("--disks", type=int, default=1000, help="Disks in the cluster")
+    parser.add_argument("--vuids", type=int, default=100, help="Vuids per disk")
+    parser.add_argument("--bids", type=int, default=10000, help="Shards per vuid")
+    parser.add_argument("--disks-per-host", type=int, default=12, help="Disks per blobnode host")
+    parser.add_argument("--shard-size", type=int, default=65536, help="Size of each shard in bytes")
+    parser.add_argument("--follower", action="store_true",
+                        help="Report the clustermgr as a raft follower, to fake the other members of a cluster")
+    parser.add_argument("--leader-host", type=str, default="",
+                        help="Clustermgr leader_host reported by /stat, default this clustermgr")
+    parser.add_argument("--latency", type=float, default=0, help="Latency added to each request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Uniform +/- jitter of the latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 500")
+    parser.add_argument("--error-pattern", type=str, default="", help="Only inject errors on paths matching this regex")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of latency jitter and errors")
+    args = parser.parse_args()
+
+    cluster = FakeCluster(args.disks, args.vuids, args.bids, args.disks_per_host, args.shard_size)
+    faults = FaultInjector(args.latency / 1000, args.jitter / 1000, args.error_rate, args.error_pattern, args.seed)
+    roles = [("all", args.port)] if args.port else [("cm", args.cm_port), ("bn", args.bn_port), ("sc", args.sc_port)]
+    servers = []
+    try:
+        for role, port in roles:
+            servers.append(FakeServer(port, role, cluster, faults))
+    except OSError as e:
+        print(f"Error: failed to listen: {e}")
+        sys.exit(1)
+    bn_port = servers[0].server_address[1] if args.port else servers[1].server_address[1]
+    cluster.bn_url = f"http://127.0.0.1:{bn_port}"
+    cluster.leader_host = args.leader_host or f"127.0.0.1:{servers[0].server_address[1]}"
+    cluster.raft_state = "StateFollower" if args.follower else "StateLeader"
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {args.disks} disks x {args.vuids} vuids x {args.bids} shards on "
+          + ", ".join(f"{server.role}=http://127.0.0.1:{server.server_address[1]}" for server in servers))
+    sys.stdout.flush()
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Sample memory and cpu of the blobnode pod without forking, as a replacement of shell/monitor_k8s_pod.sh.
+crictl is only run to resolve the blobnode pid, everything else is read from /proc and /sys directly.
+Needs root to read other processes and /proc/slabinfo.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import json
+from typing import List, Optional, Tuple
+
+import common
+
+# mountpoints of blobnode meta disks inside the container, the disk name is the trailing diskN
+META_MOUNT_PATTERN = re.compile(r"/var/lib/blobstore/blobnode/meta.*?(disk[0-9]+)$")
+COLUMNS = ["timestamp", "cpu_pct", "pod_kb", "vmrss_kb", "vmsize_kb", "cg_usage_kb", "cg_max_kb", "ext4_slab_kb"]
+
+class ProcFile:
+    """A /proc or /sys file kept open and re-read with pread, so every sample costs one syscall"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self) -> str:
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(self.fd, 65536, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return b"".join(chunks).decode('utf-8', 'replace')
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class PodTarget:
+    """Blobnode pid, container cgroup and meta disk mounts, resolved once"""
+
+    def __init__(self, pid: int, container_id: str = "") -> None:
+        self.pid = pid
+        self.container_id = container_id
+        self.cgroup_dir, self.cgroup_v2 = self._find_cgroup(pid)
+        self.meta_mounts = self._find_meta_mounts(pid)
+
+    @staticmethod
+    def resolve(namespace: str, pod_prefix: str) -> Optional["PodTarget"]:
+        pod_id = PodTarget._first_line(["crictl", "pods", "--namespace", namespace, "--name", pod_prefix, "-q"])
+        if not pod_id:
+            return None
+        container_id = PodTarget._first_line(["crictl", "ps", "--pod", pod_id, "--state", "Running", "-q"])
+        if not container_id:
+            return None
+        result = common.CommandExecutor.run_raw(["crictl", "inspect", "--output", "json", container_id])
+        try:
+            entrypoint_pid = int(json.loads(result.stdout)["info"]["pid"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        # blobnode is the child of the container entrypoint
+        children = PodTarget._children(entrypoint_pid)
+        if not children:
+            return None
+        return PodTarget(children[0], container_id)
+
+    @staticmethod
+    def _first_line(command: List[str]) -> str:
+        result = common.CommandExecutor.run_raw(command)
+        if result.returncode != 0:
+            return ""
+        lines = result.stdout.split()
+        return lines[0] if lines else ""
+
+    @staticmethod
+    def _children(pid: int) -> List[int]:
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children", 'r') as f:
+                    children.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            pass
+        return sorted(children)
+
+    @staticmethod
+    def _find_cgroup(pid: int) -> Tuple[str, bool]:
+        """Memory cgroup directory of the process and whether it is cgroup v2"""
+        try:
+            with open(f"/proc/{pid}/cgroup", 'r') as f:
+                lines = f.read().splitlines()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return "", False
+        for line in lines:
+            _, controllers, path = line.split(":", 2)
+            if "memory" in controllers.split(","):
+                return f"/sys/fs/cgroup/memory{path}", False
+        for line in lines:
+            hierarchy, controllers, path = line.split(":", 2)
+            if hierarchy == "0" and controllers == "":
+                return f"/sys/fs/cgroup{path}", True
+        return "", False
+
+    @staticmethod
+    def _find_meta_mounts(pid: int) -> List[Tuple[str, str]]:
+        """(disk name, path to statvfs from the host) of every meta disk mounted in the process namespace"""
+        mounts = {}
+        try:
+            with open(f"/proc/{pid}/mountinfo", 'r') as f:
+                for line in f:
+                    mountpoint = line.split()[4]
+                    match = META_MOUNT_PATTERN.search(mountpoint)
+                    if match:
+                        mounts[match.group(1)] = f"/proc/{pid}/root{mountpoint}"
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            pass
+        return sorted(mounts.items(), key=lambda item: int(item[0][4:]))
+
+class PodSampler:
+    """Read one record of columns COLUMNS plus the meta disks of the target"""
+
+    def __init__(self, target: PodTarget) -> None:
+        """Raises ProcessLookupError when blobnode has exited since it was resolved"""
+        self.target = target
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+        try:
+            self.stat = ProcFile(f"/proc/{target.pid}/stat")
+        except OSError:
+            raise ProcessLookupError(target.pid)
+        try:
+            self.status = ProcFile(f"/proc/{target.pid}/status")
+        except OSError:
+            self.stat.close()
+            raise ProcessLookupError(target.pid)
+        self.slabinfo = self._open_optional("/proc/slabinfo")
+        cgroup_dir = target.cgroup_dir
+        if target.cgroup_v2:
+            usage, peak, stat = "memory.current", "memory.peak", "memory.stat"
+        else:
+            usage, peak, stat = "memory.usage_in_bytes", "memory.max_usage_in_bytes", "memory.stat"
+        self.cg_usage = self._open_optional(f"{cgroup_dir}/{usage}") if cgroup_dir else None
+        self.cg_peak = self._open_optional(f"{cgroup_dir}/{peak}") if cgroup_dir else None
+        self.cg_stat = self._open_optional(f"{cgroup_dir}/{stat}") if cgroup_dir else None
+        self.last_cpu: Optional[Tuple[float, int]] = None
+
+    @property
+    def columns(self) -> List[str]:
+        return COLUMNS + [f"{disk}_kb" for disk, _ in self.target.meta_mounts]
+
+    @staticmethod
+    def _open_optional(path: str) -> Optional[ProcFile]:
+        try:
+            return ProcFile(path)
+        except OSError:
+            return None
+
+    def close(self) -> None:
+        for proc_file in (self.stat, self.status, self.slabinfo, self.cg_usage, self.cg_peak, self.cg_stat):
+            if proc_file is not None:
+                proc_file.close()
+
+    def sample(self) -> List[float]:
+        """Raises ProcessLookupError when blobnode has exited"""
+        now = time.time()
+        record = [now, self._cpu_pct(now)]
+        vmrss, vmsize = self._vm_kb()
+        cg_usage = self._read_int(self.cg_usage) // 1024
+        record += [self._working_set_kb(cg_usage), vmrss, vmsize, cg_usage,
+                   self._read_int(self.cg_peak) // 1024, self._ext4_slab_kb()]
+        record += [self._used_kb(path) for _, path in self.target.meta_mounts]
+        return record
+
+    def _cpu_pct(self, now: float) -> float:
+        """Cpu usage over the last interval, not the lifetime average ps shows"""
+        try:
+            stat = self.stat.read()
+        except OSError:
+            raise ProcessLookupError(self.target.pid)
+        if not stat:
+            raise ProcessLookupError(self.target.pid)
+        fields = stat.rsplit(")", 1)[1].split()
+        ticks = int(fields[11]) + int(fields[12])
+        last, self.last_cpu = self.last_cpu, (now, ticks)
+        if last is None or now <= last[0]:
+            return 0.0
+        return round((ticks - last[1]) / self.clock_ticks / (now - last[0]) * 100, 1)
+
+    def _vm_kb(self) -> Tuple[int, int]:
+        vmrss = vmsize = 0
+        for line in self.status.read().splitlines():
+            if line.startswith("VmRSS:"):
+                vmrss = int(line.split()[1])
+            elif line.startswith("VmSize:"):
+                vmsize = int(line.split()[1])
+        return vmrss, vmsize
+
+    def _working_set_kb(self, usage_kb: int) -> int:
+        """Container working set as kubelet reports it: usage minus inactive file cache"""
+        if self.cg_stat is None:
+            return 0
+        key = "inactive_file" if self.target.cgroup_v2 else "total_inactive_file"
+        for line in self.cg_stat.read().splitlines():
+            name, _, value = line.partition(" ")
+            if name == key:
+                return max(0, usage_kb - int(value) // 1024)
+        return usage_kb
+
+    def _ext4_slab_kb(self) -> int:
+        """Cache size of ext4 slabs as slabtop shows it, num_slabs * pagesperslab pages"""
+        if self.slabinfo is None:
+            return 0
+        total = 0
+        for line in self.slabinfo.read().splitlines():
+            if not line.startswith("ext4_"):
+                continue
+            fields = line.split()
+            # name active_objs num_objs objsize objperslab pagesperslab : tunables ... : slabdata active num shared
+            total += int(fields[14]) * int(fields[5]) * self.page_kb
+        return total
+
+    @staticmethod
+    def _read_int(proc_file: Optional[ProcFile]) -> int:
+        if proc_file is None:
+            return 0
+        try:
+            value = proc_file.read().strip()
+        except OSError:
+            return 0
+        return int(value) if value.isdigit() else 0
+
+    @staticmethod
+    def _used_kb(path: str) -> int:
+        try:
+            stat = os.statvfs(path)
+        except OSError:
+            return 0
+        return (stat.f_blocks - stat.f_bfree) * stat.f_frsize // 1024
+
+def format_log_line(columns: List[str], record: List[float]) -> str:
+    """Same line as monitor_k8s_pod.sh writes, for tools parsing monitor.log"""
+    values = dict(zip(columns, record))
+    disks = " ".join(f"{name[:-3]}: {int(values[name])}" for name in columns[len(COLUMNS):]) or "disk_err:0"
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(values["timestamp"]))
+    return (f"[{timestamp}]  BLOBNODE_CPU%: {values['cpu_pct']}  POD: {int(values['pod_kb'])}  "
+            f"BLOBNODE_VmRSS: {int(values['vmrss_kb'])}  BLOBNODE_VmSize: {int(values['vmsize_kb'])}  "
+            f"CG_Usage: {int(values['cg_usage_kb'])}  CG_MaxUsage: {int(values['cg_max_kb'])}  "
+            f"SYS_Ext4_Slab: {int(values['ext4_slab_kb'])}  {disks}")
+
+def fit_record(columns: List[str], record: List[float], header: List[str]) -> List[float]:
+    """
+    Values of record in the order of header, the csv header is written once so meta disks that come or go
+    later are 0 or dropped
+    """
+    values = dict(zip(columns, record))
+    return [values.get(name, 0) for name in header]
+
+def read_header(path: str) -> List[str]:
+    """Columns of the header of an existing csv file, empty if there is none"""
+    try:
+        with open(path, 'r') as f:
+            first = f.readline().strip()
+    except OSError:
+        return []
+    return first.split(",") if first.startswith(COLUMNS[0]) else []
+
+def format_csv_line(record: List[float]) -> str:
+    return ",".join([f"{record[0]:.3f}"] + [f"{value:g}" if isinstance(value, float) else str(value)
+                                            for value in record[1:]])
+
+class PodMonitor:
+    def __init__(self) -> None:
+        self.args = self._parse_args()
+
+    def _parse_args(self) -> argparse.Namespace:
+        parser = argparse.ArgumentParser(description="Fork-free memory monitor of the blobnode pod")
+        parser.add_argument('--namespace', type=str, default='blobstore', help='Namespace of the blobnode pod')
+        parser.add_argument('--pod-prefix', type=str, default='blobstore-blobnode', help='Name of the blobnode pod')
+        parser.add_argument('--pid', type=int, default=0, help='Sample this pid instead of resolving it by crictl')
+        parser.add_argument('--interval', type=float, default=float(os.environ.get("INTERVAL", 60)),
+                            help='Seconds between samples, sub-second intervals are fine')
+        parser.add_argument('--output', type=str, default=os.environ.get("OUTPUT_FILE", "./monitor.csv"),
+                            help='File the records are appended to')
+        parser.add_argument('--format', type=str, default='csv', choices=['csv', 'log'],
+                            help='csv columns, or the monitor.log lines of monitor_k8s_pod.sh')
+        parser.add_argument('--samples', type=int, default=0, help='Stop after this many samples, 0 for never')
+        return parser.parse_args()
+
+    def _resolve(self) -> Optional[PodTarget]:
+        if self.args.pid > 0:
+            return PodTarget(self.args.pid) if os.path.exists(f"/proc/{self.args.pid}") else None
+        return PodTarget.resolve(self.args.namespace, self.args.pod_prefix)
+
+    def run(self) -> None:
+        print(f"Starting memory monitor for Pod Prefix: {self.args.pod_prefix} (Namespace: {self.args.namespace})")
+        print(f"Data will be saved to: {self.args.output}")
+        sampler = None
+        header = read_header(self.args.output)
+        if (self.args.format == 'csv' and not header and os.path.exists(self.args.output)
+                and os.path.getsize(self.args.output) > 0):
+            print(f"Error: {self.args.output} has no csv header of monitor_pod.py, choose another --output")
+            sys.exit(1)
+        count = 0
+        with open(self.args.output, 'a') as output:
+            try:
+                while self.args.samples <= 0 or count < self.args.samples:
+                    started = time.monotonic()
+                    if sampler is None:
+                        target = self._resolve()
+                        try:
+                            sampler = PodSampler(target) if target is not None else None
+                        except ProcessLookupError:
+                            # exited right after it was resolved, record it as missing this time
+                            sampler = None
+                    record = None
+                    if sampler is not None:
+                        try:
+                            record = sampler.sample()
+                        except ProcessLookupError:
+                            sampler.close()
+                            sampler = None
+                    columns = sampler.columns if sampler is not None else COLUMNS
+                    if record is None:
+                        record = [time.time()] + [0] * (len(columns) - 1)
+                    if self.args.format == 'log':
+                        output.write(format_log_line(columns, record) + "\n")
+                    else:
+                        if not header:
+                            header = columns
+                            output.write(",".join(header) + "\n")
+                        output.write(format_csv_line(fit_record(columns, record, header)) + "\n")
+                    output.flush()
+                    count += 1
+                    time.sleep(max(0.0, self.args.interval - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if sampler is not None:
+                    sampler.close()
+
+def main():
+    if sys.platform != "linux":
+        sys.exit("Error: monitor_pod.py reads /proc and only runs on linux")
+    PodMonitor().run()
+
+if __name__ == "__main__":
+    main()
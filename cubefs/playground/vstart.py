@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
 import argparse
 import shutil
 import time
 import signal
-import glob
+import socket
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED, FIRST_EXCEPTION
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from abc import ABC, abstractmethod
 
 import common
@@ -18,8 +21,9 @@ class DirectoryManager:
         self.bin_dir = os.path.abspath(os.path.join(VSTART_SCRIPT_DIR, '../build/bin/blobstore'))
         self.lib_dir = os.path.abspath(os.path.join(VSTART_SCRIPT_DIR, './run/lib'))
         self.log_dir = os.path.abspath(os.path.join(VSTART_SCRIPT_DIR, './run/log'))
+        self.pid_dir = os.path.abspath(os.path.join(VSTART_SCRIPT_DIR, './run/pid'))
         self.cfg_dir = os.path.abspath(os.path.join(VSTART_SCRIPT_DIR, cfg_dir))
-        self.all_dirs = [self.lib_dir, self.log_dir]
+        self.all_dirs = [self.lib_dir, self.log_dir, self.pid_dir]
 
     def setup_directory(self) -> None:
         for dir in self.all_dirs:
@@ -32,15 +36,41 @@ class DirectoryManager:
             if dir_path.exists():
                 shutil.rmtree(dir_path)
 
+class ServiceStartError(Exception):
+    pass
+
+class ServiceStartAborted(ServiceStartError):
+    """Raised by a readiness probe given up because another service failed to start"""
+
 class ServiceBase(ABC):
+    # readiness probes start polling fast and back off exponentially up to the max interval
+    PROBE_INITIAL_INTERVAL = 0.05
+    PROBE_MAX_INTERVAL = 1.0
+    # the spawned process forks the real daemon itself and exits, so its pid can't tell liveness
+    self_daemonizing = False
+    _timing_lock = threading.Lock()
+    # set once any service fails to start so the readiness probes of its siblings give up too
+    start_aborted = threading.Event()
+
     def __init__(self, args: argparse.Namespace, dir_manager: DirectoryManager,
-                 process_identifier: str, cfg_file: str, start_log_file: str) -> None:
+                 process_identifier: str, cfg_file: str, start_log_file: str,
+                 config: Optional[Dict[str, Any]] = None) -> None:
         self.args = args
         self.dir_manager = dir_manager
         self.process_identifier = process_identifier
         self.cfg_file = f"{self.dir_manager.cfg_dir}/{cfg_file}"
         self.start_log_file = f"{self.dir_manager.log_dir}/{start_log_file}"
+        self._config = config
         self.command: List[str] = []
+        self.pid = 0
+        self.spawn_time = 0.0
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """Parsed config file, read once on first use unless it was passed in"""
+        if self._config is None:
+            self._config = common.ConfigFileManager.get_json_data(self.cfg_file)
+        return self._config
 
     def run_service(self) -> None:
         self._setup_service()
@@ -48,18 +78,18 @@ class ServiceBase(ABC):
         self._check_service()
 
     def stop_service(self) -> None:
-        print(f"stopping {self.process_identifier} ...")
-        current_pid = os.getpid()
-        for pid in glob.glob("/proc/[0-9]*"):
-            pid_num = int(pid.split("/")[-1])
-            if pid_num == current_pid:
-                continue
-            try:
-                if self.process_identifier in open(f"{pid}/cmdline").read().replace("\0", " "):
-                    os.kill(pid_num, signal.SIGKILL)
-            except (FileNotFoundError, ProcessLookupError, PermissionError):
-                pass
-        time.sleep(1)
+        stop_services([self], self.args.stop_timeout)
+
+    @property
+    def pid_file(self) -> str:
+        name = self.process_identifier.strip("/").replace("/", "_")
+        return f"{self.dir_manager.pid_dir}/{name}.pid"
+
+    def matches(self, argv: List[str]) -> bool:
+        """Whether a process argv belongs to this service instance"""
+        if self.process_identifier in argv:
+            return True
+        return any(os.path.isabs(arg) and arg == self.cfg_file for arg in argv)
 
     @abstractmethod
     def _setup_service(self) -> None:
@@ -70,24 +100,151 @@ class ServiceBase(ABC):
         raise NotImplementedError
 
     def _start_service(self) -> None:
-        common.CommandExecutor.run_background_daemon(self.command, self.start_log_file)
+        self.spawn_time = time.monotonic()
+        pid_file = "" if self.self_daemonizing else self.pid_file
+        self.pid = common.CommandExecutor.run_background_daemon(self.command, self.start_log_file, pid_file)
+
+    def _listen_port(self) -> int:
+        """Port the service listens on, 0 if unknown"""
+        return 0
+
+    def _bind_port(self) -> int:
+        bind_addr = self.config['bind_addr']
+        return int(bind_addr.rsplit(":", 1)[-1])
+
+    def _is_listening(self, port: int) -> bool:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    def _is_alive(self) -> bool:
+        if self.self_daemonizing or self.pid <= 0:
+            return True
+        try:
+            # the daemon is a child of vstart, reap it so an exited daemon is not mistaken for a live zombie
+            if os.waitpid(self.pid, os.WNOHANG)[0] == self.pid:
+                return False
+        except ChildProcessError:
+            pass
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _wait_ready(self, name: str, probe: Callable[[], bool]) -> None:
+        """
+        Poll probe until it passes, failing early when the daemon has exited or the start timeout is hit.
+        Probing starts once the listen port accepts connections, if the service has one.
+        """
+        print(f"checking {name} ...")
+        spawn_time = self.spawn_time or time.monotonic()
+        deadline = spawn_time + self.args.start_timeout
+        port = self._listen_port()
+        listening_time = 0.0
+        interval = self.PROBE_INITIAL_INTERVAL
+        while True:
+            if not listening_time and (port == 0 or self._is_listening(port)):
+                listening_time = time.monotonic()
+            if listening_time and probe():
+                break
+            if not self._is_alive():
+                raise ServiceStartError(f"{name} (pid {self.pid}) exited before ready, see {self.start_log_file}")
+            now = time.monotonic()
+            if now >= deadline:
+                raise ServiceStartError(f"{name} not ready after {self.args.start_timeout}s, see {self.start_log_file}")
+            if self.start_aborted.wait(min(interval, deadline - now)):
+                raise ServiceStartAborted(f"{name} not checked further, another service failed to start")
+            interval = min(interval * 2, self.PROBE_MAX_INTERVAL)
+        ready_time = time.monotonic()
+        print(f"{name} started")
+        self._record_timing(name, spawn_time, listening_time, ready_time)
+
+    def _record_timing(self, name: str, spawn_time: float, listening_time: float, ready_time: float) -> None:
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "version": self.args.version,
+            "az_num": self.args.az_num,
+            "service": name,
+            "instance": self.process_identifier,
+            "pid": self.pid,
+            "spawn_to_listening": round(listening_time - spawn_time, 3),
+            "spawn_to_ready": round(ready_time - spawn_time, 3),
+        }
+        with self._timing_lock:
+            with open(f"{self.dir_manager.log_dir}/startup-timing.jsonl", 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+def stop_services(services: List[ServiceBase], timeout: float = 10) -> None:
+    """
+    Stop services together: send SIGTERM to every daemon at once, wait for all of them until the timeout,
+    then SIGKILL the stragglers. Daemons are found by pid file, or else by argv in one /proc snapshot.
+    """
+    current_pid = os.getpid()
+    snapshot = None
+    targets: Dict[int, ServiceBase] = {}
+    for service in services:
+        print(f"stopping {service.process_identifier} ...")
+        pid = common.ProcFs.read_pidfile(service.pid_file)
+        if pid > 0:
+            targets[pid] = service
+            continue
+        if snapshot is None:
+            snapshot = common.ProcFs.snapshot()
+        for pid, argv in snapshot.items():
+            if pid != current_pid and service.matches(argv):
+                targets[pid] = service
+
+    for pid in list(targets):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            del targets[pid]
+        except PermissionError:
+            print(f"warning: no permission to stop {targets.pop(pid).process_identifier} (pid {pid})")
+
+    deadline = time.monotonic() + timeout
+    interval = ServiceBase.PROBE_INITIAL_INTERVAL
+    alive = [pid for pid in targets if common.ProcFs.is_running(pid)]
+    while alive and time.monotonic() < deadline:
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+        interval = min(interval * 2, ServiceBase.PROBE_MAX_INTERVAL)
+        alive = [pid for pid in alive if common.ProcFs.is_running(pid)]
+
+    for pid in alive:
+        print(f"{targets[pid].process_identifier} (pid {pid}) not stopped after {timeout}s, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    while alive and any(common.ProcFs.is_running(pid) for pid in alive):
+        time.sleep(ServiceBase.PROBE_INITIAL_INTERVAL)
+
+    for service in services:
+        try:
+            os.remove(service.pid_file)
+        except FileNotFoundError:
+            pass
 
 class ServiceConsul(ServiceBase):
     def _setup_service(self) -> None:
         print("starting consul ...")
         self.command = ["/usr/bin/consul", "agent", "-dev", "-client", "0.0.0.0"]
 
+    def _listen_port(self) -> int:
+        return 8500
+
     def _check_service(self) -> None:
-        print("checking consul ...")
         url = "http://localhost:8500/v1/status/leader"
-        while True:
-            result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, str) and result == "127.0.0.1:8300":
-                print("consul started")
-                break
-            time.sleep(1)
+        self._wait_ready("consul", lambda: common.CommandExecutor.run_http_get_json(url) == "127.0.0.1:8300")
 
 class ServiceKafka(ServiceBase):
+    self_daemonizing = True
+
     def _setup_service(self) -> None:
         print("starting kafka ...")
         kafka_path = "/usr/bin/kafka_2.13-3.1.0"
@@ -102,39 +259,40 @@ class ServiceKafka(ServiceBase):
         self.command = [f"{kafka_path}/bin/kafka-server-start.sh", "-daemon",
                         f"{kafka_path}/config/kraft/server.properties"]
 
+    def _listen_port(self) -> int:
+        return 9092
+
+    def matches(self, argv: List[str]) -> bool:
+        # the broker is a java process started by kafka-server-start.sh, match its main class and config
+        return "kafka.Kafka" in argv and any(arg.startswith(self.process_identifier) for arg in argv)
+
     def _check_service(self) -> None:
-        print("checking kafka ...")
         kafka_path = "/usr/bin/kafka_2.13-3.1.0"
         cmd = [f"{kafka_path}/bin/kafka-broker-api-versions.sh", "--bootstrap-server", "localhost:9092"]
-        while True:
-            res = common.CommandExecutor.run_raw(cmd)
-            if res.returncode == 0:
-                print("kafka started")
-                break
-            time.sleep(1)
+        self._wait_ready("kafka", lambda: common.CommandExecutor.run_raw(cmd).returncode == 0)
 
 class ServiceClustermgr(ServiceBase):
+    EXPECTED_STATES = ("StateLeader", "StateReplicate", "StateFollower")
+
     def _setup_service(self) -> None:
         print("starting clustermgr ...")
         self.command = [f"{self.dir_manager.bin_dir}/clustermgr", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        time.sleep(1)
+        url = f"http://127.0.0.1:{self._listen_port()}/stat"
+        self._wait_ready("clustermgr", lambda: ServiceClustermgr.raft_ready(url))
 
     @staticmethod
-    def check_started() -> None:
-        print("checking clustermgr ...")
-        url = "http://127.0.0.1:9998/stat"
-        expected_states=("StateLeader", "StateReplicate", "StateFollower")
-        while True:
-            result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, dict):
-                raft_status = result.get('raft_status', {})
-                raft_state = raft_status.get('raftState') or raft_status.get('raft_state')
-                if raft_state in expected_states:
-                    print("clustermgr started")
-                    break
-            time.sleep(1)
+    def raft_ready(url: str) -> bool:
+        result = common.CommandExecutor.run_http_get_json(url)
+        if not isinstance(result, dict):
+            return False
+        raft_status = result.get('raft_status', {})
+        raft_state = raft_status.get('raftState') or raft_status.get('raft_state')
+        return raft_state in ServiceClustermgr.EXPECTED_STATES
 
 class ServiceBlobnode(ServiceBase):
     def _setup_service(self) -> None:
@@ -142,60 +300,58 @@ class ServiceBlobnode(ServiceBase):
         self._setup_disks_dir()
         self.command = [f"{self.dir_manager.bin_dir}/blobnode", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        print("checking blobnode ...")
-        blobnode_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        port = blobnode_config['bind_addr']
-        url = f"http://127.0.0.1{port}/stat"
-        while True:
+        url = f"http://127.0.0.1:{self._listen_port()}/stat"
+        # generated topologies may give a blobnode fewer disks than the shipped configs
+        expected_disks = min(8, len(self.config['disks']))
+
+        def probe() -> bool:
             result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, list) and len(result) >= 8:
-                print("blobnode started")
-                break
-            time.sleep(1)
+            return isinstance(result, list) and len(result) >= expected_disks
+        self._wait_ready("blobnode", probe)
 
     def _setup_disks_dir(self) -> None:
-        blobnode_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        for disk in blobnode_config['disks']:
+        for disk in self.config['disks']:
             disk_path = Path(disk['path'])
             disk_path.mkdir(parents=True, exist_ok=True)
 
 class ServiceProxy(ServiceBase):
+    # id of the code mode enabled in clustermgr, volumes of it are allocated before the proxy is ready
+    code_mode = 11
+
     def _setup_service(self) -> None:
         print("starting proxy ...")
         self.command = [f"{self.dir_manager.bin_dir}/proxy", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        print("checking proxy ...")
-        proxy_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        port = proxy_config['bind_addr']
-        codemode = 11
-        if self.args.az_num == 'two':
-            codemode = 4
-        url = f"http://127.0.0.1{port}/volume/list?code_mode={codemode}"
-        while True:
+        url = f"http://127.0.0.1:{self._listen_port()}/volume/list?code_mode={self.code_mode}"
+
+        def probe() -> bool:
             result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, dict) and 'vids' in result and len(result['vids']) > 0:
-                print("proxy started")
-                break
-            time.sleep(1)
+            return isinstance(result, dict) and 'vids' in result and len(result['vids']) > 0
+        self._wait_ready("proxy", probe)
 
 class ServiceScheduler(ServiceBase):
     def _setup_service(self) -> None:
         print("starting scheduler ...")
         self.command = [f"{self.dir_manager.bin_dir}/scheduler", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        print("checking scheduler ...")
-        scheduler_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        port = scheduler_config['bind_addr']
-        url = f"http://127.0.0.1{port}/stats"
-        while True:
+        url = f"http://127.0.0.1:{self._listen_port()}/stats"
+
+        def probe() -> bool:
             result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, dict) and len(result) >= 2:
-                print("scheduler started")
-                break
-            time.sleep(1)
+            return isinstance(result, dict) and len(result) >= 2
+        self._wait_ready("scheduler", probe)
 
 class ServiceShardnode(ServiceBase):
     def _setup_service(self) -> None:
@@ -203,22 +359,20 @@ class ServiceShardnode(ServiceBase):
         self._setup_disks_dir()
         self.command = [f"{self.dir_manager.bin_dir}/shardnode", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        print("checking shardnode ...")
-        shardnode_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        port = shardnode_config['bind_addr']
-        url = f"http://127.0.0.1{port}/blob/delete/stats"
+        url = f"http://127.0.0.1:{self._listen_port()}/blob/delete/stats"
         expected_keys=("success_per_min", "failed_per_min")
-        while True:
+
+        def probe() -> bool:
             result = common.CommandExecutor.run_http_get_json(url)
-            if isinstance(result, dict) and all(key in result for key in expected_keys):
-                print("shardnode started")
-                break
-            time.sleep(1)
+            return isinstance(result, dict) and all(key in result for key in expected_keys)
+        self._wait_ready("shardnode", probe)
 
     def _setup_disks_dir(self) -> None:
-        shardnode_config = common.ConfigFileManager.get_json_data(self.cfg_file)
-        disks = shardnode_config.get("disks_config", {}).get("disks", [])
+        disks = self.config.get("disks_config", {}).get("disks", [])
         for disk_path in disks:
             Path(disk_path).mkdir(parents=True, exist_ok=True)
 
@@ -227,24 +381,243 @@ class ServiceAccess(ServiceBase):
         print("starting access ...")
         self.command = [f"{self.dir_manager.bin_dir}/access", "-f", self.cfg_file]
 
+    def _listen_port(self) -> int:
+        return self._bind_port()
+
     def _check_service(self) -> None:
-        print("checking access ...")
-        time.sleep(1)
-        print("access started")
+        # access has no cheap status api, accepting connections means ready
+        self._wait_ready("access", lambda: True)
+
+# code mode name -> (id, az count, units of a stripe), see blobstore/common/codemode
+CODE_MODES = {
+    'EC15P12':   (1, 3, 27),
+    'EC6P6':     (2, 3, 12),
+    'EC16P20L2': (3, 2, 38),
+    'EC6P10L2':  (4, 2, 18),
+    'EC6P3L3':   (5, 3, 12),
+    'EC12P4':    (9, 1, 16),
+    'EC3P3':     (11, 1, 6),
+}
+DEFAULT_CODE_MODES = {1: 'EC3P3', 2: 'EC6P10L2', 3: 'EC6P6'}
+# shard code mode name -> (az count, replicas), every replica needs a shardnode disk of its own
+SHARD_CODE_MODES = {
+    'Replica3OneAZ': (1, 3),
+    'Replica4TwoAZ': (2, 4),
+}
+DEFAULT_SHARD_CODE_MODES = {1: 'Replica3OneAZ', 2: 'Replica4TwoAZ'}
+AZ_NUMS = {'one': 1, 'two': 2, 'three': 3}
+
+class Topology:
+    """Cluster layout that configs are generated from, read from a json spec and overridden by flags"""
+    FIELDS = {
+        'azs': 1,
+        'blobnodes_per_az': 1,
+        'disks_per_blobnode': 15,
+        'clustermgr_members': 3,
+        'clustermgr_port': 9998,
+        'clustermgr_raft_port': 10110,
+        'blobnode_port': 8899,
+        'code_mode': '',
+        'shard_code_mode': '',
+    }
+
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        unknown = sorted(set(spec) - set(self.FIELDS))
+        if unknown:
+            print(f"Error: unknown topology fields {', '.join(unknown)}, expect {', '.join(self.FIELDS)}")
+            sys.exit(1)
+        for field, default in self.FIELDS.items():
+            setattr(self, field, spec.get(field, default))
+        for field in ('azs', 'blobnodes_per_az', 'disks_per_blobnode', 'clustermgr_members'):
+            if not isinstance(getattr(self, field), int) or getattr(self, field) < 1:
+                print(f"Error: topology {field} must be a positive integer")
+                sys.exit(1)
+        self.code_mode = self.code_mode or DEFAULT_CODE_MODES.get(self.azs, '')
+        if self.code_mode not in CODE_MODES:
+            print(f"Error: code mode '{self.code_mode}' for {self.azs} AZs is unknown, "
+                  f"set code_mode to one of {', '.join(CODE_MODES)}")
+            sys.exit(1)
+        _, mode_azs, units = CODE_MODES[self.code_mode]
+        if mode_azs != self.azs:
+            print(f"Error: code mode {self.code_mode} spans {mode_azs} AZs, topology has {self.azs}")
+            sys.exit(1)
+        # every unit of a stripe goes to a different disk of its AZ
+        if self.blobnodes_per_az * self.disks_per_blobnode < units // mode_azs:
+            print(f"Error: {self.code_mode} needs {units // mode_azs} disks per AZ, "
+                  f"topology has {self.blobnodes_per_az * self.disks_per_blobnode}")
+            sys.exit(1)
+
+    @staticmethod
+    def from_args(args: argparse.Namespace) -> "Topology":
+        spec: Dict[str, Any] = {'azs': AZ_NUMS[args.az_num]}
+        if args.topology:
+            spec.update(common.ConfigFileManager.get_json_data(args.topology))
+        for field in ('blobnodes_per_az', 'disks_per_blobnode', 'clustermgr_members'):
+            if getattr(args, field) is not None:
+                spec[field] = getattr(args, field)
+        return Topology(spec)
+
+    @property
+    def code_mode_id(self) -> int:
+        return CODE_MODES[self.code_mode][0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+class ConfigGenerator:
+    """
+    Generate the configs of a topology from the one AZ templates of a version. Configs are returned
+    parsed so services are built from them directly, and also written out for the daemons to read.
+    """
+
+    def __init__(self, version: str, topology: Topology, out_dir: str) -> None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.template_dir = os.path.join(script_dir, f"cfg-{version}", "az-one")
+        self.version = version
+        self.out_dir = os.path.join(script_dir, out_dir)
+        self.topology = topology
+
+    def _template(self, name: str) -> Dict[str, Any]:
+        return common.ConfigFileManager.get_json_data(os.path.join(self.template_dir, name))
+
+    def blobnode_names(self) -> List[str]:
+        return [f"blobnode-z{az}-{index}" for az in range(self.topology.azs)
+                for index in range(self.topology.blobnodes_per_az)]
+
+    def clustermgr_hosts(self) -> List[str]:
+        port = self.topology.clustermgr_port
+        return [f"http://127.0.0.1:{port + i}" for i in range(self.topology.clustermgr_members)]
+
+    def shard_code_mode(self) -> str:
+        """Shard code mode of versions with shardnodes, empty for older ones"""
+        if not os.path.exists(os.path.join(self.template_dir, "shardnode.json")):
+            return ""
+        topo = self.topology
+        if not any(azs == topo.azs for azs, _ in SHARD_CODE_MODES.values()):
+            supported = " or ".join(str(azs) for azs in sorted(DEFAULT_SHARD_CODE_MODES))
+            print(f"Error: version {self.version} does not support {topo.azs} AZs, no shard code mode replicates "
+                  f"across {topo.azs} AZs. Use --version 1.4.x or a topology of {supported} AZs")
+            sys.exit(1)
+        shard_mode = topo.shard_code_mode or DEFAULT_SHARD_CODE_MODES[topo.azs]
+        if shard_mode not in SHARD_CODE_MODES:
+            print(f"Error: shard code mode '{shard_mode}' is unknown, "
+                  f"set shard_code_mode to one of {', '.join(SHARD_CODE_MODES)}")
+            sys.exit(1)
+        if SHARD_CODE_MODES[shard_mode][0] != topo.azs:
+            print(f"Error: shard code mode {shard_mode} spans {SHARD_CODE_MODES[shard_mode][0]} AZs, "
+                  f"topology has {topo.azs}")
+            sys.exit(1)
+        return shard_mode
+
+    def generate(self) -> Dict[str, Dict[str, Any]]:
+        """Return config file name -> parsed config of every service"""
+        topo = self.topology
+        idcs = [f"z{az}" for az in range(topo.azs)]
+        cm_hosts = self.clustermgr_hosts()
+        configs: Dict[str, Dict[str, Any]] = {}
+        shard_mode = self.shard_code_mode()
+
+        members = [{"id": i + 1, "host": f"127.0.0.1:{topo.clustermgr_raft_port + i}", "learner": False,
+                    "node_host": f"127.0.0.1:{topo.clustermgr_port + i}"} for i in range(topo.clustermgr_members)]
+        template = self._template("clustermgr1.json")
+        for i in range(topo.clustermgr_members):
+            cfg = json.loads(json.dumps(template))
+            node = i + 1
+            cfg['bind_addr'] = f":{topo.clustermgr_port + i}"
+            cfg['idc'] = idcs
+            cfg['log']['filename'] = f"./run/log/clustermgr{node}.log"
+            if cfg['auditlog'].get('logdir'):
+                cfg['auditlog']['logdir'] = f"./run/log/auditlog/clustermgr{node}"
+            cfg['db_path'] = f"./run/lib/db{node}"
+            for policy in cfg['code_mode_policies']:
+                policy['mode_name'] = topo.code_mode
+            if 'shard_code_mode_name' in cfg:
+                cfg['shard_code_mode_name'] = shard_mode
+            server = cfg['raft_config']['server_config']
+            server['nodeId'] = node
+            server['listen_port'] = topo.clustermgr_raft_port + i
+            server['raft_wal_dir'] = f"./run/lib/raftwal{node}"
+            cfg['raft_config']['raft_node_config']['members'] = members
+            configs[f"clustermgr{node}.json"] = cfg
+
+        template = self._template("blobnode.json")
+        disk_template = template['disks'][0]
+        for n, name in enumerate(self.blobnode_names()):
+            cfg = json.loads(json.dumps(template))
+            port = topo.blobnode_port + n
+            cfg['bind_addr'] = f":{port}"
+            cfg['idc'] = idcs[n // topo.blobnodes_per_az]
+            cfg['host'] = f"http://127.0.0.1:{port}"
+            cfg['dropped_bid_record']['dir'] = f"./run/log/dropped-{name}"
+            cfg['disks'] = [dict(disk_template, path=f"./run/lib/disks/{name}/disk{d + 1}")
+                            for d in range(topo.disks_per_blobnode)]
+            cfg['clustermgr']['hosts'] = cm_hosts
+            cfg['log']['filename'] = f"./run/log/{name}.log"
+            if cfg['auditlog'].get('logdir'):
+                cfg['auditlog']['logdir'] = f"./run/log/auditlog/{name}"
+            configs[f"{name}.json"] = cfg
+
+        for name in ("proxy.json", "scheduler.json", "access.json", "shardnode.json", "sdk.json", "bench.json"):
+            if not os.path.exists(os.path.join(self.template_dir, name)):
+                continue
+            cfg = self._template(name)
+            if 'clustermgr' in cfg:
+                cfg['clustermgr']['hosts'] = cm_hosts
+            if 'cm_config' in cfg:
+                cfg['cm_config']['hosts'] = cm_hosts
+            for cluster in cfg.get('stream', {}).get('cluster_config', {}).get('clusters', []):
+                cluster['hosts'] = cm_hosts
+            if name == "shardnode.json":
+                replicas = SHARD_CODE_MODES[shard_mode][1]
+                cfg['disks_config']['disks'] = [f"./run/lib/disks/shard-disk{d + 1}" for d in range(replicas)]
+            configs[name] = cfg
+
+        self._check_ports(configs)
+        self._write(configs)
+        return configs
+
+    @staticmethod
+    def _check_ports(configs: Dict[str, Dict[str, Any]]) -> None:
+        owners: Dict[int, str] = {}
+        for name, cfg in configs.items():
+            ports = []
+            if 'bind_addr' in cfg:
+                ports.append(int(cfg['bind_addr'].rsplit(":", 1)[-1]))
+            if 'raft_config' in cfg:
+                ports.append(cfg['raft_config']['server_config']['listen_port'])
+            for port in ports:
+                if port in owners:
+                    print(f"Error: port {port} of {name} is also used by {owners[port]}, change the topology ports")
+                    sys.exit(1)
+                owners[port] = name
+
+    def _write(self, configs: Dict[str, Dict[str, Any]]) -> None:
+        Path(self.out_dir).mkdir(parents=True, exist_ok=True)
+        wanted = set(configs) | {"topology.json"}
+        # configs of blobnodes dropped from the topology would be picked up by nothing, remove them
+        for stale in Path(self.out_dir).glob("*.json"):
+            if stale.name not in wanted:
+                stale.unlink()
+        for name, cfg in list(configs.items()) + [("topology.json", self.topology.to_dict())]:
+            tmp = os.path.join(self.out_dir, f".{name}.tmp")
+            with open(tmp, 'w') as f:
+                json.dump(cfg, f, indent=4)
+            os.replace(tmp, os.path.join(self.out_dir, name))
 
 SERVICE_CHOICES = ['all', 'depends', 'blobstore', 'consul', 'kafka',
                    'clustermgr', 'blobnode', 'proxy', 'scheduler', 'access', 'shardnode']
 
 class VstartManager:
+    # depends_on only orders groups started together, dependencies outside the started target are not waited on
     SERVICE_GROUPS = {
-        'consul':      {'list_attr': 'services_consul'},
-        'kafka':       {'list_attr': 'services_kafka'},
-        'clustermgr':  {'list_attr': 'services_clustermgr', 'start_hook': lambda _: ServiceClustermgr.check_started()},
-        'blobnode':    {'list_attr': 'services_blobnode'},
-        'proxy':       {'list_attr': 'services_proxy'},
-        'scheduler':   {'list_attr': 'services_scheduler'},
-        'access':      {'list_attr': 'services_access'},
-        'shardnode':   {'list_attr': 'services_shardnode'},
+        'consul':      {'list_attr': 'services_consul', 'depends_on': []},
+        'kafka':       {'list_attr': 'services_kafka', 'depends_on': []},
+        'clustermgr':  {'list_attr': 'services_clustermgr', 'depends_on': ['consul']},
+        'blobnode':    {'list_attr': 'services_blobnode', 'depends_on': ['clustermgr']},
+        'proxy':       {'list_attr': 'services_proxy', 'depends_on': ['clustermgr', 'kafka']},
+        'scheduler':   {'list_attr': 'services_scheduler', 'depends_on': ['blobnode', 'proxy']},
+        'access':      {'list_attr': 'services_access', 'depends_on': ['blobnode', 'proxy']},
+        'shardnode':   {'list_attr': 'services_shardnode', 'depends_on': ['blobnode', 'proxy']},
     }
     COMPOSITE_SERVICES = {
         'depends':    ['consul', 'kafka'],
@@ -263,17 +636,50 @@ class VstartManager:
         parser.add_argument('--version', type=str, default='1.4.x', choices=['1.4.x', '1.5.x'],
                             help='Specify the version of Blobstore')
         parser.add_argument('--az-num', type=str, default='one', choices=['one', 'two', 'three'],
-                            help='Number of availability zones to create')
+                            help='Number of availability zones to create, three needs --version 1.4.x')
+        parser.add_argument('--topology', type=str, default='',
+                            help='Generate configs from this json topology spec instead of the shipped ones, '
+                                 f'fields: {", ".join(Topology.FIELDS)}')
+        parser.add_argument('--blobnodes-per-az', type=int, default=None,
+                            help='Generate configs with this many blobnodes in each AZ')
+        parser.add_argument('--disks-per-blobnode', type=int, default=None,
+                            help='Generate configs with this many disks on each blobnode')
+        parser.add_argument('--clustermgr-members', type=int, default=None,
+                            help='Generate configs with this many clustermgr raft members')
         parser.add_argument('--start', type=str, default='', choices=SERVICE_CHOICES,
                             help='Start specific service by name')
         parser.add_argument('--stop', type=str, default='', choices=SERVICE_CHOICES,
                             help='Stop specific service by name')
         parser.add_argument('--restart', type=str, default='', choices=SERVICE_CHOICES,
                             help='Restart specific service by name')
+        parser.add_argument('--start-timeout', type=float, default=300,
+                            help='Seconds to wait for each service to be ready before giving up')
+        parser.add_argument('--stop-timeout', type=float, default=10,
+                            help='Seconds to wait for services to exit after SIGTERM before SIGKILL')
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='Print calls, latency, bytes and errors per http endpoint of the readiness probes on exit')
+        parser.add_argument('--profile-prom', type=str, metavar='FILE',
+                            help='Also write the --profile metrics to FILE in Prometheus text format')
         parser.add_argument('--rmdir', action='store_true', default=False,
                             help='Remove existing directories before starting services')
         return parser.parse_args()
 
+    def _is_generated(self) -> bool:
+        """Whether configs are generated from a topology, three AZs only exist as a generated topology"""
+        overrides = (self.args.blobnodes_per_az, self.args.disks_per_blobnode, self.args.clustermgr_members)
+        return self.args.az_num == 'three' or bool(self.args.topology) or any(v is not None for v in overrides)
+
+    def _service(self, cls: type, name: str) -> ServiceBase:
+        cfg_file = f"{name}.json"
+        return cls(self.args, self.dir_manager, cfg_file, cfg_file, f"{name}-start.log", self.configs.get(cfg_file))
+
+    def _code_mode_id(self) -> int:
+        cm_config = self.configs.get("clustermgr1.json", {})
+        for policy in cm_config.get('code_mode_policies', []):
+            if policy.get('enable') and policy.get('mode_name') in CODE_MODES:
+                return CODE_MODES[policy['mode_name']][0]
+        return ServiceProxy.code_mode
+
     def setup_services_default(self) -> None:
         self.services_consul = [
             ServiceConsul(self.args, self.dir_manager, "/usr/bin/consul", "", "consul-start.log"),
@@ -281,64 +687,144 @@ class VstartManager:
         self.services_kafka = [
             ServiceKafka(self.args, self.dir_manager, "/usr/bin/kafka_2.13-3.1.0", "", "kafka-start.log"),
         ]
+        cm_count = sum(1 for name in self.configs if name.startswith("clustermgr"))
         self.services_clustermgr = [
-            ServiceClustermgr(self.args, self.dir_manager, "clustermgr1.json", "clustermgr1.json", "clustermgr1-start.log"),
-            ServiceClustermgr(self.args, self.dir_manager, "clustermgr2.json", "clustermgr2.json", "clustermgr2-start.log"),
-            ServiceClustermgr(self.args, self.dir_manager, "clustermgr3.json", "clustermgr3.json", "clustermgr3-start.log"),
+            self._service(ServiceClustermgr, f"clustermgr{node}") for node in range(1, cm_count + 1)
         ]
         self.services_proxy = [
-            ServiceProxy(self.args, self.dir_manager, "proxy.json", "proxy.json", "proxy-start.log"),
+            self._service(ServiceProxy, "proxy"),
         ]
+        self.services_proxy[0].code_mode = self._code_mode_id()
         self.services_scheduler = [
-            ServiceScheduler(self.args, self.dir_manager, "scheduler.json", "scheduler.json", "scheduler-start.log"),
+            self._service(ServiceScheduler, "scheduler"),
         ]
         self.services_access = [
-            ServiceAccess(self.args, self.dir_manager, "access.json", "access.json", "access-start.log"),
+            self._service(ServiceAccess, "access"),
         ]
         self.services_shardnode = []
 
     def setup_services_one_az(self) -> None:
         self.services_blobnode = [
-            ServiceBlobnode(self.args, self.dir_manager, "blobnode.json", "blobnode.json", "blobnode-start.log"),
+            self._service(ServiceBlobnode, "blobnode"),
         ]
 
     def setup_services_two_az(self) -> None:
         self.services_blobnode = [
-            ServiceBlobnode(self.args, self.dir_manager, "blobnode-z0.json", "blobnode-z0.json", "blobnode-z0-start.log"),
-            ServiceBlobnode(self.args, self.dir_manager, "blobnode-z1.json", "blobnode-z1.json", "blobnode-z1-start.log"),
+            self._service(ServiceBlobnode, "blobnode-z0"),
+            self._service(ServiceBlobnode, "blobnode-z1"),
         ]
 
-    def setup_services_three_az(self) -> None:
-        print("Three AZ setup is not implemented yet.")
-        exit(1)
+    def setup_services_topology(self) -> None:
+        self.services_blobnode = [
+            self._service(ServiceBlobnode, name) for name in self.generator.blobnode_names()
+        ]
 
     def setup_services_shardnode(self) -> None:
         self.services_shardnode = [
-            ServiceShardnode(self.args, self.dir_manager, "shardnode.json", "shardnode.json", "shardnode-start.log"),
+            self._service(ServiceShardnode, "shardnode"),
         ]
 
+    @staticmethod
+    def _run_parallel(tasks: List[Callable[[], None]]) -> None:
+        if len(tasks) <= 1:
+            for task in tasks:
+                task()
+            return
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            futures = [pool.submit(task) for task in tasks]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            try:
+                for future in done:
+                    future.result()
+            except BaseException:
+                VstartManager._abort_start(pool, futures)
+                raise
+
+    @staticmethod
+    def _abort_start(pool: ThreadPoolExecutor, futures: List[Future]) -> None:
+        """Stop the remaining probes and drop queued starts, then raise the failure that caused it"""
+        ServiceBase.start_aborted.set()
+        pool.shutdown(cancel_futures=True)
+        for future in futures:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None and not isinstance(error, ServiceStartAborted):
+                raise error
+
     def _start_service_group(self, group_name: str) -> None:
         config = self.SERVICE_GROUPS[group_name]
         services = getattr(self, config['list_attr'])
-        for service in services:
-            service.run_service()
-        hook = config.get('start_hook')
-        if hook:
-            hook(services)
+        self._run_parallel([service.run_service for service in services])
+
+    def _start_groups_by_dependency(self, groups: List[str]) -> Dict[str, Tuple[float, float]]:
+        """Start every group as soon as its dependencies are ready, return (start, ready) seconds of each"""
+        begin = time.monotonic()
+
+        def timed_start(group_name: str) -> Tuple[float, float]:
+            start = time.monotonic() - begin
+            self._start_service_group(group_name)
+            return start, time.monotonic() - begin
+
+        pending = {group: {dep for dep in self.SERVICE_GROUPS[group]['depends_on'] if dep in groups}
+                   for group in groups}
+        timings: Dict[str, Tuple[float, float]] = {}
+        running = {}
+        submitted: List[Future] = []
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            try:
+                while pending or running:
+                    for group in [group for group, deps in pending.items() if not deps]:
+                        del pending[group]
+                        future = pool.submit(timed_start, group)
+                        running[future] = group
+                        submitted.append(future)
+                    if not running:
+                        raise ValueError(f"dependency cycle between services: {', '.join(pending)}")
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        group = running.pop(future)
+                        timings[group] = future.result()
+                        for deps in pending.values():
+                            deps.discard(group)
+            except BaseException:
+                self._abort_start(pool, submitted)
+                raise
+        return timings
+
+    def _critical_path(self, timings: Dict[str, Tuple[float, float]]) -> List[str]:
+        path = []
+        group = max(timings, key=lambda name: timings[name][1]) if timings else None
+        while group is not None:
+            path.append(group)
+            deps = [dep for dep in self.SERVICE_GROUPS[group]['depends_on'] if dep in timings]
+            group = max(deps, key=lambda name: timings[name][1]) if deps else None
+        return list(reversed(path))
+
+    def _print_timing_report(self, timings: Dict[str, Tuple[float, float]]) -> None:
+        critical_path = self._critical_path(timings)
+        print("startup timing (seconds since start, * on critical path):")
+        print(f"  {'service':<12} {'start':>8} {'ready':>8} {'took':>8}")
+        for group, (start, ready) in sorted(timings.items(), key=lambda item: item[1]):
+            mark = "*" if group in critical_path else ""
+            print(f"  {group:<12} {start:>8.2f} {ready:>8.2f} {ready - start:>8.2f} {mark}".rstrip())
+        if critical_path:
+            total = timings[critical_path[-1]][1]
+            print(f"critical path: {' -> '.join(critical_path)} ({total:.2f}s)")
 
     def _stop_service_group(self, group_name: str) -> None:
         config = self.SERVICE_GROUPS[group_name]
-        services = getattr(self, config['list_attr'])
-        for service in services:
-            service.stop_service()
+        stop_services(getattr(self, config['list_attr']), self.args.stop_timeout)
 
     def _start_composite(self, name: str) -> None:
-        for svc in self.COMPOSITE_SERVICES[name]:
-            self._start_service_group(svc)
+        timings = self._start_groups_by_dependency(self.COMPOSITE_SERVICES[name])
+        self._print_timing_report(timings)
 
     def _stop_composite(self, name: str) -> None:
+        services = []
         for svc in reversed(self.COMPOSITE_SERVICES[name]):
-            self._stop_service_group(svc)
+            services.extend(getattr(self, self.SERVICE_GROUPS[svc]['list_attr']))
+        stop_services(services, self.args.stop_timeout)
 
     def _execute_action(self, action: str, target: str) -> None:
         if target in self.COMPOSITE_SERVICES:
@@ -361,18 +847,43 @@ class VstartManager:
             raise ValueError(f"Unknown service: {target}")
 
     def run(self) -> None:
-        cfg_dir = f"cfg-{self.args.version}/az-{self.args.az_num}"
-        print(f"Using configuration directory: {cfg_dir}")
-        self.dir_manager = DirectoryManager(cfg_dir)
+        common.HttpProfiler.configure(self.args.profile or bool(self.args.profile_prom))
+        try:
+            self._run()
+        finally:
+            if self.args.profile:
+                print("http profile:")
+                for line in common.HttpProfiler.summary():
+                    print(f"  {line}")
+            if self.args.profile_prom:
+                common.HttpProfiler.write_prometheus(self.args.profile_prom, "blobstore_vstart")
+
+    def _run(self) -> None:
+        if self._is_generated():
+            topology = Topology.from_args(self.args)
+            cfg_dir = f"run/cfg-{self.args.version}-generated"
+            self.generator = ConfigGenerator(self.args.version, topology, cfg_dir)
+            self.configs = self.generator.generate()
+            print(f"Generated configuration directory: {cfg_dir} ({topology.azs} AZs, "
+                  f"{len(self.generator.blobnode_names())} blobnodes, {topology.disks_per_blobnode} disks each, "
+                  f"{topology.clustermgr_members} clustermgrs, {topology.code_mode})")
+            self.dir_manager = DirectoryManager(cfg_dir)
+        else:
+            cfg_dir = f"cfg-{self.args.version}/az-{self.args.az_num}"
+            print(f"Using configuration directory: {cfg_dir}")
+            self.dir_manager = DirectoryManager(cfg_dir)
+            self.configs = {path.name: common.ConfigFileManager.get_json_data(str(path))
+                            for path in Path(self.dir_manager.cfg_dir).glob("*.json")}
         self.dir_manager.setup_directory()
 
         self.setup_services_default()
         az_setup_map = {
             'one': self.setup_services_one_az,
             'two': self.setup_services_two_az,
-            'three': self.setup_services_three_az,
         }
-        if self.args.az_num in az_setup_map:
+        if self._is_generated():
+            self.setup_services_topology()
+        elif self.args.az_num in az_setup_map:
             az_setup_map[self.args.az_num]()
         else:
             print(f"Invalid az-num: {self.args.az_num}")
@@ -391,7 +902,11 @@ class VstartManager:
         if self.args.restart:
             actions.append(('restart', self.args.restart))
         for action, target in actions:
-            self._execute_action(action, target)
+            try:
+                self._execute_action(action, target)
+            except ServiceStartError as e:
+                print(f"error: {e}")
+                sys.exit(1)
 
         if self.args.rmdir:
             print("Removing all directories...")
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Run /usr/bin/bench over a matrix of sizes, threads and modes, as a replacement of run_bench.sh.
+
+Every run gets a unique id, its raw output goes to <output-dir>/<run id>.log and a structured record
+(parameters, wall time, rusage of the bench process, host cpu/disk usage, parsed bench metrics) is
+appended to <output-dir>/results.jsonl. A summary table across the matrix is printed at the end.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import secrets
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# metrics printed by bench, the last occurrence in the log wins so the final summary is kept
+QPS_PATTERN = re.compile(r"\b(?:qps|iops|ops/s)\s*[:=]\s*([0-9.]+)", re.IGNORECASE)
+THROUGHPUT_PATTERN = re.compile(r"\b(?:throughput|bandwidth|bw)\s*[:=]\s*([0-9.]+)\s*([KMGT]?i?B)/s", re.IGNORECASE)
+LATENCY_PATTERN = re.compile(
+    r"\b(avg|mean|min|max|p50|p90|p95|p99|p999|p99\.9)(?:[ _-]?lat(?:ency)?)?\s*[:=]\s*([0-9.]+)\s*(ns|us|µs|ms|s)\b",
+    re.IGNORECASE)
+COUNT_PATTERN = re.compile(r"\b(success|succeeded|ok|failed|fail|errors?)\s*[:=]\s*([0-9]+)\b", re.IGNORECASE)
+
+LATENCY_UNITS_US = {"ns": 0.001, "us": 1.0, "µs": 1.0, "ms": 1000.0, "s": 1000000.0}
+BYTE_UNITS_MB = {"B": 1 / 1048576, "KB": 1 / 1024, "KIB": 1 / 1024, "MB": 1.0, "MIB": 1.0,
+                 "GB": 1024.0, "GIB": 1024.0, "TB": 1048576.0, "TIB": 1048576.0}
+COUNT_KEYS = {"success": "success", "succeeded": "success", "ok": "success",
+              "failed": "errors", "fail": "errors", "error": "errors", "errors": "errors"}
+
+class BenchOutputParser:
+    """Pull qps, throughput, latency percentiles and request counts out of raw bench output"""
+
+    @staticmethod
+    def parse(text: str) -> Dict[str, float]:
+        metrics: Dict[str, float] = {}
+        for match in QPS_PATTERN.finditer(text):
+            metrics["qps"] = float(match.group(1))
+        for match in THROUGHPUT_PATTERN.finditer(text):
+            unit = match.group(2).upper()
+            metrics["throughput_mb"] = float(match.group(1)) * BYTE_UNITS_MB.get(unit, 1.0)
+        for match in LATENCY_PATTERN.finditer(text):
+            name = match.group(1).lower().replace("p99.9", "p999").replace("mean", "avg")
+            metrics[f"lat_{name}_us"] = float(match.group(2)) * LATENCY_UNITS_US[match.group(3).lower()]
+        for match in COUNT_PATTERN.finditer(text):
+            metrics[COUNT_KEYS[match.group(1).lower()]] = float(match.group(2))
+        return metrics
+
+    @staticmethod
+    def parse_file(path: str) -> Dict[str, float]:
+        with open(path, "r", errors="replace") as f:
+            return BenchOutputParser.parse(f.read())
+
+class HostUsage:
+    """Host cpu and whole-disk io counters from /proc, diffed around a run"""
+
+    @staticmethod
+    def snapshot() -> Dict[str, float]:
+        usage: Dict[str, float] = {}
+        try:
+            with open("/proc/stat", "r") as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+            # user nice system idle iowait irq softirq steal
+            usage["cpu_total"] = float(sum(fields[:8]))
+            usage["cpu_idle"] = float(fields[3])
+            usage["cpu_iowait"] = float(fields[4])
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            disks = set(os.listdir("/sys/block"))
+            read_sectors = write_sectors = 0
+            with open("/proc/diskstats", "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 10 and parts[2] in disks and not parts[2].startswith(("loop", "ram")):
+                        read_sectors += int(parts[5])
+                        write_sectors += int(parts[9])
+            usage["disk_read_sectors"] = float(read_sectors)
+            usage["disk_write_sectors"] = float(write_sectors)
+        except (OSError, ValueError):
+            pass
+        return usage
+
+    @staticmethod
+    def diff(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+        result: Dict[str, float] = {}
+        total = after.get("cpu_total", 0) - before.get("cpu_total", 0)
+        if total > 0:
+            idle = after["cpu_idle"] - before["cpu_idle"]
+            iowait = after["cpu_iowait"] - before["cpu_iowait"]
+            result["host_cpu_pct"] = round(100.0 * (total - idle - iowait) / total, 2)
+            result["host_iowait_pct"] = round(100.0 * iowait / total, 2)
+        if "disk_read_sectors" in before and "disk_read_sectors" in after:
+            result["host_disk_read_mb"] = round((after["disk_read_sectors"] - before["disk_read_sectors"]) * 512 / 1048576, 2)
+            result["host_disk_write_mb"] = round((after["disk_write_sectors"] - before["disk_write_sectors"]) * 512 / 1048576, 2)
+        return result
+
+class BenchRunner:
+    """Run bench once per matrix point and iteration, recording each run to results.jsonl"""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        # one session id per invocation, runs started in the same second never collide
+        self.session = time.strftime("%Y%m%d%H%M%S") + "-" + secrets.token_hex(3)
+        self.results_file = os.path.join(args.output_dir, "results.jsonl")
+        self.stopped = False
+
+    def matrix(self) -> List[Tuple[str, str, int, int]]:
+        return [(mode, size, threads, i) for mode, size, threads in
+                itertools.product(self.args.modes, self.args.sizes, self.args.threads)
+                for i in range(1, self.args.iterations + 1)]
+
+    def build_command(self, run_id: str, mode: str, size: str, threads: int) -> List[str]:
+        return [self.args.bench,
+                "-b", self.args.target,
+                "-c", self.args.config,
+                "-r", self.args.db,
+                "-e", "-1",
+                "-m", mode,
+                "-pr", f"{self.args.prefix}-{size}-{run_id}",
+                "-s", size,
+                "-t", str(threads),
+                "-d", "-1",
+                "-n", str(self.args.count)] + self.args.extra
+
+    def run_one(self, run_id: str, mode: str, size: str, threads: int, iteration: int) -> Dict[str, Any]:
+        command = self.build_command(run_id, mode, size, threads)
+        logfile = os.path.join(self.args.output_dir, f"{run_id}.log")
+        record: Dict[str, Any] = {"run_id": run_id, "session": self.session, "mode": mode, "size": size,
+                                  "threads": threads, "iteration": iteration, "command": command, "log": logfile,
+                                  "start_time": time.time()}
+        if self.args.dry_run:
+            print(" ".join(command))
+            return record
+
+        host_before = HostUsage.snapshot()
+        start = time.monotonic()
+        with open(logfile, "w") as log:
+            try:
+                proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+            except OSError as e:
+                print(f"Error: failed to start {command[0]}: {e}")
+                sys.exit(1)
+            try:
+                # wait4 gives the rusage of the bench process alone, not of everything we forked
+                _, status, rusage = os.wait4(proc.pid, 0)
+            except KeyboardInterrupt:
+                proc.send_signal(signal.SIGINT)
+                _, status, rusage = os.wait4(proc.pid, 0)
+                self.stopped = True
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        record["wall_sec"] = round(time.monotonic() - start, 3)
+        record["exit_code"] = proc.returncode
+        record["rusage"] = {
+            "user_sec": round(rusage.ru_utime, 3),
+            "sys_sec": round(rusage.ru_stime, 3),
+            "max_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+            "major_faults": rusage.ru_majflt,
+            "inblock": rusage.ru_inblock,
+            "oublock": rusage.ru_oublock,
+            "voluntary_ctx": rusage.ru_nvcsw,
+            "involuntary_ctx": rusage.ru_nivcsw,
+        }
+        record["host"] = HostUsage.diff(host_before, HostUsage.snapshot())
+        record["metrics"] = BenchOutputParser.parse_file(logfile)
+        return record
+
+    def run(self) -> List[Dict[str, Any]]:
+        os.makedirs(self.args.output_dir, exist_ok=True)
+        matrix = self.matrix()
+        records = []
+        for index, (mode, size, threads, iteration) in enumerate(matrix, start=1):
+            run_id = f"{self.session}-{mode}-{size}-t{threads}-r{iteration}"
+            print("========================================")
+            print(f"Run {index}/{len(matrix)}: mode={mode} size={size} threads={threads} iteration={iteration}")
+            print(f"Run ID: {run_id}")
+            record = self.run_one(run_id, mode, size, threads, iteration)
+            records.append(record)
+            if self.args.dry_run:
+                continue
+            with open(self.results_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            metrics = record["metrics"]
+            print(f"Finished in {record['wall_sec']}s, exit code {record['exit_code']}, "
+                  f"qps {metrics.get('qps', '-')}, p99 {metrics.get('lat_p99_us', '-')}us")
+            print(f"Log saved to: {record['log']}")
+            if self.stopped:
+                print("Interrupted, skipping the remaining runs")
+                break
+            if self.args.cooldown > 0 and index < len(matrix):
+                time.sleep(self.args.cooldown)
+        return records
+
+class BenchSummary:
+    """Aggregate the iterations of every matrix point into one row"""
+
+    COLUMNS = ["mode", "size", "threads", "runs", "failed", "wall_s", "qps", "MB/s", "avg_us", "p99_us",
+               "cpu_s", "rss_mb", "host_cpu%"]
+
+    @staticmethod
+    def median(values: List[float]) -> Optional[float]:
+        return statistics.median(values) if values else None
+
+    @staticmethod
+    def rows(records: List[Dict[str, Any]]) -> List[List[str]]:
+        groups: Dict[Tuple[str, str, int], List[Dict[str, Any]]] = {}
+        for record in records:
+            groups.setdefault((record["mode"], record["size"], record["threads"]), []).append(record)
+        rows = []
+        for (mode, size, threads), group in groups.items():
+            def collect(getter: Any) -> List[float]:
+                values = []
+                for record in group:
+                    try:
+                        value = getter(record)
+                    except KeyError:
+                        continue
+                    if value is not None:
+                        values.append(float(value))
+                return values
+            cells = [
+                BenchSummary.median(collect(lambda r: r["wall_sec"])),
+                BenchSummary.median(collect(lambda r: r["metrics"]["qps"])),
+                BenchSummary.median(collect(lambda r: r["metrics"]["throughput_mb"])),
+                BenchSummary.median(collect(lambda r: r["metrics"]["lat_avg_us"])),
+                BenchSummary.median(collect(lambda r: r["metrics"]["lat_p99_us"])),
+                BenchSummary.median(collect(lambda r: r["rusage"]["user_sec"] + r["rusage"]["sys_sec"])),
+                BenchSummary.median(collect(lambda r: r["rusage"]["max_rss_mb"])),
+                BenchSummary.median(collect(lambda r: r["host"]["host_cpu_pct"])),
+            ]
+            failed = sum(1 for record in group if record.get("exit_code", 0) != 0)
+            rows.append([mode, size, str(threads), str(len(group)), str(failed)] +
+                        ["-" if cell is None else f"{cell:.2f}" for cell in cells])
+        return rows
+
+    @staticmethod
+    def print_table(records: List[Dict[str, Any]]) -> None:
+        rows = [BenchSummary.COLUMNS] + BenchSummary.rows(records)
+        widths = [max(len(row[i]) for row in rows) for i in range(len(BenchSummary.COLUMNS))]
+        print("Summary (medians across iterations):")
+        for n, row in enumerate(rows):
+            print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+            if n == 0:
+                print("  ".join("-" * width for width in widths))
+
+def split_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sweep /usr/bin/bench over sizes, threads and modes",
+                                     epilog="Arguments after -- are passed to bench as is")
+    parser.add_argument("--bench", default="/usr/bin/bench", help="Path of the bench binary")
+    parser.add_argument("--target", default="blobnode", help="Bench target (-b)")
+    parser.add_argument("--config", default="/root/blobstore/bench.json", help="Bench config (-c)")
+    parser.add_argument("--db", default="/root/blobstore/db", help="Bench db dir (-r)")
+    parser.add_argument("--sizes", type=split_list, default=["8K"], help="Comma separated sizes (-s), default 8K")
+    parser.add_argument("--threads", type=lambda v: [int(t) for t in split_list(v)], default=[18],
+                        help="Comma separated thread counts (-t), default 18")
+    parser.add_argument("--modes", type=split_list, default=["pgd"], help="Comma separated modes (-m), default pgd")
+    parser.add_argument("--iterations", type=int, default=10, help="Runs per matrix point, default 10")
+    parser.add_argument("--count", type=int, default=587199960, help="Requests per run (-n)")
+    parser.add_argument("--prefix", default="bn-db-cast", help="Key prefix (-pr), size and run id are appended")
+    parser.add_argument("--output-dir", default="bench-results", help="Directory of run logs and results.jsonl")
+    parser.add_argument("--cooldown", type=float, default=0, help="Seconds to sleep between runs")
+    parser.add_argument("--dry-run", action="store_true", help="Print the bench commands without running them")
+    parser.add_argument("--save-as", metavar="NAME",
+                        help="Also save the runs as result set NAME of bench_store.py, e.g. baseline")
+    parser.add_argument("--store", default="bench-store", help="Result store directory of --save-as")
+    parser.add_argument("--summary", metavar="RESULTS",
+                        help="Only print the summary table of an existing results.jsonl")
+
+    argv = sys.argv[1:]
+    extra: List[str] = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+    args.extra = extra
+
+    if args.summary:
+        try:
+            with open(args.summary, "r") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            print(f"Error: failed to read {args.summary}: {e}")
+            sys.exit(1)
+        BenchSummary.print_table(records)
+        return
+
+    runner = BenchRunner(args)
+    records = runner.run()
+    if args.dry_run:
+        return
+    print("========================================")
+    print(f"Completed {len(records)} runs, results appended to {runner.results_file}")
+    BenchSummary.print_table(records)
+    if args.save_as:
+        import bench_store
+        runs = [bench_store.RunResult.from_bench_record(record) for record in records if record["exit_code"] == 0]
+        bench_store.ResultStore(args.store).save(args.save_as, runs, append=True)
+        print(f"Saved {len(runs)} runs as result set {args.save_as} in {args.store}")
+    if runner.stopped:
+        sys.exit(130)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Analyze bio traces printed by systemtap/show_bio_info.stp.
+
+Traces are parsed in chunks into NumPy arrays and folded into running totals, so memory stays flat however
+long the trace is. Reported: size histogram, read/write and sync/flush/fua mix, sequential ratio by offset
+continuity (per disk and per process), alignment to BLOBNODE_IO_ALIGN, per-process breakdown and, when lines
+carry the gettimeofday_us() prefix of the script, IOPS and throughput over time.
+"""
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+# bytes of lines read per chunk
+CHUNK_BYTES = 32 << 20
+# size histogram buckets are powers of two from 512B, the last one takes everything from 16MB up
+SIZE_BUCKETS = 16
+LINE_PATTERN = re.compile(
+    r"^\s*(?:(\d+)\s+)?\[(.*):(\d+):\d+\]\s+submit bio : disk=(\S+)\s+rw=(\w+)\s+sync=(\w+)\s+flush=(\w+)\s+"
+    r"fua=(\w+)\s+offset=(\d+)\s+size=(\d+)")
+
+# show_bio_info() prints fixed width fields, so they sit at fixed positions before the end of every line:
+# "disk=%-8s rw=%-6s sync=%-4s flush=%-4s fua=%-4s offset=%-20lu size=%-8u cnt=%-3d"
+TAIL_LENGTH = 103
+TAIL_MARKERS = ((-13, b"submit bio : "), (0, b"disk="), (13, b" rw="), (23, b" sync="), (33, b" flush="),
+                (44, b" fua="), (53, b" offset="), (81, b" size="), (95, b" cnt="))
+# "[comm:pid:cpu]" with the optional timestamp before it, comm is at most 15 bytes
+HEAD_LENGTH = 64
+
+def gather(buf, starts, width):
+    """Rows of width bytes of buf from every start, buf is padded so no row runs past it"""
+    return buf[starts[:, None] + np.arange(width, dtype=starts.dtype)]
+
+def parse_fields(rows):
+    """Left aligned numbers of rows of field bytes, anything after the digits is ignored"""
+    rows = np.where((rows >= 48) & (rows <= 57), rows, 32)
+    # a field is a number until its first non digit, digits after that belong to no field
+    rows[np.cumsum(rows == 32, axis=1) > 0] = 32
+    padded = np.hstack([rows, np.full((len(rows), 1), 32, dtype=np.uint8)])
+    return np.fromstring(padded.tobytes(), dtype=np.int64, sep=" ")
+
+def parse_chunk_fast(data):
+    """
+    Parse the lines of data by byte positions, return the columns of the lines in the fixed layout and the
+    other lines with their line numbers for parse_chunk_slow
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == 10)
+    buf = np.concatenate([buf, np.full(HEAD_LENGTH, 32, dtype=np.uint8)])
+    ends = ends.astype(np.int32 if len(buf) < 2 ** 31 else np.int64)
+    starts = np.empty(len(ends), dtype=ends.dtype)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    tails = ends - TAIL_LENGTH
+    valid = tails - 13 >= starts
+    for offset, marker in TAIL_MARKERS:
+        field = gather(buf, np.maximum(tails + offset, 0), len(marker))
+        valid &= (field == np.frombuffer(marker, dtype=np.uint8)).all(axis=1)
+    head = gather(buf, starts, HEAD_LENGTH)
+    column = np.arange(HEAD_LENGTH)
+    head[column >= (tails - 13 - starts)[:, None]] = 32
+    left = np.argmax(head == ord("["), axis=1)
+    right = HEAD_LENGTH - 1 - np.argmax(head[:, ::-1] == ord("]"), axis=1)
+    valid &= (head[np.arange(len(head)), left] == ord("[")) & (head[np.arange(len(head)), right] == ord("]"))
+
+    others = [(line, data[start:end].decode("utf-8", "replace"))
+              for line, start, end in zip(np.flatnonzero(~valid).tolist(), starts[~valid], ends[~valid])]
+    lines = np.flatnonzero(valid)
+    starts, tails, head, left, right = starts[valid], tails[valid], head[valid], left[valid], right[valid]
+    if len(starts) == 0:
+        return None, others
+    timed = (head[:, 0] >= 48) & (head[:, 0] <= 57)
+    times = np.full(len(starts), -1, dtype=np.int64)
+    if timed.any():
+        times[timed] = parse_fields(head[timed, :20])
+    process = np.where((column >= left[:, None]) & (column <= right[:, None]), head, 0)
+    columns = {
+        "line": lines,
+        "time": times,
+        "process": np.ascontiguousarray(process).view(f"S{HEAD_LENGTH}").ravel(),
+        "disk": gather(buf, tails + 5, 8).view("S8").ravel(),
+        "write": buf[tails + 17] == ord("w"),
+        "sync": buf[tails + 29] == ord("y"),
+        "flush": buf[tails + 40] == ord("y"),
+        "fua": buf[tails + 49] == ord("y"),
+        "offset": parse_fields(gather(buf, tails + 61, 20)),
+        "size": parse_fields(gather(buf, tails + 87, 8)),
+    }
+    return columns, others
+
+def parse_chunk_slow(lines):
+    """
+    Parse (line number, line) pairs one by one, for lines that don't fit the fixed layout such as disk names
+    over 8 bytes
+    """
+    matches = [(line, LINE_PATTERN.match(text)) for line, text in lines]
+    numbers = [line for line, m in matches if m]
+    rows = [m.groups() for _, m in matches if m]
+    if not rows:
+        return None
+    return {
+        "line": np.array(numbers, dtype=np.int64),
+        "time": np.array([row[0] or -1 for row in rows], dtype=np.int64),
+        "process": np.array([f"[{row[1]}:{row[2]}:0]".encode() for row in rows]),
+        "disk": np.array([row[3].encode() for row in rows]),
+        "write": np.array([row[4] == "write" for row in rows]),
+        "sync": np.array([row[5] == "yes" for row in rows]),
+        "flush": np.array([row[6] == "yes" for row in rows]),
+        "fua": np.array([row[7] == "yes" for row in rows]),
+        "offset": np.array([row[8] for row in rows], dtype=np.int64),
+        "size": np.array([row[9] for row in rows], dtype=np.int64),
+    }
+
+def merge_chunk(fast, slow):
+    """Columns of both parsers in line order, sequential detection compares offsets in trace order"""
+    if fast is None or slow is None:
+        return fast if slow is None else slow
+    order = np.argsort(np.concatenate([fast["line"], slow["line"]]), kind="stable")
+    return {name: np.concatenate([fast[name], slow[name]])[order] for name in fast}
+
+def iter_chunks(f):
+    """Yield about CHUNK_BYTES of whole lines at a time"""
+    rest = b""
+    while True:
+        data = f.read(CHUNK_BYTES)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind(b"\n") + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+    if rest:
+        yield rest + b"\n"
+
+class Registry:
+    """Stable ids of names across chunks, with one carried value per id"""
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.last_end = np.full(0, -1, dtype=np.int64)
+
+    def map(self, values, name_of):
+        """Global id of every element of the string array values, names derived from the distinct values"""
+        distinct, inverse = np.unique(values, return_inverse=True)
+        lookup = np.empty(len(distinct), dtype=np.int64)
+        for i, value in enumerate(distinct):
+            name = name_of(value)
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+            lookup[i] = self.ids[name]
+        if len(self.last_end) < len(self.names):
+            grown = np.full(len(self.names), -1, dtype=np.int64)
+            grown[:len(self.last_end)] = self.last_end
+            self.last_end = grown
+        return lookup[inverse.reshape(-1)]
+
+    def sequential(self, ids, offsets, ends):
+        """
+        Whether every bio starts where the previous bio of the same id ended, continuing from the previous
+        chunk through last_end
+        """
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        previous_end = np.empty(len(ids), dtype=np.int64)
+        previous_end[1:] = ends[order][:-1]
+        group_start = np.ones(len(ids), dtype=bool)
+        group_start[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        previous_end[group_start] = self.last_end[sorted_ids[group_start]]
+        sequential = np.empty(len(ids), dtype=bool)
+        sequential[order] = offsets[order] == previous_end
+        group_end = np.ones(len(ids), dtype=bool)
+        group_end[:-1] = sorted_ids[1:] != sorted_ids[:-1]
+        self.last_end[sorted_ids[group_end]] = ends[order][group_end]
+        return sequential
+
+def process_name(token):
+    """comm:pid of a "[comm:pid:cpu]" token, the same thread on any cpu is one process"""
+    return token.strip(b"\x00")[1:-1].rsplit(b":", 1)[0].decode("utf-8", "replace")
+
+class BioStats:
+    # per process: bios, writes, bytes, bios with data, sequential, aligned
+    PROCESS_FIELDS = 6
+
+    def __init__(self, align, interval):
+        self.align = align
+        self.interval = interval
+        self.disks = Registry()
+        self.processes = Registry()
+        self.bios = 0
+        self.slow_bios = 0
+        # [write][bucket], bucket 0 is empty bios such as pure flushes
+        self.sizes = np.zeros((2, SIZE_BUCKETS + 1), dtype=np.int64)
+        self.bytes = np.zeros(2, dtype=np.int64)
+        # [write][sync * 4 + flush * 2 + fua]
+        self.flags = np.zeros((2, 8), dtype=np.int64)
+        self.sequential = np.zeros(2, dtype=np.int64)
+        # [write][offset aligned, size aligned, both]
+        self.aligned = np.zeros((2, 3), dtype=np.int64)
+        self.per_process = np.zeros((0, self.PROCESS_FIELDS), dtype=np.int64)
+        self.first_time = None
+        self.last_time = None
+        self.timeline_iops = np.zeros(0, dtype=np.int64)
+        self.timeline_bytes = np.zeros(0, dtype=np.int64)
+        self.untimed = 0
+
+    def add(self, columns):
+        write = columns["write"].astype(np.int64)
+        offset, size = columns["offset"], columns["size"]
+        count = len(size)
+        self.bios += count
+
+        buckets = np.zeros(count, dtype=np.int64)
+        nonzero = size > 0
+        buckets[nonzero] = np.clip(np.ceil(np.log2(np.maximum(size[nonzero], 512) / 512)).astype(np.int64) + 1,
+                                   1, SIZE_BUCKETS)
+        self.sizes += np.bincount(write * (SIZE_BUCKETS + 1) + buckets,
+                                  minlength=2 * (SIZE_BUCKETS + 1)).reshape(2, -1)
+        self.bytes += np.bincount(write, weights=size, minlength=2).astype(np.int64)
+        flag_index = columns["sync"] * 4 + columns["flush"] * 2 + columns["fua"]
+        self.flags += np.bincount(write * 8 + flag_index, minlength=16).reshape(2, -1)
+
+        # empty bios such as pure flushes carry no data position, they neither continue nor break a stream
+        data = np.flatnonzero(nonzero)
+        offset_data, ends_data = offset[data], offset[data] + size[data]
+        disk_ids = self.disks.map(columns["disk"], lambda name: name.strip().decode("utf-8", "replace"))
+        disk_sequential = np.zeros(count, dtype=bool)
+        disk_sequential[data] = self.disks.sequential(disk_ids[data], offset_data, ends_data)
+        self.sequential += np.bincount(write, weights=disk_sequential, minlength=2).astype(np.int64)
+
+        offset_aligned = offset % self.align == 0
+        size_aligned = size % self.align == 0
+        both = offset_aligned & size_aligned
+        for i, values in enumerate((offset_aligned, size_aligned, both)):
+            self.aligned[:, i] += np.bincount(write, weights=values & nonzero, minlength=2).astype(np.int64)
+
+        process_ids = self.processes.map(columns["process"], process_name)
+        process_sequential = np.zeros(count, dtype=bool)
+        process_sequential[data] = self.processes.sequential(process_ids[data], offset_data, ends_data)
+        if len(self.per_process) < len(self.processes.names):
+            grown = np.zeros((len(self.processes.names), self.PROCESS_FIELDS), dtype=np.int64)
+            grown[:len(self.per_process)] = self.per_process
+            self.per_process = grown
+        length = len(self.per_process)
+        for field, weights in enumerate((None, write, size, nonzero, process_sequential, both & nonzero)):
+            self.per_process[:, field] += np.bincount(process_ids, weights=weights, minlength=length).astype(np.int64)
+
+        times = columns["time"][columns["time"] >= 0]
+        self.untimed += count - len(times)
+        if len(times) == 0:
+            return
+        if self.first_time is None:
+            self.first_time = int(times.min())
+        self.last_time = max(self.last_time or 0, int(times.max()))
+        slots = np.maximum(times - self.first_time, 0) // int(self.interval * 1e6)
+        length = max(len(self.timeline_iops), int(slots.max()) + 1)
+        self.timeline_iops = np.pad(self.timeline_iops, (0, length - len(self.timeline_iops)))
+        self.timeline_bytes = np.pad(self.timeline_bytes, (0, length - len(self.timeline_bytes)))
+        self.timeline_iops += np.bincount(slots, minlength=length)
+        self.timeline_bytes += np.bincount(slots, weights=size[columns["time"] >= 0], minlength=length).astype(np.int64)
+
+def percent(part, whole):
+    return f"{part * 100 / whole:.1f}%" if whole else "-"
+
+def human_size(size):
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.0f}T"
+
+def print_table(rows):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for n, row in enumerate(rows):
+        print("  " + "  ".join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                               for i, (cell, width) in enumerate(zip(row, widths))))
+        if n == 0:
+            print("  " + "  ".join("-" * width for width in widths))
+
+def print_report(stats, top):
+    reads, writes = stats.sizes.sum(axis=1)
+    print(f"bios: {stats.bios} (read {reads}, write {writes}), bytes: read {human_size(stats.bytes[0])}, "
+          f"write {human_size(stats.bytes[1])}, disks: {', '.join(stats.disks.names)}")
+    if stats.slow_bios:
+        print(f"({stats.slow_bios} bios not in the fixed layout were parsed line by line)")
+
+    print("\nsize histogram:")
+    rows = [["size", "read", "read%", "write", "write%"]]
+    for bucket in range(SIZE_BUCKETS + 1):
+        if not stats.sizes[:, bucket].any():
+            continue
+        if bucket == 0:
+            label = "0 (flush)"
+        elif bucket == 1:
+            label = "<=512B"
+        elif bucket == SIZE_BUCKETS:
+            label = f">{human_size(512 << (bucket - 2))}"
+        else:
+            label = f"<={human_size(512 << (bucket - 1))}"
+        rows.append([label, str(stats.sizes[0, bucket]), percent(stats.sizes[0, bucket], reads),
+                     str(stats.sizes[1, bucket]), percent(stats.sizes[1, bucket], writes)])
+    print_table(rows)
+
+    print("\nflags:")
+    rows = [["", "bios", "sync", "flush", "fua", "sequential", f"offset%{stats.align}", f"size%{stats.align}", "aligned"]]
+    for write, name in ((0, "read"), (1, "write")):
+        total = stats.flags[write].sum()
+        nonempty = total - stats.sizes[write, 0]
+        flags = stats.flags[write]
+        rows.append([name, str(total), percent(flags[4:].sum(), total), percent(flags[[2, 3, 6, 7]].sum(), total),
+                     percent(flags[1::2].sum(), total), percent(stats.sequential[write], nonempty),
+                     *(percent(stats.aligned[write, i], nonempty) for i in range(3))])
+    print_table(rows)
+
+    print(f"\nprocesses (top {top} by bios):")
+    rows = [["process", "bios", "write%", "bytes", "avg_size", "sequential", "aligned"]]
+    for index in np.argsort(-stats.per_process[:, 0], kind="stable")[:top]:
+        bios, writes, size, nonempty, sequential, aligned = stats.per_process[index]
+        rows.append([stats.processes.names[index], str(bios), percent(writes, bios), human_size(size),
+                     human_size(size / nonempty) if nonempty else "-", percent(sequential, nonempty),
+                     percent(aligned, nonempty)])
+    print_table(rows)
+
+    if stats.first_time is None:
+        print("\nno timestamps, prefix trace lines with gettimeofday_us() for IOPS and throughput over time")
+        return
+    span = (stats.last_time - stats.first_time) / 1e6
+    iops = stats.timeline_iops / stats.interval
+    throughput = stats.timeline_bytes / stats.interval
+    print(f"\nover time ({span:.1f}s in {len(iops)} slots of {stats.interval}s"
+          + (f", {stats.untimed} bios without timestamp" if stats.untimed else "") + "):")
+    rows = [["", "avg", "p50", "p99", "max"]]
+    rows.append(["iops", f"{stats.bios / span if span else 0:.0f}",
+                 *(f"{np.percentile(iops, q):.0f}" for q in (50, 99)), f"{iops.max():.0f}"])
+    rows.append(["throughput", f"{human_size(sum(stats.bytes) / span) if span else '-'}/s",
+                 *(f"{human_size(np.percentile(throughput, q))}/s" for q in (50, 99)),
+                 f"{human_size(throughput.max())}/s"])
+    print_table(rows)
+
+def write_timeline(stats, path):
+    with open(path, "w") as f:
+        f.write("time_us,bios,bytes,iops,bytes_per_sec\n")
+        for slot, (bios, size) in enumerate(zip(stats.timeline_iops, stats.timeline_bytes)):
+            start = stats.first_time + int(slot * stats.interval * 1e6)
+            f.write(f"{start},{bios},{size},{bios / stats.interval:.1f},{size / stats.interval:.0f}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a bio trace of systemtap/show_bio_info.stp")
+    parser.add_argument("trace", nargs="?", default="-", help="Trace file, - for stdin (default)")
+    parser.add_argument("--align", type=int, default=int(os.environ.get("BLOBNODE_IO_ALIGN", "4096")),
+                        help="Alignment checked for offsets and sizes (default BLOBNODE_IO_ALIGN or 4096)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds per IOPS/throughput slot")
+    parser.add_argument("--top", type=int, default=10, help="Processes shown, most bios first")
+    parser.add_argument("--timeline", type=str, help="Write IOPS and throughput per --interval to this csv file")
+    args = parser.parse_args()
+    if args.align <= 0 or args.interval <= 0:
+        print("Error: --align and --interval must be positive")
+        sys.exit(1)
+
+    stats = BioStats(args.align, args.interval)
+    try:
+        f = sys.stdin.buffer if args.trace == "-" else open(args.trace, "rb")
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    with f:
+        for data in iter_chunks(f):
+            columns, others = parse_chunk_fast(data)
+            slow = parse_chunk_slow(others)
+            if slow is not None:
+                stats.slow_bios += len(slow["size"])
+            columns = merge_chunk(columns, slow)
+            if columns is not None:
+                stats.add(columns)
+    if stats.bios == 0:
+        print("Error: no \"submit bio\" lines found")
+        sys.exit(1)
+    print_report(stats, args.top)
+    if args.timeline and stats.first_time is not None:
+        write_timeline(stats, args.timeline)
+        print(f"\ntimeline written to {args.timeline}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import argparse
 import math
+import sys
 from datetime import datetime
 
+# bytes of lines read per chunk in batch mode
+CHUNK_BYTES = 16 << 20
+UNITS = (("seconds", 1), ("minutes", 60), ("hours", 3600), ("days", 24 * 3600))
+PERCENTILES = (("min", 0), ("p50", 50), ("p99", 99), ("max", 100))
+
 def ceil_to_2_decimal(x):
     """Round up the number to 2 decimal places (ceiling at the 3rd decimal digit)."""
     return math.ceil(x * 100) / 100.0
@@ -37,6 +43,107 @@ def calculate_time_difference(date_str1, date_str2):
         "total_days": total_days,
     }
 
+def ceil_to_2_decimal_array(x):
+    """Vectorized ceil_to_2_decimal, same float operations so results match row by row."""
+    import numpy as np
+    return np.ceil(x * 100) / 100.0
+
+def parse_pairs(lines):
+    """
+    Parse lines of "YYYY-MM-DD HH:MM:SS YYYY-MM-DD HH:MM:SS" (comma or whitespace separated) into two
+    datetime64[s] arrays. Returns (start, end, valid lines, skipped count).
+    """
+    import numpy as np
+    stamps = []
+    kept = []
+    for line in lines:
+        tokens = line.replace(",", " ").split()
+        # same strictness as strptime: full date and full clock, no fractions or timezones
+        if len(tokens) != 4 or len(tokens[0]) != 10 or len(tokens[1]) != 8 \
+                or len(tokens[2]) != 10 or len(tokens[3]) != 8:
+            continue
+        stamps.append(tokens[0] + "T" + tokens[1])
+        stamps.append(tokens[2] + "T" + tokens[3])
+        kept.append(line)
+    try:
+        parsed = np.array(stamps, dtype="datetime64[s]")
+    except ValueError:
+        # a bad value somewhere in the chunk, find it pair by pair
+        parsed = []
+        good = []
+        for i, line in enumerate(kept):
+            try:
+                pair = np.array(stamps[2 * i:2 * i + 2], dtype="datetime64[s]")
+            except ValueError:
+                continue
+            parsed.extend(pair)
+            good.append(line)
+        kept = good
+        parsed = np.array(parsed, dtype="datetime64[s]")
+    return parsed[0::2], parsed[1::2], kept, len(lines) - len(kept)
+
+def calculate_time_differences(start, end):
+    """Vectorized calculate_time_difference over datetime64[s] arrays, values rounded up to 2 decimals."""
+    import numpy as np
+    seconds = np.abs((end - start).astype(np.int64)).astype(np.float64)
+    return {f"total_{unit}": ceil_to_2_decimal_array(seconds / scale) for unit, scale in UNITS}
+
+def nearest_rank(sorted_values, percentile):
+    """Nearest-rank percentile, always one of the values so it keeps the round-up rule."""
+    if percentile <= 0:
+        return sorted_values[0]
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def iter_chunks(f):
+    while True:
+        lines = [line for line in f.readlines(CHUNK_BYTES) if line.strip() and not line.startswith("#")]
+        if not lines:
+            break
+        yield lines
+
+def run_batch(path, rows):
+    """Compute intervals of every pair in path ("-" for stdin) and print their distribution."""
+    try:
+        import numpy as np
+    except ImportError:
+        print("Error: numpy library is not installed")
+        print("Please install it using: pip install numpy")
+        sys.exit(1)
+
+    f = sys.stdin if path == "-" else open(path, "r")
+    chunks = []
+    skipped = 0
+    try:
+        if rows:
+            print("date1,date2,total_seconds,total_minutes,total_hours,total_days")
+        for lines in iter_chunks(f):
+            start, end, kept, bad = parse_pairs(lines)
+            skipped += bad
+            # exact seconds are kept, every unit is derived from them again for the summary
+            chunks.append(np.abs((end - start).astype(np.int64)))
+            if rows and len(kept):
+                result = calculate_time_differences(start, end)
+                columns = [np.char.mod("%.2f", result[f"total_{unit}"]) for unit, _ in UNITS]
+                out = [f"{s},{e},{','.join(values)}" for s, e, *values in
+                       zip(np.datetime_as_string(start).tolist(), np.datetime_as_string(end).tolist(),
+                           *(column.tolist() for column in columns))]
+                sys.stdout.write("\n".join(out).replace("T", " ") + "\n")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    seconds = np.sort(np.concatenate(chunks)) if chunks else np.array([], dtype=np.int64)
+    out = sys.stderr if rows else sys.stdout
+    print(f"Pairs: {len(seconds)}, skipped lines: {skipped}", file=out)
+    if len(seconds) == 0:
+        return
+    summary = np.array([nearest_rank(seconds, p) for _, p in PERCENTILES], dtype=np.float64)
+    print(f"{'':15}" + "".join(f"{name:>12}" for name, _ in PERCENTILES), file=out)
+    for unit, scale in UNITS:
+        values = ceil_to_2_decimal_array(summary / scale)
+        print(f"{'Total ' + unit + ':':15}" + "".join(f"{format_two_decimal(v):>12}" for v in values), file=out)
+
 def format_two_decimal(value):
     """Format a number to always show exactly 2 decimal places (e.g., 5 → '5.00')."""
     return f"{value:.2f}"
@@ -46,10 +153,19 @@ def main():
         description="Calculate time interval between two datetimes (format: 'YYYY-MM-DD HH:MM:SS'), "
                     "with results rounded up to 2 decimal places."
     )
-    parser.add_argument("date1", help="First datetime, e.g., '2025-11-10 19:01:57'")
-    parser.add_argument("date2", help="Second datetime, e.g., '2025-11-11 14:22:00'")
+    parser.add_argument("date1", nargs="?", help="First datetime, e.g., '2025-11-10 19:01:57'")
+    parser.add_argument("date2", nargs="?", help="Second datetime, e.g., '2025-11-11 14:22:00'")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Read one pair per line from FILE ('-' for stdin) and print min/p50/p99/max")
+    parser.add_argument("--rows", action="store_true",
+                        help="In batch mode also print every pair as csv, the summary goes to stderr")
 
     args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.rows)
+        return
+    if args.date1 is None or args.date2 is None:
+        parser.error("date1 and date2 are required unless --batch is given")
 
     try:
         result = calculate_time_difference(args.date1, args.date2)
@@ -1,19 +1,239 @@
-import matplotlib.pyplot as plt
+#!/usr/bin/env python3
+"""
+Plot monitor.log written by shell/monitor_k8s_pod.sh (or the csv of monitor_pod.py) over long periods.
+
+Logs are parsed in chunks into NumPy arrays, every series is downsampled to a fixed number of points
+before drawing, and the figure is rendered headlessly with the Agg backend to PNG/SVG.
+"""
+import argparse
+import fnmatch
+import sys
+
 import numpy as np
 
-# 生成模拟数据 (模仿原图趋势)
-x = np.linspace(0, 1400, 20)
-y = 1000 + 1.5 * x + np.random.normal(0, 50, 20)
-
-# 绘图设置 (复刻原图风格)
-plt.figure(figsize=(8, 6))
-plt.plot(x, y, color='purple', marker='o', linestyle='-')
-plt.title('RSS Memory Usage Over Time (in MB)')
-plt.xlabel('Time (minutes)')
-plt.ylabel('Memory Usage (MB)')
-plt.grid(True, linestyle='--', alpha=0.7)
-plt.xlim(0, 1600)
-plt.ylim(500, 3500)
-
-# 直接展示 (macOS 会弹出带工具栏的窗口)
-plt.show()
+# bytes of lines read per chunk
+CHUNK_BYTES = 64 << 20
+DEFAULT_SERIES = "BLOBNODE_VmRSS,CG_Usage,SYS_Ext4_Slab"
+
+def parse_layout(tokens):
+    """
+    Column layout of a monitor.log line split by whitespace, as (name, token index, inline) tuples.
+    Values follow their "KEY:" token, except inline ones such as "disk_err:0".
+    """
+    layout = []
+    i = 2
+    while i < len(tokens):
+        token = tokens[i]
+        if token.endswith(":") and i + 1 < len(tokens):
+            layout.append((token[:-1], i + 1, False))
+            i += 2
+        else:
+            name, _, _ = token.partition(":")
+            layout.append((name, i, True))
+            i += 1
+    return layout
+
+def parse_numbers(tokens):
+    """Parse a list of numeric strings in one C call, much faster than building a string array"""
+    return np.fromstring(" ".join(tokens), dtype=np.float64, sep=" ")
+
+def parse_times(dates, times):
+    """Turn "[YYYY-MM-DD" and "HH:MM:SS]" tokens into datetime64[s], dates repeat so they are parsed once each"""
+    days = {}
+    for date in set(dates):
+        days[date] = np.datetime64(date.lstrip("["), "D").astype(np.int64)
+    seconds = np.fromiter((days[date] for date in dates), dtype=np.int64, count=len(dates)) * 86400
+    clock = parse_numbers([t.rstrip("]").replace(":", " ") for t in times]).astype(np.int64).reshape(-1, 3)
+    seconds += clock[:, 0] * 3600 + clock[:, 1] * 60 + clock[:, 2]
+    return seconds.astype("datetime64[s]")
+
+def parse_chunk_fast(lines, layout, width):
+    """Parse lines sharing one layout column by column, None if the lines don't fit it"""
+    tokens = " ".join(lines).split()
+    if len(tokens) != len(lines) * width:
+        return None
+    for name, index, inline in layout:
+        if not inline and tokens[index - 1::width].count(name + ":") != len(lines):
+            return None
+    columns = {"time": parse_times(tokens[0::width], tokens[1::width])}
+    for name, index, inline in layout:
+        values = tokens[index::width]
+        if inline:
+            values = [value.partition(":")[2] for value in values]
+        columns[name] = parse_numbers(values)
+        if len(columns[name]) != len(lines):
+            return None
+    return columns
+
+def parse_chunk_slow(lines, names):
+    """Parse lines one by one, for lines that don't share the layout of their neighbours"""
+    stamps = []
+    values = {}
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 2:
+            continue
+        stamps.append(tokens[0].lstrip("[") + "T" + tokens[1].rstrip("]"))
+        for name, index, inline in parse_layout(tokens):
+            value = tokens[index].partition(":")[2] if inline else tokens[index]
+            if name not in values:
+                names.append(name)
+                values[name] = np.full(len(lines), np.nan)
+            try:
+                values[name][len(stamps) - 1] = float(value)
+            except ValueError:
+                pass
+    columns = {"time": np.array(stamps, dtype="datetime64[s]")}
+    for name, column in values.items():
+        columns[name] = column[:len(stamps)]
+    return columns
+
+def parse_lines(lines, names):
+    """Parse runs of lines with the same number of fields at once, the layout only changes when disks do"""
+    signatures = np.fromiter((line.count(":") for line in lines), dtype=np.int64, count=len(lines))
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(signatures)) + 1, [len(lines)]])
+    chunks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        run = lines[start:end]
+        tokens = run[0].split()
+        columns = parse_chunk_fast(run, parse_layout(tokens), len(tokens))
+        if columns is None:
+            columns = parse_chunk_slow(run, names)
+        for name in columns:
+            if name != "time" and name not in names:
+                names.append(name)
+        chunks.append(columns)
+    return chunks
+
+def read_monitor_log(path):
+    """Return {"time": datetime64 array, column: float64 array} of a whole monitor.log"""
+    chunks = []
+    names = []
+    with open(path, "r") as f:
+        while True:
+            lines = [line for line in f.readlines(CHUNK_BYTES) if line.strip()]
+            if not lines:
+                break
+            chunks.extend(parse_lines(lines, names))
+    return concat_chunks(chunks, names)
+
+def read_monitor_csv(path):
+    """Return columns of the csv written by cubefs/playground/monitor_pod.py"""
+    with open(path, "r") as f:
+        names = f.readline().strip().split(",")
+    chunks = []
+    with open(path, "r") as f:
+        f.readline()
+        while True:
+            lines = [line for line in f.readlines(CHUNK_BYTES) if line.strip()]
+            if not lines:
+                break
+            table = np.array(",".join(line.strip() for line in lines).split(","), dtype=np.float64)
+            table = table.reshape(len(lines), len(names))
+            columns = {"time": (table[:, 0] * 1000).astype("datetime64[ms]").astype("datetime64[s]")}
+            for i, name in enumerate(names[1:], start=1):
+                columns[name] = table[:, i]
+            chunks.append(columns)
+    return concat_chunks(chunks, names[1:])
+
+def concat_chunks(chunks, names):
+    if not chunks:
+        return {"time": np.array([], dtype="datetime64[s]")}
+    columns = {"time": np.concatenate([chunk["time"] for chunk in chunks])}
+    for name in names:
+        columns[name] = np.concatenate([chunk.get(name, np.full(len(chunk["time"]), np.nan)) for chunk in chunks])
+    return columns
+
+def downsample_minmax(x, y, points):
+    """Keep the min and max of each of points/2 buckets in time order, so spikes survive downsampling"""
+    if len(x) <= points:
+        return x, y
+    edges = np.linspace(0, len(x), max(1, points // 2) + 1).astype(np.int64)
+    keep = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        if end <= start or np.all(np.isnan(bucket)):
+            continue
+        low, high = start + np.nanargmin(bucket), start + np.nanargmax(bucket)
+        keep.extend((low, high) if low <= high else (high, low))
+    keep = np.unique(np.array(keep, dtype=np.int64))
+    return x[keep], y[keep]
+
+def downsample_lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets, keeps the visual shape of the series with points points"""
+    n = len(x)
+    if n <= points or points < 3:
+        return x, y
+    xf = x.astype("datetime64[s]").astype(np.float64)
+    yf = np.nan_to_num(y)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[next_start:next_end].mean()
+        avg_y = yf[next_start:next_end].mean()
+        area = np.abs((xf[a] - avg_x) * (yf[start:end] - yf[a]) - (xf[a] - xf[start:end]) * (avg_y - yf[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+def select_series(columns, patterns):
+    names = [name for name in columns if name != "time"]
+    selected = []
+    for pattern in patterns:
+        for name in fnmatch.filter(names, pattern):
+            if name not in selected:
+                selected.append(name)
+    return selected
+
+def plot(columns, series, output, points, method, title):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    downsample = {"minmax": downsample_minmax, "lttb": downsample_lttb}.get(method)
+    fig, axes = plt.subplots(len(series), 1, figsize=(12, 2.6 * len(series)), sharex=True, squeeze=False)
+    for ax, name in zip(axes[:, 0], series):
+        x, y = columns["time"], columns[name]
+        if downsample is not None:
+            x, y = downsample(x, y, points)
+        # cpu columns are percentages, all the others are KB shown in MB
+        is_cpu = "cpu" in name.lower()
+        ax.plot(x, y if is_cpu else y / 1024, linewidth=0.8)
+        ax.set_ylabel(f"{name} ({'%' if is_cpu else 'MB'})")
+        ax.grid(True, linestyle="--", alpha=0.7)
+    axes[0, 0].set_title(title)
+    axes[-1, 0].set_xlabel("Time")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(output)
+    plt.close(fig)
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot monitor.log of the blobnode pod to PNG/SVG")
+    parser.add_argument("logfile", help="monitor.log of monitor_k8s_pod.sh, or csv of monitor_pod.py")
+    parser.add_argument("-o", "--output", default="monitor.png", help="Output image, format by suffix (png/svg)")
+    parser.add_argument("--series", default=DEFAULT_SERIES,
+                        help=f"Comma separated columns to plot, shell patterns allowed (default {DEFAULT_SERIES})")
+    parser.add_argument("--points", type=int, default=2000, help="Points drawn per series after downsampling")
+    parser.add_argument("--downsample", default="minmax", choices=["minmax", "lttb", "none"],
+                        help="Downsampling method, minmax keeps spikes and lttb keeps the shape")
+    parser.add_argument("--title", default="Blobnode Memory Usage Over Time", help="Figure title")
+    args = parser.parse_args()
+
+    with open(args.logfile, "r") as f:
+        is_csv = f.readline().startswith("timestamp,")
+    columns = read_monitor_csv(args.logfile) if is_csv else read_monitor_log(args.logfile)
+    series = select_series(columns, [pattern.strip() for pattern in args.series.split(",") if pattern.strip()])
+    if len(columns["time"]) == 0 or not series:
+        available = ", ".join(name for name in columns if name != "time")
+        sys.exit(f"Error: nothing to plot, available columns: {available}")
+
+    plot(columns, series, args.output, args.points, args.downsample, args.title)
+    print(f"Plotted {len(series)} series of {len(columns['time'])} samples to {args.output}")
+
+if __name__ == "__main__":
+    main()